@@ -0,0 +1,100 @@
+"""
+Per-run index of Recurly account notes for expire_subscriptions.py.
+
+The script adds at most one note per account per day, so for every row with an
+account_note it must know whether the account already has a note created on the
+run date. Paging through an account's whole note history for that (on every row
+of the account) is O(notes) calls; AccountNoteIndex instead keeps, per account,
+the newest note timestamp and the messages created on run_date:
+
+  - it is filled with one listing per account, which stops at the first note
+    older than run_date (Recurly lists notes newest first; if a page turns out
+    not to be in that order the scan simply reads to the end);
+  - a successful create_account_note is recorded locally, so later rows of the
+    same account need no further calls.
+"""
+
+from __future__ import annotations
+
+import threading
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def _note_time(note: Any) -> Optional[datetime]:
+    """Note created_at as a datetime (recurly resources carry datetimes, the async client ISO strings)."""
+    created = getattr(note, "created_at", None)
+    if not created:
+        return None
+    if isinstance(created, datetime):
+        return created
+    try:
+        return datetime.fromisoformat(str(created).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+class _NoteScan:
+    """Consumes a newest-first note listing and says when the rest cannot be from run_date."""
+
+    def __init__(self, run_date: date) -> None:
+        self.run_date = run_date
+        self.newest: Optional[datetime] = None
+        self.today: List[str] = []
+        self._previous: Optional[datetime] = None
+        self._newest_first = True
+
+    def feed(self, note: Any) -> bool:
+        """Index one note; False once every later note is older than run_date."""
+        created = _note_time(note)
+        if created is None:
+            return True
+        if self.newest is None or created > self.newest:
+            self.newest = created
+        if self._previous is not None and created > self._previous:
+            self._newest_first = False
+        self._previous = created
+        if created.date() == self.run_date:
+            self.today.append(getattr(note, "message", None) or "")
+        return not (self._newest_first and created.date() < self.run_date)
+
+
+class AccountNoteIndex:
+    """Newest note time and run_date note messages per account id (thread-safe)."""
+
+    def __init__(self, run_date: date) -> None:
+        self.run_date = run_date
+        self._entries: Dict[str, Tuple[Optional[datetime], List[str]]] = {}
+        self._lock = threading.Lock()
+        self.listings = 0
+
+    def notes_today(self, account_id: str) -> Optional[List[str]]:
+        """Messages of the account's notes created on run_date, or None if the account is not indexed."""
+        with self._lock:
+            entry = self._entries.get(account_id)
+            return list(entry[1]) if entry is not None else None
+
+    def _store(self, account_id: str, scan: _NoteScan) -> List[str]:
+        with self._lock:
+            self._entries[account_id] = (scan.newest, scan.today)
+            self.listings += 1
+        return list(scan.today)
+
+    def record_created(self, account_id: str, message: str, created: Optional[datetime] = None) -> None:
+        """Record a note this run just created (no re-listing needed for later rows)."""
+        created = created or datetime.now(timezone.utc)
+        with self._lock:
+            newest, today = self._entries.get(account_id, (None, []))
+            if newest is None or created > newest:
+                newest = created
+            self._entries[account_id] = (newest, today + [message])
+
+    def summary(self) -> str:
+        return f"accounts={len(self._entries)} listings={self.listings}"
+
+
+async def index_account_notes(api: Any, account_id: str, index: AccountNoteIndex) -> List[str]:
+    """List the account's notes (stopping before run_date), index them, and return today's messages."""
+    scan = _NoteScan(index.run_date)
+    await api.items("list_account_notes", account_id, stop=lambda note: not scan.feed(note))
+    return index._store(account_id, scan)
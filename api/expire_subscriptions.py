@@ -11,17 +11,37 @@ Authentication: Recurly expects the API key to be passed as the username in a
 Basic Authorization header (password empty). The official recurly-client-python
 library handles this when you pass the raw API key to recurly.Client(api_key).
 Do not pre-encode the key; the client sends it as Basic base64(api_key + ":").
+
+Before processing, a pre-flight pass looks up every subscription's state, every
+account's billing info and each subscription's eligible invoices (concurrently, through
+the invoice cache; re-listed after a row refunds), so rows only make the mutating calls that can still change
+something: already expired subscriptions are not terminated again and accounts
+without billing info are not cleared again. --plan-only prints the resulting
+call counts and exits; --no-preflight restores the old call-and-check behavior.
 """
 
 from __future__ import annotations
 
 import argparse
+import asyncio
 import csv
 import os
+import queue
 import sys
-from datetime import date, datetime
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+# Server-side invoice listing starts this many days before refund_dt (filtered on created_at),
+# so invoices created shortly before but billed on/after refund_dt are still returned.
+INVOICE_LOOKBACK_DAYS = 31
+
+# Rows dispatched but not yet yielded, per worker: a row stuck in a long 429 backoff stalls
+# the in-order output, and at most workers * this many finished rows wait behind it.
+ROWS_IN_FLIGHT_PER_WORKER = 8
 
 RECURLY_KEY_FILE = "/Users/gregory.hamilton/Desktop/Creds/recurly_us_sbx.txt"
 DEFAULT_INPUT_CSV = "/Users/gregory.hamilton/Downloads/expire_refund_script_test.csv"
@@ -54,6 +74,13 @@ try:
 except ImportError:
     recurly = None
 
+from account_notes import AccountNoteIndex, index_account_notes
+from invoice_cache import DEFAULT_CACHE_PATH, DEFAULT_TTL_HOURS, InvoiceCache, fetch_invoices
+from recurly_async import AsyncRecurlyClient
+from recurly_throttle import RateLimiter, throttle_client
+from recurly_transport import AsyncTransport, SyncTransport, run_sync
+from run_journal import RowJournal, RunJournal, journal_path_for
+
 
 def _refund_invoice_body() -> Dict[str, Any]:
     """
@@ -64,32 +91,55 @@ def _refund_invoice_body() -> Dict[str, Any]:
     return {"type": "percentage", "percentage": 100}
 
 
-def load_input(csv_path: Union[str, Path]) -> List[Dict[str, Any]]:
-    """Load CSV with columns account_cd, subscription_guid, refund_dt, account_note (optional: currency_cd)."""
+INPUT_COLUMNS = ("account_cd", "subscription_guid", "refund_dt", "account_note")
+
+
+def iter_input(csv_path: Union[str, Path]) -> Iterator[Dict[str, Any]]:
+    """
+    Stream CSV rows (account_cd, subscription_guid, refund_dt, account_note; optional: currency_cd).
+
+    The file is opened and the header validated before this returns, so a missing file or
+    column fails up front; rows are then read and normalized one at a time as the caller
+    consumes them.
+    """
     path = Path(csv_path)
     if not path.exists():
         raise FileNotFoundError(f"Input CSV not found: {path}")
     # utf-8-sig strips BOM (e.g. from Excel) so first column is "account_cd" not "\ufeffaccount_cd"
-    with open(path, newline="", encoding="utf-8-sig") as f:
+    f = open(path, newline="", encoding="utf-8-sig")
+    try:
         reader = csv.DictReader(f)
-        rows = list(reader)
-    if not rows:
-        return []
-    # Normalize header keys: strip BOM and whitespace so columns are found
-    for row in rows:
-        for k in list(row.keys()):
-            clean_key = k.strip().lstrip("\ufeff")
-            if clean_key != k:
-                row[clean_key] = row.pop(k)
-    for col in ("account_cd", "subscription_guid", "refund_dt", "account_note"):
-        if col not in rows[0]:
-            raise ValueError(f"CSV must have column: {col}")
-    # Normalize: treat None as empty string
-    for row in rows:
-        for k in list(row.keys()):
-            v = row[k]
-            row[k] = (str(v).strip() if v is not None and v != "" else "")
-    return rows
+        # Normalize header keys once: strip BOM and whitespace so columns are found
+        if reader.fieldnames:
+            reader.fieldnames = [k.strip().lstrip("\ufeff") for k in reader.fieldnames]
+        first = next(reader, None)
+        if first is None:
+            f.close()
+            return iter(())
+        for col in INPUT_COLUMNS:
+            if col not in first:
+                raise ValueError(f"CSV must have column: {col}")
+    except Exception:
+        f.close()
+        raise
+
+    def _rows() -> Iterator[Dict[str, Any]]:
+        with f:
+            row: Optional[Dict[str, Any]] = first
+            while row is not None:
+                # Normalize: treat None as empty string
+                yield {
+                    k: (str(v).strip() if v is not None and v != "" else "")
+                    for k, v in row.items()
+                }
+                row = next(reader, None)
+
+    return _rows()
+
+
+def load_input(csv_path: Union[str, Path]) -> List[Dict[str, Any]]:
+    """Load CSV with columns account_cd, subscription_guid, refund_dt, account_note (optional: currency_cd)."""
+    return list(iter_input(csv_path))
 
 
 def _subscription_id(value: str) -> str:
@@ -142,20 +192,27 @@ def _parse_refund_date(s: Optional[str]) -> Optional[date]:
     return None
 
 
-def _account_has_note_today(client: Any, acc_id: str, run_date: date) -> bool:
-    """Return True if the account already has at least one note created on run_date."""
-    try:
-        pager = client.list_account_notes(acc_id)
-        for note in pager.items():
-            created = getattr(note, "created_at", None)
-            if not created:
-                continue
-            note_date = created.date() if hasattr(created, "date") else datetime.fromisoformat(str(created).replace("Z", "+00:00")).date()
-            if note_date == run_date:
-                return True
-        return False
-    except Exception:
-        return False
+async def _has_note_today(api: Any, acc_id: str, run_date: date, notes: Optional[AccountNoteIndex] = None) -> bool:
+    """
+    Return True if the account already has at least one note created on run_date.
+    Answered from the run's note index; an account not indexed yet is listed once
+    (newest first, stopping before run_date) and added to it.
+    """
+    index = notes if notes is not None else AccountNoteIndex(run_date)
+    today = index.notes_today(acc_id)
+    if today is None:
+        try:
+            today = await index_account_notes(api, acc_id, index)
+        except Exception:
+            return False
+    return bool(today)
+
+
+def _account_has_note_today(
+    client: Any, acc_id: str, run_date: date, notes: Optional[AccountNoteIndex] = None
+) -> bool:
+    """_has_note_today on a recurly.Client."""
+    return run_sync(_has_note_today(SyncTransport(client), acc_id, run_date, notes))
 
 
 def _invoice_date(inv: Any) -> Optional[date]:
@@ -173,15 +230,76 @@ def _invoice_date(inv: Any) -> Optional[date]:
     return None
 
 
-def get_eligible_invoices(
-    client: Any,
+def _created_date(inv: Any) -> Optional[date]:
+    """Invoice created_at as a date (the field Recurly sorts and filters begin_time on)."""
+    val = getattr(inv, "created_at", None)
+    if not val:
+        return None
+    if hasattr(val, "date"):
+        return val.date()
+    try:
+        return datetime.fromisoformat(str(val).replace("Z", "+00:00")).date()
+    except Exception:
+        return None
+
+
+def _eligible_invoice_params(refund_date: date) -> Dict[str, Any]:
+    """
+    Server-side filter for the refund window: charge invoices created since shortly before
+    refund_date, newest first, in the largest page size.
+    """
+    begin = refund_date - timedelta(days=INVOICE_LOOKBACK_DAYS)
+    return {
+        "type": "charge",
+        "sort": "created_at",
+        "order": "desc",
+        "begin_time": f"{begin.isoformat()}T00:00:00Z",
+        "limit": 200,
+    }
+
+
+def _before_window(refund_date: date) -> Callable[[Any], bool]:
+    """Stop predicate for the newest-first listing: invoice created before the lookback window."""
+    window_start = refund_date - timedelta(days=INVOICE_LOOKBACK_DAYS)
+    return lambda inv: (_created_date(inv) or date.max) < window_start
+
+
+def _filter_eligible(invoices: Iterable[Any], refund_date: date, currency_cd: str) -> List[Any]:
+    """Client-side eligibility: charge, total > 0, currency, invoice_date >= refund_date; sorted by date."""
+    out = []
+    for inv in invoices:
+        if getattr(inv, "type", None) != "charge":
+            continue
+        total = getattr(inv, "total", 0) or 0
+        if total <= 0:
+            continue
+        if (getattr(inv, "currency", None) or "").upper() != (currency_cd or "USD").upper():
+            continue
+        inv_date = _invoice_date(inv)
+        if inv_date is None:
+            continue
+        if inv_date < refund_date:
+            continue
+        out.append(inv)
+    out.sort(key=lambda inv: _invoice_date(inv) or date.min)
+    return out
+
+
+async def eligible_invoices(
+    api: Any,
     subscription_id: str,
     refund_dt_str: Optional[str],
     currency_cd: str = "USD",
+    cache: Optional[InvoiceCache] = None,
 ) -> List[Any]:
     """
     List subscription invoices, filter to charge + total > 0 + currency + invoice_date >= refund_dt,
     sort by invoice date ascending. Return list of invoice objects.
+
+    The type and date window are pushed into the Recurly list call (type=charge, begin_time,
+    newest first) and paging stops at the first invoice created before the window, so old
+    renewals are never downloaded. The client-side checks below still apply to every invoice.
+    The listing comes from `cache` when it holds a fresh entry for the subscription.
     """
     refund_dt_str = (refund_dt_str or "").strip()
     if not refund_dt_str:
@@ -189,40 +307,426 @@ def get_eligible_invoices(
     refund_date = _parse_refund_date(refund_dt_str)
     if refund_date is None:
         return []
-    out = []
     try:
-        pager = client.list_subscription_invoices(subscription_id)
-        for inv in pager.items():
-            if getattr(inv, "type", None) != "charge":
-                continue
-            total = getattr(inv, "total", 0) or 0
-            if total <= 0:
-                continue
-            if (getattr(inv, "currency", None) or "").upper() != (currency_cd or "USD").upper():
-                continue
-            inv_date = _invoice_date(inv)
-            if inv_date is None:
-                continue
-            if inv_date < refund_date:
-                continue
-            out.append(inv)
+        invoices = await fetch_invoices(
+            api,
+            subscription_id,
+            cache,
+            params=_eligible_invoice_params(refund_date),
+            stop=_before_window(refund_date),
+        )
     except Exception as e:
         print(f"  Warning: list_subscription_invoices failed: {e}", file=sys.stderr)
         return []
-    out.sort(key=lambda inv: _invoice_date(inv) or date.min)
-    return out
+    return _filter_eligible(invoices, refund_date, currency_cd)
 
 
-def process_row(
+def get_eligible_invoices(
     client: Any,
+    subscription_id: str,
+    refund_dt_str: Optional[str],
+    currency_cd: str = "USD",
+    cache: Optional[InvoiceCache] = None,
+) -> List[Any]:
+    """eligible_invoices on a recurly.Client."""
+    return run_sync(eligible_invoices(SyncTransport(client), subscription_id, refund_dt_str, currency_cd, cache))
+
+
+def _init_log_entry(log_entry: Dict[str, Any], account_cd: str, subscription_guid: str, dry_run: bool) -> None:
+    log_entry["account_cd"] = account_cd
+    log_entry["subscription_guid"] = subscription_guid
+    log_entry["subscription_state"] = ""
+    log_entry["note_added"] = False
+    log_entry["billing_cleared"] = False
+    log_entry["refunded_invoice_numbers"] = []
+    log_entry["dry_run"] = dry_run
+    log_entry["error"] = ""
+
+
+def _restore_step(journal: Optional[RowJournal], step: str, log_entry: Dict[str, Any], fields: Tuple[str, ...]) -> bool:
+    """Restore a journaled step's fields into log_entry; True if the step can be skipped."""
+    done = journal.get(step) if journal is not None else None
+    if done is None:
+        return False
+    for field in fields + ("error",):
+        if field in done:
+            log_entry[field] = done[field]
+    print(f"  (resume) {step} already done")
+    return True
+
+
+def _record_step(journal: Optional[RowJournal], step: str, log_entry: Dict[str, Any], fields: Tuple[str, ...]) -> None:
+    if journal is not None:
+        journal.record(step, {field: log_entry[field] for field in fields + ("error",)})
+
+
+def _report_eligible(refund_dt: str, eligible: List[Any]) -> None:
+    parsed = _parse_refund_date(refund_dt) if refund_dt else None
+    print(f"  refund_dt={refund_dt!r} -> parsed={parsed}, eligible_invoices={len(eligible)}")
+    if refund_dt and parsed is None:
+        print(f"  Warning: refund_dt could not be parsed (use m/d/yyyy or yyyy-mm-dd); no refunds will be attempted for this row.")
+
+
+def _record_terminate_error(log_entry: Dict[str, Any], e: Exception) -> None:
+    """Already expired/canceled/missing subscriptions are not errors; anything else is logged."""
+    err = str(e)
+    if "expired" in err.lower() or "canceled" in err.lower() or "not found" in err.lower():
+        log_entry["subscription_state"] = "expired_or_invalid"
+    else:
+        log_entry["error"] = err
+
+
+def _record_billing_error(log_entry: Dict[str, Any], e: Exception) -> None:
+    """Non-fatal if billing info was already cleared."""
+    if "404" in str(e) or "not found" in str(e).lower():
+        log_entry["billing_cleared"] = False  # already cleared, continue
+    else:
+        log_entry["error"] = (log_entry["error"] or str(e)) + " (billing)"
+
+
+def _print_eligible_numbers(eligible: List[Any]) -> None:
+    eligible_display = [
+        getattr(inv, "number", None) or getattr(inv, "id", None) or "?"
+        for inv in eligible
+    ]
+    print(f"  Eligible invoice numbers: {eligible_display}")
+
+
+def _report_dry_run_refunds(eligible: List[Any], refunded_numbers: List[Any]) -> None:
+    refunded_numbers.extend(
+        getattr(inv, "number", None) or getattr(inv, "id", "") for inv in eligible
+    )
+    print(f"  (dry-run) Would refund {len(eligible)} invoice(s)")
+
+
+def _refund_target(inv: Any, journal: Optional[RowJournal], refunded_numbers: List[Any]) -> str:
+    """API id to refund, or "" when the invoice has no id or was refunded in a journaled run."""
+    inv_number = getattr(inv, "number", None)
+    inv_id = getattr(inv, "id", None)
+    api_id = f"number-{inv_number}" if inv_number is not None else (inv_id or "")
+    if not api_id:
+        print(f"  Skipping invoice (no number or id): {inv}", file=sys.stderr)
+        return ""
+    done = journal.get(f"refund:{api_id}") if journal is not None else None
+    if done is not None:
+        refunded_numbers.append(done.get("refunded"))
+        print(f"  (resume) refund {api_id} already done")
+        return ""
+    return api_id
+
+
+def _record_refund(journal: Optional[RowJournal], inv: Any, api_id: str, refunded_numbers: List[Any]) -> None:
+    refunded = getattr(inv, "number", None) or getattr(inv, "id", None)
+    refunded_numbers.append(refunded)
+    if journal is not None:
+        journal.record(f"refund:{api_id}", {"refunded": refunded})
+    print(f"  Refunded invoice: {api_id}")
+
+
+def _with_journaled_refunds(journal: Optional[RowJournal], refunded_numbers: List[Any]) -> List[Any]:
+    """
+    Refunds journaled in an earlier run drop out of the eligible list once the
+    credit invoice exists; report them as refunded all the same.
+    """
+    if journal is not None:
+        for _step, done in journal.steps_with_prefix("refund:"):
+            if done.get("refunded") not in refunded_numbers:
+                refunded_numbers.append(done.get("refunded"))
+    return refunded_numbers
+
+
+# --- Pre-flight: resolve state for the whole input, then make only the calls each row needs ---
+
+# Subscription states terminate_subscription cannot change
+TERMINAL_SUBSCRIPTION_STATES = ("expired", "failed")
+SUBSCRIPTION_NOT_FOUND = "not_found"
+
+
+def _is_not_found(e: Exception) -> bool:
+    """404 from either client (recurly.errors.NotFoundError or RecurlyAsyncError)."""
+    err_type = getattr(getattr(e, "error", None), "type", None) or getattr(e, "error_type", "")
+    return err_type == "not_found" or getattr(e, "status", None) == 404
+
+
+def _subscription_state_result(sub: Any = None, error: Optional[Exception] = None) -> str:
+    if error is None:
+        return getattr(sub, "state", None) or "unknown"
+    return SUBSCRIPTION_NOT_FOUND if _is_not_found(error) else "unknown"
+
+
+async def _lookup_subscription_state(api: Any, sub_id: str) -> str:
+    try:
+        return _subscription_state_result(await api.call("get_subscription", sub_id))
+    except Exception as e:
+        return _subscription_state_result(error=e)
+
+
+async def _lookup_has_billing(api: Any, acc_id: str) -> bool:
+    """False only when Recurly says the account has no billing info; errors count as present."""
+    try:
+        await api.call("get_billing_info", acc_id)
+        return True
+    except Exception as e:
+        return not _is_not_found(e)
+
+
+class RunPlan:
+    """
+    State resolved by the pre-flight pass: subscription state by subscription id, billing
+    info presence by account id, and eligible invoices by subscription (per refund_dt and
+    currency). process_row consults it to skip calls that cannot change anything, and
+    updates it as it terminates subscriptions, clears billing and refunds, so later rows
+    see the new state (a refunded subscription's lists are dropped and re-listed).
+    """
+
+    def __init__(self, notes: Optional[AccountNoteIndex] = None) -> None:
+        self.notes = notes
+        self.subscription_states: Dict[str, str] = {}
+        self.has_billing: Dict[str, bool] = {}
+        self._eligible: Dict[str, Dict[Tuple[str, str], List[Any]]] = {}
+        self._eligible_lock = threading.Lock()
+        # (row_index, sub_id, acc_id, refund_dt, currency_cd, has_note) for rows still to run
+        self._rows: List[Tuple[int, str, str, str, str, bool]] = []
+        self.rows_seen = 0
+
+    def add_rows(self, rows: Iterable[Dict[str, Any]], journal: Optional[RunJournal] = None) -> None:
+        """Register input rows (1-based index, as in the log); rows finished in a resumed journal are skipped."""
+        for i, row in enumerate(rows):
+            self.rows_seen += 1
+            if journal is not None and journal.is_done(i + 1):
+                continue
+            sub_id = _subscription_id(row.get("subscription_guid") or "")
+            acc_id = _account_id(row.get("account_cd") or "")
+            if not sub_id or not acc_id:
+                continue
+            self._rows.append((
+                i + 1,
+                sub_id,
+                acc_id,
+                (row.get("refund_dt") or "").strip(),
+                (row.get("currency_cd") or "USD").strip() or "USD",
+                bool((row.get("account_note") or "").strip()),
+            ))
+
+    def subscription_ids(self) -> List[str]:
+        return sorted({r[1] for r in self._rows})
+
+    def account_ids(self) -> List[str]:
+        return sorted({r[2] for r in self._rows})
+
+    def note_account_ids(self) -> List[str]:
+        """Accounts that get a note (at most one per account per day)."""
+        return sorted({r[2] for r in self._rows if r[5]})
+
+    def refund_listings(self) -> List[Tuple[str, str, str]]:
+        """Distinct (sub_id, refund_dt, currency_cd) of rows that can have eligible invoices."""
+        return sorted({(r[1], r[3], r[4]) for r in self._rows if r[3]})
+
+    def set_eligible(self, sub_id: str, refund_dt: str, currency_cd: str, eligible: List[Any]) -> None:
+        with self._eligible_lock:
+            self._eligible.setdefault(sub_id, {})[(refund_dt, currency_cd)] = eligible
+
+    def eligible_for(self, sub_id: str, refund_dt: str, currency_cd: str) -> Optional[List[Any]]:
+        """Eligible invoices listed for the subscription, or None to list them now (not listed, or refunded since)."""
+        with self._eligible_lock:
+            return self._eligible.get(sub_id, {}).get((refund_dt, currency_cd))
+
+    def drop_eligible(self, sub_id: str) -> None:
+        """After refunds on the subscription: its lists are stale, later rows re-list."""
+        with self._eligible_lock:
+            self._eligible.pop(sub_id, None)
+
+    def terminate_skip_state(self, sub_id: str) -> str:
+        """Log state for a subscription that must not be terminated, or "" when terminate is needed."""
+        state = self.subscription_states.get(sub_id, "")
+        if state == SUBSCRIPTION_NOT_FOUND:
+            return "expired_or_invalid"
+        return state if state in TERMINAL_SUBSCRIPTION_STATES else ""
+
+    def mark_terminated(self, sub_id: str) -> None:
+        self.subscription_states[sub_id] = "expired"
+
+    def needs_billing_clear(self, acc_id: str) -> bool:
+        return self.has_billing.get(acc_id, True)
+
+    def mark_billing_cleared(self, acc_id: str) -> None:
+        self.has_billing[acc_id] = False
+
+    def call_counts(self) -> Dict[str, int]:
+        """Recurly calls execution still needs (notes are an upper bound: one per account per day)."""
+        subs = self.subscription_ids()
+        note_accounts = self.note_account_ids()
+        notes_today = [self.notes.notes_today(acc_id) if self.notes is not None else None for acc_id in note_accounts]
+        # Each eligible invoice is refunded once, however many rows of its subscription list it
+        refund_invoices: Dict[str, set] = {}
+        with self._eligible_lock:
+            for sub_id, lists in self._eligible.items():
+                numbers = {getattr(inv, "number", None) or getattr(inv, "id", None) for lst in lists.values() for inv in lst}
+                if numbers:
+                    refund_invoices[sub_id] = numbers
+        refund_row_counts: Dict[str, int] = {}
+        for r in self._rows:
+            if r[3]:
+                refund_row_counts[r[1]] = refund_row_counts.get(r[1], 0) + 1
+        return {
+            "terminate_subscription": sum(1 for sub_id in subs if not self.terminate_skip_state(sub_id)),
+            "remove_billing_info": sum(1 for acc_id in self.account_ids() if self.needs_billing_clear(acc_id)),
+            "list_account_notes": sum(1 for today in notes_today if today is None),
+            "create_account_note": sum(1 for today in notes_today if not today),
+            "refund_invoice": sum(len(invoices) for invoices in refund_invoices.values()),
+            # Listings pre-flight could not do, plus one re-list per refunded subscription with later rows
+            "list_subscription_invoices": sum(
+                1 for sub_id, refund_dt, currency_cd in self.refund_listings()
+                if self.eligible_for(sub_id, refund_dt, currency_cd) is None
+            ) + sum(1 for sub_id in refund_invoices if refund_row_counts.get(sub_id, 0) > 1),
+        }
+
+    def report(self) -> List[str]:
+        states: Dict[str, int] = {}
+        for sub_id in self.subscription_ids():
+            state = self.subscription_states.get(sub_id, "unknown")
+            states[state] = states.get(state, 0) + 1
+        accounts = self.account_ids()
+        with_billing = sum(1 for acc_id in accounts if self.needs_billing_clear(acc_id))
+        counts = self.call_counts()
+        return [
+            f"Plan: {len(self._rows)} of {self.rows_seen} rows to process "
+            f"(pre-flight looked up {len(self.subscription_ids())} subscriptions, {len(accounts)} accounts, "
+            f"{len(self.note_account_ids()) if self.notes is not None else 0} note listings, "
+            f"{len(self.refund_listings())} invoice listings)",
+            "  subscriptions: " + (", ".join(f"{n} {state}" for state, n in sorted(states.items())) or "none"),
+            f"  accounts: {with_billing} with billing info, {len(accounts) - with_billing} without",
+            "  calls to make: " + " ".join(f"{name}={n}" for name, n in counts.items()),
+            f"  total: {sum(counts.values())} calls",
+        ]
+
+
+def build_plan(
+    client_factory: Callable[[], Any],
+    rows: Iterable[Dict[str, Any]],
+    workers: int = 1,
+    cache: Optional[InvoiceCache] = None,
+    journal: Optional[RunJournal] = None,
+    notes: Optional[AccountNoteIndex] = None,
+) -> RunPlan:
+    """
+    Pre-flight pass over the input: look up each distinct subscription and account once,
+    index the recent notes of accounts that get a note (into `notes`), and list each subscription's
+    eligible invoices (filling `cache`), on up to `workers` threads with a client per thread.
+    Only read-only calls are made, so it also runs under --dry-run.
+    """
+    plan = RunPlan(notes)
+    plan.add_rows(rows, journal)
+    local = threading.local()
+
+    def _client() -> Any:
+        if getattr(local, "client", None) is None:
+            local.client = client_factory()
+        return local.client
+
+    def _subscription(sub_id: str) -> None:
+        plan.subscription_states[sub_id] = run_sync(_lookup_subscription_state(SyncTransport(_client()), sub_id))
+
+    def _billing(acc_id: str) -> None:
+        plan.has_billing[acc_id] = run_sync(_lookup_has_billing(SyncTransport(_client()), acc_id))
+
+    def _eligible(item: Tuple[str, str, str]) -> None:
+        sub_id, refund_dt, currency_cd = item
+        plan.set_eligible(sub_id, refund_dt, currency_cd, get_eligible_invoices(_client(), sub_id, refund_dt, currency_cd, cache))
+
+    def _notes(acc_id: str) -> None:
+        # Not indexed on failure, so the row lists the account's notes itself
+        _account_has_note_today(_client(), acc_id, notes.run_date, notes)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="preflight") as pool:
+        futures = [pool.submit(_subscription, sub_id) for sub_id in plan.subscription_ids()]
+        futures += [pool.submit(_billing, acc_id) for acc_id in plan.account_ids()]
+        if notes is not None:
+            futures += [pool.submit(_notes, acc_id) for acc_id in plan.note_account_ids()]
+        futures += [pool.submit(_eligible, item) for item in plan.refund_listings()]
+        for future in futures:
+            future.result()
+    return plan
+
+
+async def build_plan_async(
+    client: Any,
+    rows: Iterable[Dict[str, Any]],
+    workers: int = 1,
+    cache: Optional[InvoiceCache] = None,
+    journal: Optional[RunJournal] = None,
+    notes: Optional[AccountNoteIndex] = None,
+) -> RunPlan:
+    """build_plan on the async client, with up to `workers` lookups in flight."""
+    plan = RunPlan(notes)
+    plan.add_rows(rows, journal)
+    api = AsyncTransport(client)
+    slots = asyncio.Semaphore(workers)
+
+    async def _subscription(sub_id: str) -> None:
+        async with slots:
+            plan.subscription_states[sub_id] = await _lookup_subscription_state(api, sub_id)
+
+    async def _billing(acc_id: str) -> None:
+        async with slots:
+            plan.has_billing[acc_id] = await _lookup_has_billing(api, acc_id)
+
+    async def _eligible(item: Tuple[str, str, str]) -> None:
+        sub_id, refund_dt, currency_cd = item
+        async with slots:
+            plan.set_eligible(sub_id, refund_dt, currency_cd, await eligible_invoices(api, sub_id, refund_dt, currency_cd, cache))
+
+    async def _notes(acc_id: str) -> None:
+        async with slots:
+            await _has_note_today(api, acc_id, notes.run_date, notes)
+
+    lookups = [_subscription(sub_id) for sub_id in plan.subscription_ids()]
+    lookups += [_billing(acc_id) for acc_id in plan.account_ids()]
+    if notes is not None:
+        lookups += [_notes(acc_id) for acc_id in plan.note_account_ids()]
+    lookups += [_eligible(item) for item in plan.refund_listings()]
+    await asyncio.gather(*lookups)
+    return plan
+
+
+def _planned_terminate_skip(plan: Optional[RunPlan], sub_id: str, log_entry: Dict[str, Any]) -> bool:
+    """True (and the known state logged) when pre-flight found the subscription already ended."""
+    state = plan.terminate_skip_state(sub_id) if plan is not None else ""
+    if not state:
+        return False
+    log_entry["subscription_state"] = state
+    print(f"  Subscription already {state}; not terminating")
+    return True
+
+
+def _planned_billing_skip(plan: Optional[RunPlan], acc_id: str, log_entry: Dict[str, Any]) -> bool:
+    """True when pre-flight found no billing info on the account (same outcome as a 404 on remove)."""
+    if plan is None or plan.needs_billing_clear(acc_id):
+        return False
+    log_entry["billing_cleared"] = False
+    print("  No billing info on account; not clearing")
+    return True
+
+
+async def _row_steps(
+    api: Any,
     row: Dict[str, Any],
     log_entry: Dict[str, Any],
     dry_run: bool = False,
     run_date: Optional[date] = None,
     row_index: Optional[int] = None,
+    journal: Optional[RowJournal] = None,
+    cache: Optional[InvoiceCache] = None,
+    plan: Optional[RunPlan] = None,
+    notes: Optional[AccountNoteIndex] = None,
 ) -> None:
     """
-    Run the 5-step workflow for one CSV row. Mutating API calls skipped when dry_run is True.
+    The 5-step workflow for one CSV row, on either transport (see recurly_transport).
+    Mutating API calls skipped when dry_run is True.
+    When a journal is given, each finished step is recorded and steps it already holds are
+    skipped (their recorded outcome is restored into log_entry instead). With a pre-flight
+    plan, terminate and billing clear are skipped where they cannot change anything and the
+    eligible invoices come from the plan.
     """
     if run_date is None:
         run_date = datetime.now().date()
@@ -236,14 +740,7 @@ def process_row(
     row_label = f"Row {row_index}" if row_index is not None else "Row"
     print(f"Processing {row_label}: account_cd={account_cd!r}, subscription_guid={subscription_guid!r}, refund_dt={refund_dt!r}")
 
-    log_entry["account_cd"] = account_cd
-    log_entry["subscription_guid"] = subscription_guid
-    log_entry["subscription_state"] = ""
-    log_entry["note_added"] = False
-    log_entry["billing_cleared"] = False
-    log_entry["refunded_invoice_numbers"] = []
-    log_entry["dry_run"] = dry_run
-    log_entry["error"] = ""
+    _init_log_entry(log_entry, account_cd, subscription_guid, dry_run)
 
     sub_id = _subscription_id(subscription_guid)
     acc_id = _account_id(account_cd)
@@ -251,94 +748,431 @@ def process_row(
         log_entry["error"] = "missing account_cd or subscription_guid"
         return
 
+    def _resumed(step: str, *fields: str) -> bool:
+        return _restore_step(journal, step, log_entry, fields)
+
+    def _record(step: str, *fields: str) -> None:
+        _record_step(journal, step, log_entry, fields)
+
     # Step 1: eligible invoices (when refund_dt is set and parseable)
-    eligible = get_eligible_invoices(client, sub_id, refund_dt if refund_dt else None, currency_cd)
-    parsed = _parse_refund_date(refund_dt) if refund_dt else None
-    print(f"  refund_dt={refund_dt!r} -> parsed={parsed}, eligible_invoices={len(eligible)}")
-    if refund_dt and parsed is None:
-        print(f"  Warning: refund_dt could not be parsed (use m/d/yyyy or yyyy-mm-dd); no refunds will be attempted for this row.")
+    eligible = plan.eligible_for(sub_id, refund_dt, currency_cd) if plan is not None else None
+    if eligible is None:
+        eligible = await eligible_invoices(api, sub_id, refund_dt if refund_dt else None, currency_cd, cache)
+    _report_eligible(refund_dt, eligible)
     refunded_numbers = []
 
     # Step 2: terminate subscription (no refund; all refunds handled in step 5)
-    try:
-        if dry_run:
-            log_entry["subscription_state"] = "(dry-run) would terminate with refund=none"
-        else:
-            client.terminate_subscription(sub_id, params={"refund": "none"})
-            log_entry["subscription_state"] = "expired"
-    except Exception as e:
-        err = str(e)
-        if "expired" in err.lower() or "canceled" in err.lower() or "not found" in err.lower():
-            log_entry["subscription_state"] = "expired_or_invalid"
-            # Continue: still try note, billing clear, and refunds if needed
-        else:
-            log_entry["error"] = err
-            # Continue anyway so we can try refunds if eligible
+    if not _resumed("terminate", "subscription_state"):
+        if not _planned_terminate_skip(plan, sub_id, log_entry):
+            try:
+                if dry_run:
+                    log_entry["subscription_state"] = "(dry-run) would terminate with refund=none"
+                else:
+                    await api.call("terminate_subscription", sub_id, params={"refund": "none"})
+                    log_entry["subscription_state"] = "expired"
+                    if plan is not None:
+                        plan.mark_terminated(sub_id)
+            except Exception as e:
+                # Continue either way: still try note, billing clear, and refunds if eligible
+                _record_terminate_error(log_entry, e)
 
-    if not dry_run and not log_entry["subscription_state"]:
-        try:
-            sub = client.get_subscription(sub_id)
-            log_entry["subscription_state"] = getattr(sub, "state", "unknown") or "unknown"
-        except Exception:
-            log_entry["subscription_state"] = "unknown"
+            if not dry_run and not log_entry["subscription_state"]:
+                try:
+                    sub = await api.call("get_subscription", sub_id)
+                    log_entry["subscription_state"] = getattr(sub, "state", "unknown") or "unknown"
+                except Exception:
+                    log_entry["subscription_state"] = "unknown"
+        _record("terminate", "subscription_state")
 
     # Step 3: add account note (skip if account already has a note added today)
-    if account_note:
+    if account_note and not _resumed("note", "note_added"):
         if dry_run:
             log_entry["note_added"] = True  # would add
-        elif _account_has_note_today(client, acc_id, run_date):
+        elif await _has_note_today(api, acc_id, run_date, notes):
             log_entry["note_added"] = False  # already added today, skip
         else:
             try:
-                client.create_account_note(acc_id, {"message": account_note})
+                await api.call("create_account_note", acc_id, {"message": account_note})
                 log_entry["note_added"] = True
+                if notes is not None:
+                    notes.record_created(acc_id, account_note)
             except Exception as e:
                 log_entry["error"] = log_entry["error"] or str(e)
+        _record("note", "note_added")
 
     # Step 4: clear billing info (non-fatal if already cleared)
-    if dry_run:
-        log_entry["billing_cleared"] = True  # would clear
-    else:
-        try:
-            client.remove_billing_info(acc_id)
-            log_entry["billing_cleared"] = True
-        except Exception as e:
-            if "404" in str(e) or "not found" in str(e).lower():
-                log_entry["billing_cleared"] = False  # already cleared, continue
-            else:
-                log_entry["error"] = (log_entry["error"] or str(e)) + " (billing)"
-            # Continue to step 5 (refunds) even if billing clear failed
+    if not _resumed("billing", "billing_cleared"):
+        if _planned_billing_skip(plan, acc_id, log_entry):
+            pass
+        elif dry_run:
+            log_entry["billing_cleared"] = True  # would clear
+        else:
+            try:
+                await api.call("remove_billing_info", acc_id)
+                log_entry["billing_cleared"] = True
+                if plan is not None:
+                    plan.mark_billing_cleared(acc_id)
+            except Exception as e:
+                # Continue to step 5 (refunds) even if billing clear failed
+                _record_billing_error(log_entry, e)
+        _record("billing", "billing_cleared")
 
     # Step 5: refund all eligible invoices (1 or more)
     if eligible:
-        eligible_display = [
-            getattr(inv, "number", None) or getattr(inv, "id", None) or "?"
-            for inv in eligible
-        ]
-        print(f"  Eligible invoice numbers: {eligible_display}")
+        _print_eligible_numbers(eligible)
         if dry_run:
-            refunded_numbers.extend(
-                getattr(inv, "number", None) or getattr(inv, "id", "") for inv in eligible
-            )
-            print(f"  (dry-run) Would refund {len(eligible)} invoice(s)")
+            _report_dry_run_refunds(eligible, refunded_numbers)
         else:
             for inv in eligible:
-                inv_number = getattr(inv, "number", None)
-                inv_id = getattr(inv, "id", None)
-                api_id = f"number-{inv_number}" if inv_number is not None else (inv_id or "")
+                api_id = _refund_target(inv, journal, refunded_numbers)
                 if not api_id:
-                    print(f"  Skipping invoice (no number or id): {inv}", file=sys.stderr)
                     continue
                 try:
                     # Recurly API expects body with "type"; use request class if available for correct serialization
                     refund_body = _refund_invoice_body()
-                    client.refund_invoice(api_id, refund_body)
-                    refunded_numbers.append(inv_number or inv_id)
-                    print(f"  Refunded invoice: {api_id}")
+                    await api.call("refund_invoice", api_id, refund_body)
+                    _record_refund(journal, inv, api_id, refunded_numbers)
                 except Exception as e:
                     print(f"  Refund failed for invoice {api_id}: {e}", file=sys.stderr)
+            # Refunds add credit invoices; later rows for this subscription must re-list
+            if cache is not None:
+                cache.invalidate(sub_id)
+            if plan is not None:
+                plan.drop_eligible(sub_id)
+
+    log_entry["refunded_invoice_numbers"] = _with_journaled_refunds(journal, refunded_numbers)
+
+
+def process_row(
+    client: Any,
+    row: Dict[str, Any],
+    log_entry: Dict[str, Any],
+    dry_run: bool = False,
+    run_date: Optional[date] = None,
+    row_index: Optional[int] = None,
+    journal: Optional[RowJournal] = None,
+    cache: Optional[InvoiceCache] = None,
+    plan: Optional[RunPlan] = None,
+    notes: Optional[AccountNoteIndex] = None,
+) -> None:
+    """Run the 5-step workflow for one CSV row on a recurly.Client (see _row_steps)."""
+    run_sync(_row_steps(SyncTransport(client), row, log_entry, dry_run, run_date, row_index, journal, cache, plan, notes))
+
+
+def _error_log_entry(row: Dict[str, Any], dry_run: bool, error: str) -> Dict[str, Any]:
+    """Log entry for a row that failed before process_row could record its own outcome."""
+    return {
+        "account_cd": row.get("account_cd", ""),
+        "subscription_guid": row.get("subscription_guid", ""),
+        "subscription_state": "",
+        "note_added": False,
+        "billing_cleared": False,
+        "refunded_invoice_numbers": [],
+        "dry_run": dry_run,
+        "error": error,
+    }
+
+
+async def _row_outcome(
+    api: Any,
+    row: Dict[str, Any],
+    dry_run: bool,
+    run_date: date,
+    row_index: int,
+    journal: Optional[RunJournal] = None,
+    cache: Optional[InvoiceCache] = None,
+    plan: Optional[RunPlan] = None,
+    notes: Optional[AccountNoteIndex] = None,
+) -> Dict[str, Any]:
+    """Run one row's steps and return its log entry (errors recorded, never raised)."""
+    row_journal = journal.for_row(row_index, row) if journal is not None else None
+    if row_journal is not None:
+        finished = row_journal.get("done")
+        if finished is not None:
+            print(f"Row {row_index}: already completed in journaled run, skipping")
+            return dict(finished)
+
+    log_entry: Dict[str, Any] = {}
+    try:
+        await _row_steps(
+            api,
+            row,
+            log_entry,
+            dry_run=dry_run,
+            run_date=run_date,
+            row_index=row_index,
+            journal=row_journal,
+            cache=cache,
+            plan=plan,
+            notes=notes,
+        )
+        if row_journal is not None:
+            row_journal.record("done", log_entry)
+    except Exception as e:
+        # Not journaled as done, so --resume retries the row
+        log_entry = _error_log_entry(row, dry_run, str(e))
+    if log_entry.get("error"):
+        print(f"Row {row_index} ({log_entry.get('account_cd', '')}): {log_entry['error']}", file=sys.stderr)
+    return log_entry
+
+
+def _run_row(
+    client: Any,
+    row: Dict[str, Any],
+    dry_run: bool,
+    run_date: date,
+    row_index: int,
+    journal: Optional[RunJournal] = None,
+    cache: Optional[InvoiceCache] = None,
+    plan: Optional[RunPlan] = None,
+    notes: Optional[AccountNoteIndex] = None,
+) -> Dict[str, Any]:
+    """_row_outcome on a recurly.Client."""
+    return run_sync(_row_outcome(SyncTransport(client), row, dry_run, run_date, row_index, journal, cache, plan, notes))
+
 
-    log_entry["refunded_invoice_numbers"] = refunded_numbers
+def _worker_for_account(account_cd: str, workers: int) -> int:
+    """Stable worker index for an account so all of its rows run on one worker, in input order."""
+    return zlib.crc32((account_cd or "").strip().encode("utf-8")) % workers
+
+
+def run_rows(
+    client_factory: Callable[[], Any],
+    rows: Iterable[Dict[str, Any]],
+    workers: int = 1,
+    dry_run: bool = False,
+    run_date: Optional[date] = None,
+    journal: Optional[RunJournal] = None,
+    cache: Optional[InvoiceCache] = None,
+    plan: Optional[RunPlan] = None,
+    notes: Optional[AccountNoteIndex] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Process rows with a bounded pool of workers and yield log entries in input order.
+
+    Each worker owns its own client (recurly.Client holds a single HTTPS connection and is
+    not safe to share across threads). Rows are routed by account_cd, so note and billing
+    calls for one account never run concurrently and keep their input order; steps within
+    a row keep the order of process_row. All workers share one account note index. At most
+    workers * ROWS_IN_FLIGHT_PER_WORKER rows are dispatched ahead of the oldest unfinished one.
+    """
+    if run_date is None:
+        run_date = datetime.now().date()
+    if notes is None:
+        notes = AccountNoteIndex(run_date)
+
+    if workers <= 1:
+        client = client_factory()
+        for i, row in enumerate(rows):
+            yield _run_row(client, row, dry_run, run_date, i + 1, journal, cache, plan, notes)
+        return
+
+    # Small per-worker queues keep the dispatcher from running far ahead of one worker;
+    # the in-flight window below bounds the reorder buffer (`done`) across all of them
+    inboxes: List["queue.Queue[Optional[tuple]]"] = [queue.Queue(maxsize=4) for _ in range(workers)]
+    window = workers * ROWS_IN_FLIGHT_PER_WORKER
+    done: Dict[int, Dict[str, Any]] = {}
+    done_cv = threading.Condition()
+
+    def _worker(inbox: "queue.Queue[Optional[tuple]]") -> None:
+        client = None
+        while True:
+            item = inbox.get()
+            if item is None:
+                return
+            idx, row = item
+            try:
+                if client is None:
+                    client = client_factory()
+                entry = _run_row(client, row, dry_run, run_date, idx + 1, journal, cache, plan, notes)
+            except Exception as e:
+                # client_factory failed; record it on the row instead of killing the worker
+                entry = _error_log_entry(row, dry_run, str(e))
+            with done_cv:
+                done[idx] = entry
+                done_cv.notify_all()
+
+    threads = [
+        threading.Thread(target=_worker, args=(inbox,), name=f"row-worker-{n}", daemon=True)
+        for n, inbox in enumerate(inboxes)
+    ]
+    for t in threads:
+        t.start()
+
+    next_out = 0
+    dispatched = 0
+    try:
+        for idx, row in enumerate(rows):
+            # Emit whatever has finished, in order; wait on the oldest row only while the window is full
+            ready = []
+            with done_cv:
+                while True:
+                    while next_out in done:
+                        ready.append(done.pop(next_out))
+                        next_out += 1
+                    if idx - next_out < window:
+                        break
+                    done_cv.wait()
+            yield from ready
+            inboxes[_worker_for_account(row.get("account_cd", ""), workers)].put((idx, row))
+            dispatched = idx + 1
+        while next_out < dispatched:
+            with done_cv:
+                while next_out not in done:
+                    done_cv.wait()
+                entry = done.pop(next_out)
+            next_out += 1
+            yield entry
+    finally:
+        for inbox in inboxes:
+            inbox.put(None)
+
+
+# --- Async transport (--transport async): the same _row_outcome on recurly_async.AsyncRecurlyClient ---
+
+
+async def run_rows_async(
+    client: Any,
+    rows: Iterable[Dict[str, Any]],
+    workers: int = 1,
+    dry_run: bool = False,
+    run_date: Optional[date] = None,
+    journal: Optional[RunJournal] = None,
+    cache: Optional[InvoiceCache] = None,
+    plan: Optional[RunPlan] = None,
+    notes: Optional[AccountNoteIndex] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    run_rows on one event loop: `workers` coroutine lanes share the pooled async client.
+    Rows are routed to lanes by account_cd exactly like run_rows, and log entries are
+    yielded in input order, with the same in-flight window.
+    """
+    if run_date is None:
+        run_date = datetime.now().date()
+    if notes is None:
+        notes = AccountNoteIndex(run_date)
+    api = AsyncTransport(client)
+    lanes: List["asyncio.Queue[Optional[tuple]]"] = [asyncio.Queue(maxsize=4) for _ in range(workers)]
+    window = workers * ROWS_IN_FLIGHT_PER_WORKER
+    done: Dict[int, Dict[str, Any]] = {}
+    finished = asyncio.Event()
+
+    async def _lane(inbox: "asyncio.Queue[Optional[tuple]]") -> None:
+        while True:
+            item = await inbox.get()
+            if item is None:
+                return
+            idx, row = item
+            done[idx] = await _row_outcome(api, row, dry_run, run_date, idx + 1, journal, cache, plan, notes)
+            finished.set()
+
+    tasks = [asyncio.create_task(_lane(inbox)) for inbox in lanes]
+    next_out = 0
+    dispatched = 0
+    try:
+        for idx, row in enumerate(rows):
+            while True:
+                while next_out in done:
+                    yield done.pop(next_out)
+                    next_out += 1
+                if idx - next_out < window:
+                    break
+                finished.clear()
+                await finished.wait()
+            await lanes[_worker_for_account(row.get("account_cd", ""), workers)].put((idx, row))
+            dispatched = idx + 1
+        while next_out < dispatched:
+            while next_out not in done:
+                finished.clear()
+                await finished.wait()
+            yield done.pop(next_out)
+            next_out += 1
+    finally:
+        for inbox in lanes:
+            await inbox.put(None)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _run_async(
+    args: argparse.Namespace,
+    rows: Iterable[Dict[str, Any]],
+    limiter: RateLimiter,
+    log_writer: "LogWriter",
+    run_date: date,
+    journal: Optional[RunJournal],
+    cache: Optional[InvoiceCache],
+    plan: Optional[RunPlan],
+    notes: AccountNoteIndex,
+) -> None:
+    async with AsyncRecurlyClient(RECURLY_API_KEY, limiter, max_connections=max(args.workers, 1)) as client:
+        async for log_entry in run_rows_async(
+            client,
+            rows,
+            workers=args.workers,
+            dry_run=args.dry_run,
+            run_date=run_date,
+            journal=journal,
+            cache=cache,
+            plan=plan,
+            notes=notes,
+        ):
+            log_writer.write(log_entry)
+
+
+async def _plan_async(
+    args: argparse.Namespace,
+    rows: Iterable[Dict[str, Any]],
+    limiter: RateLimiter,
+    journal: Optional[RunJournal],
+    cache: Optional[InvoiceCache],
+    notes: AccountNoteIndex,
+) -> RunPlan:
+    async with AsyncRecurlyClient(RECURLY_API_KEY, limiter, max_connections=max(args.workers, 1)) as client:
+        return await build_plan_async(client, rows, workers=args.workers, cache=cache, journal=journal, notes=notes)
+
+
+LOG_FIELDS = [
+    "account_cd", "subscription_guid", "subscription_state",
+    "note_added", "billing_cleared", "refunded_invoice_numbers",
+    "dry_run", "error",
+]
+
+
+def _log_row(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Format one log entry for the CSV (lists joined, booleans as yes/no)."""
+    row = dict(entry)
+    if "refunded_invoice_numbers" in row and isinstance(row["refunded_invoice_numbers"], list):
+        row["refunded_invoice_numbers"] = ";".join(str(x) for x in row["refunded_invoice_numbers"] if x)
+    row["note_added"] = "yes" if row.get("note_added") else "no"
+    row["billing_cleared"] = "yes" if row.get("billing_cleared") else "no"
+    row["dry_run"] = "yes" if row.get("dry_run") else "no"
+    return row
+
+
+class LogWriter:
+    """Streams log entries to CSV as rows finish, flushing each so an interrupted run keeps its log."""
+
+    def __init__(self, log_path: Union[str, Path]) -> None:
+        path = Path(log_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._fh = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._fh, fieldnames=LOG_FIELDS, extrasaction="ignore")
+        self._writer.writeheader()
+        self.count = 0
+
+    def write(self, entry: Dict[str, Any]) -> None:
+        self._writer.writerow(_log_row(entry))
+        self._fh.flush()
+        self.count += 1
+
+    def close(self) -> None:
+        self._fh.close()
+
+    def __enter__(self) -> "LogWriter":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
 
 
 def write_log(log_path: Union[str, Path], entries: List[Dict[str, Any]]) -> None:
@@ -347,22 +1181,9 @@ def write_log(log_path: Union[str, Path], entries: List[Dict[str, Any]]) -> None
     path.parent.mkdir(parents=True, exist_ok=True)
     if not entries:
         return
-    keys = [
-        "account_cd", "subscription_guid", "subscription_state",
-        "note_added", "billing_cleared", "refunded_invoice_numbers",
-        "dry_run", "error",
-    ]
-    with open(path, "w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=keys, extrasaction="ignore")
-        w.writeheader()
+    with LogWriter(path) as writer:
         for e in entries:
-            row = dict(e)
-            if "refunded_invoice_numbers" in row and isinstance(row["refunded_invoice_numbers"], list):
-                row["refunded_invoice_numbers"] = ";".join(str(x) for x in row["refunded_invoice_numbers"] if x)
-            row["note_added"] = "yes" if row.get("note_added") else "no"
-            row["billing_cleared"] = "yes" if row.get("billing_cleared") else "no"
-            row["dry_run"] = "yes" if row.get("dry_run") else "no"
-            w.writerow(row)
+            writer.write(e)
 
 
 def main() -> int:
@@ -380,12 +1201,69 @@ def main() -> int:
         help="Output log CSV path (default: expire_refund_script_log_yyyymmdd_hhmmss.csv in Downloads)",
     )
     parser.add_argument("--dry-run", "-n", action="store_true", help="Do not call mutating APIs; only log what would be done")
+    parser.add_argument(
+        "--workers", "-w",
+        type=int,
+        default=1,
+        help="Number of rows processed in parallel (default: 1). Rows for the same account_cd always share a worker.",
+    )
+    parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=None,
+        help="Ceiling on Recurly requests/sec across all workers (default: paced from X-RateLimit-* headers only)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume an interrupted run: replay the journal next to --log and skip steps already done",
+    )
+    parser.add_argument(
+        "--invoice-cache",
+        default=DEFAULT_CACHE_PATH,
+        help=f"SQLite invoice cache shared with list_subscription_invoices.py (default: {DEFAULT_CACHE_PATH})",
+    )
+    parser.add_argument(
+        "--cache-ttl-hours",
+        type=float,
+        default=DEFAULT_TTL_HOURS,
+        help=f"Max age of cached invoice listings (default: {DEFAULT_TTL_HOURS:g})",
+    )
+    parser.add_argument("--no-invoice-cache", action="store_true", help="Always list invoices from Recurly")
+    parser.add_argument(
+        "--transport",
+        choices=("sync", "async"),
+        default="sync",
+        help="sync: recurly.Client, one thread per worker (default). "
+        "async: aiohttp client on one event loop; --workers then sets concurrent rows (e.g. 200).",
+    )
+    parser.add_argument(
+        "--plan-only",
+        action="store_true",
+        help="Run the read-only pre-flight, print the planned Recurly call counts, and exit",
+    )
+    parser.add_argument(
+        "--no-preflight",
+        action="store_true",
+        help="Skip the pre-flight state lookup; every row attempts terminate and billing clear",
+    )
     args = parser.parse_args()
 
+    if args.plan_only and args.no_preflight:
+        print("--plan-only needs the pre-flight; drop --no-preflight", file=sys.stderr)
+        return 1
+
+    if args.workers < 1:
+        print("--workers must be at least 1", file=sys.stderr)
+        return 1
+
     if args.log is None:
+        if args.resume:
+            print("--resume needs --log pointing at the log of the run to resume", file=sys.stderr)
+            return 1
         args.log = _default_log_path()
 
-    if recurly is None:
+    if args.transport == "sync" and recurly is None:
         print("recurly package not installed. pip install recurly~=4.40", file=sys.stderr)
         return 1
 
@@ -397,48 +1275,85 @@ def main() -> int:
         return 1
 
     try:
-        rows = load_input(args.input)
+        rows = iter_input(args.input)
     except Exception as e:
         print(f"Load input failed: {e}", file=sys.stderr)
         return 1
 
-    client = recurly.Client(RECURLY_API_KEY)
-    log_entries = []
     run_date = datetime.now().date()
-
-    for i, row in enumerate(rows):
-        log_entry = {}
+    limiter = RateLimiter(max_rate=args.max_rate)
+    journal_path = journal_path_for(args.log)
+    journal = None
+    # --plan-only writes nothing; it only reads the journal to leave out rows a resumed run would skip
+    if not args.plan_only or args.resume:
         try:
-            process_row(
-                client,
-                row,
-                log_entry,
-                dry_run=args.dry_run,
-                run_date=run_date,
-                row_index=i + 1,
+            journal = RunJournal(
+                journal_path,
+                {"input": str(args.input), "dry_run": args.dry_run, "started": datetime.now().isoformat()},
+                resume=args.resume,
             )
         except Exception as e:
-            log_entry["account_cd"] = row.get("account_cd", "")
-            log_entry["subscription_guid"] = row.get("subscription_guid", "")
-            log_entry["subscription_state"] = ""
-            log_entry["note_added"] = False
-            log_entry["billing_cleared"] = False
-            log_entry["refunded_invoice_numbers"] = []
-            log_entry["dry_run"] = args.dry_run
-            log_entry["error"] = str(e)
-        log_entries.append(log_entry)
-        if log_entry.get("error"):
-            print(f"Row {i + 1} ({log_entry.get('account_cd', '')}): {log_entry['error']}", file=sys.stderr)
+            print(f"Open journal failed: {e}", file=sys.stderr)
+            return 1
+    cache = None if args.no_invoice_cache else InvoiceCache(args.invoice_cache, args.cache_ttl_hours)
+    if args.resume:
+        print(f"Resuming from {journal_path}: {journal.resumed_rows} rows already completed")
+
+    notes = AccountNoteIndex(run_date)
+    plan = None
+    if not args.no_preflight:
+        # The pre-flight reads the input file on its own; execution then streams `rows` as before
+        plan_rows = iter_input(args.input)
+        if args.transport == "async":
+            plan = asyncio.run(_plan_async(args, plan_rows, limiter, journal, cache, notes))
+        else:
+            plan = build_plan(
+                lambda: throttle_client(recurly.Client(RECURLY_API_KEY), limiter),
+                plan_rows,
+                workers=args.workers,
+                cache=cache,
+                journal=journal,
+                notes=notes,
+            )
+        for line in plan.report():
+            print(line)
+        if args.plan_only:
+            if journal is not None:
+                journal.close()
+            print(f"Recurly API: {limiter.summary()}")
+            if cache is not None:
+                print(f"Invoice cache: {cache.summary()}")
+                cache.close()
+            return 0
 
     try:
-        write_log(args.log, log_entries)
-    except Exception as e:
+        with journal, LogWriter(args.log) as log_writer:
+            if args.transport == "async":
+                asyncio.run(_run_async(args, rows, limiter, log_writer, run_date, journal, cache, plan, notes))
+            else:
+                for log_entry in run_rows(
+                    lambda: throttle_client(recurly.Client(RECURLY_API_KEY), limiter),
+                    rows,
+                    workers=args.workers,
+                    dry_run=args.dry_run,
+                    run_date=run_date,
+                    journal=journal,
+                    cache=cache,
+                    plan=plan,
+                    notes=notes,
+                ):
+                    log_writer.write(log_entry)
+    except OSError as e:
         print(f"Write log failed: {e}", file=sys.stderr)
         return 1
 
-    print(f"Done. Processed {len(rows)} rows; log written to {args.log}")
+    print(f"Done. Processed {log_writer.count} rows; log written to {args.log} (journal: {journal_path})")
+    print(f"Recurly API: {limiter.summary()}")
+    print(f"Account notes: {notes.summary()}")
+    if cache is not None:
+        print(f"Invoice cache: {cache.summary()}")
+        cache.close()
     return 0
 
-
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Local fake Recurly v3 API for exercising rate limiting and retries without
+touching a real site.
+
+Serves the endpoints the api/ scripts use (list subscription invoices,
+terminate/get subscription, get/remove billing info, list/create account notes,
+refund invoice) with Recurly-shaped JSON and X-RateLimit-* headers. Terminated
+subscriptions, removed billing info and created notes are remembered, so a second
+run over the same input sees them as expired / cleared / noted. Each account also
+starts with a history of older notes, listed newest first in pages of 20, and each
+subscription with two years of monthly charge invoices and a credit; invoice listings
+honor type, sort, order, begin_time / end_time and limit like Recurly's. Requests
+over the per-window quota get a 429 rate_limited error; --error-rate injects
+random 503s.
+
+Run the adaptive throttle against it (needs the recurly package):
+  python api/fake_recurly_server.py --demo --workers 8 --requests 600 --limit 200 --window 10
+
+or serve it standalone and point a client at it with point_client_at():
+  python api/fake_recurly_server.py --port 8765
+"""
+
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+DEFAULT_PORT = 8765
+NOTES_PAGE_SIZE = 20
+INVOICES_PAGE_SIZE = 20
+
+
+class _Quota:
+    """Fixed-window request quota, like Recurly's per-site limit."""
+
+    def __init__(self, limit: int, window: float) -> None:
+        self.limit = limit
+        self.window = window
+        self._lock = threading.Lock()
+        self._window_start = time.time()
+        self._used = 0
+        self.served = 0
+        self.rejected = 0
+        self.recent: deque = deque(maxlen=10000)
+
+    def take(self) -> Tuple[bool, int, int]:
+        """Return (allowed, remaining, reset_epoch)."""
+        with self._lock:
+            now = time.time()
+            if now - self._window_start >= self.window:
+                self._window_start = now
+                self._used = 0
+            reset = int(self._window_start + self.window) + 1
+            if self._used >= self.limit:
+                self.rejected += 1
+                return False, 0, reset
+            self._used += 1
+            self.served += 1
+            self.recent.append(now)
+            return True, self.limit - self._used, reset
+
+
+def _timestamp(at: datetime) -> str:
+    return at.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _invoice(n: int, created: datetime, invoice_type: str = "charge") -> Dict[str, Any]:
+    return {
+        "object": "invoice",
+        "id": uuid.uuid4().hex[:12],
+        "number": str(100000 + n),
+        "type": invoice_type,
+        "state": "paid",
+        "currency": "USD",
+        "total": 9.99 if invoice_type == "charge" else -9.99,
+        "billed_at": _timestamp(created),
+        "created_at": _timestamp(created),
+        "updated_at": _timestamp(created),
+    }
+
+
+def _parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _list_invoices(invoices: List[Dict[str, Any]], query: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+    """Apply Recurly's list filters (type, begin_time / end_time on the sort field, sort, order)."""
+    sort = query.get("sort", ["created_at"])[0]
+    data = [inv for inv in invoices if "type" not in query or inv["type"] == query["type"][0]]
+    if "begin_time" in query:
+        begin = _parse_time(query["begin_time"][0])
+        data = [inv for inv in data if _parse_time(inv[sort]) >= begin]
+    if "end_time" in query:
+        end = _parse_time(query["end_time"][0])
+        data = [inv for inv in data if _parse_time(inv[sort]) <= end]
+    return sorted(data, key=lambda inv: inv[sort], reverse=query.get("order", ["desc"])[0] == "desc")
+
+
+def _page(data: list, next_path: Optional[str] = None) -> Dict[str, Any]:
+    return {"object": "list", "has_more": next_path is not None, "next": next_path, "data": data}
+
+
+def _note(message: str, created: datetime) -> Dict[str, Any]:
+    return {
+        "object": "account_note",
+        "id": uuid.uuid4().hex[:12],
+        "message": message,
+        "created_at": _timestamp(created),
+    }
+
+
+class _State:
+    """What the scripts changed: terminated subscriptions and accounts without billing info."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.expired: set = set()
+        self.billing_removed: set = set()
+        self.notes: Dict[str, List[Dict[str, Any]]] = {}
+        self.invoices: Dict[str, List[Dict[str, Any]]] = {}
+
+    def subscription_invoices(self, sub_id: str, history: int) -> List[Dict[str, Any]]:
+        """Invoices of a subscription: `history` monthly renewals ending today, plus one credit invoice."""
+        if sub_id not in self.invoices:
+            now = datetime.now(timezone.utc)
+            invoices = [_invoice(n, now - timedelta(days=30 * n)) for n in range(history)]
+            invoices.append(_invoice(history, now - timedelta(days=15), "credit"))
+            self.invoices[sub_id] = invoices
+        return self.invoices[sub_id]
+
+    def account_notes(self, account_id: str, history: int) -> List[Dict[str, Any]]:
+        """Notes of an account, newest first; seeded with `history` daily notes ending yesterday."""
+        if account_id not in self.notes:
+            now = datetime.now(timezone.utc)
+            self.notes[account_id] = [_note(f"older note {n}", now - timedelta(days=n + 1)) for n in range(history)]
+        return self.notes[account_id]
+
+
+class FakeRecurlyHandler(BaseHTTPRequestHandler):
+    quota: _Quota
+    state: _State
+    error_rate = 0.0
+    invoices_per_subscription = 24
+    notes_per_account = 60
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002 - BaseHTTPRequestHandler API
+        pass
+
+    def _send(self, status: int, body: Optional[Dict[str, Any]], remaining: int, reset: int) -> None:
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("X-Request-Id", uuid.uuid4().hex)
+        self.send_header("X-RateLimit-Limit", str(self.quota.limit))
+        self.send_header("X-RateLimit-Remaining", str(remaining))
+        self.send_header("X-RateLimit-Reset", str(reset))
+        self.end_headers()
+        if payload:
+            self.wfile.write(payload)
+
+    def _error(self, status: int, err_type: str, message: str, remaining: int, reset: int) -> None:
+        self._send(status, {"error": {"type": err_type, "message": message}}, remaining, reset)
+
+    def _handle(self, method: str) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        allowed, remaining, reset = self.quota.take()
+        if not allowed:
+            self._error(429, "rate_limited", "You made too many API requests", remaining, reset)
+            return
+        if self.error_rate and random.random() < self.error_rate:
+            self._error(503, "service_unavailable", "Injected failure", remaining, reset)
+            return
+
+        parts = [p for p in self.path.split("?")[0].split("/") if p]
+        if method == "GET" and len(parts) == 3 and parts[0] == "subscriptions" and parts[2] == "invoices":
+            query = parse_qs(urlsplit(self.path).query)
+            with self.state.lock:
+                data = _list_invoices(self.state.subscription_invoices(parts[1], self.invoices_per_subscription), query)
+            start = int(query.get("cursor", ["0"])[0])
+            end = start + int(query.get("limit", [str(INVOICES_PAGE_SIZE)])[0])
+            next_query = {k: v[0] for k, v in query.items() if k != "cursor"}
+            next_query["cursor"] = str(end)
+            next_path = f"/subscriptions/{parts[1]}/invoices?{urlencode(next_query)}" if end < len(data) else None
+            self._send(200, _page(data[start:end], next_path), remaining, reset)
+        elif len(parts) == 2 and parts[0] == "subscriptions" and method in ("GET", "DELETE"):
+            with self.state.lock:
+                expired = parts[1] in self.state.expired
+                if method == "DELETE":
+                    self.state.expired.add(parts[1])
+            if method == "DELETE" and expired:
+                self._error(400, "invalid_transition", "Subscription is already expired", remaining, reset)
+                return
+            state = "expired" if expired or method == "DELETE" else "active"
+            self._send(200, {"object": "subscription", "id": parts[1], "state": state}, remaining, reset)
+        elif len(parts) == 3 and parts[0] == "accounts" and parts[2] == "notes":
+            with self.state.lock:
+                notes = self.state.account_notes(parts[1], self.notes_per_account)
+                if method == "GET":
+                    start = int(parse_qs(urlsplit(self.path).query).get("cursor", ["0"])[0])
+                    end = start + NOTES_PAGE_SIZE
+                    next_path = f"/accounts/{parts[1]}/notes?cursor={end}" if end < len(notes) else None
+                    body = _page(notes[start:end], next_path)
+                else:
+                    body = _note("note", datetime.now(timezone.utc))
+                    notes.insert(0, body)
+            self._send(200 if method == "GET" else 201, body, remaining, reset)
+        elif len(parts) == 3 and parts[0] == "accounts" and parts[2] == "billing_info" and method in ("GET", "DELETE"):
+            with self.state.lock:
+                removed = parts[1] in self.state.billing_removed
+                if method == "DELETE":
+                    self.state.billing_removed.add(parts[1])
+            if removed:
+                self._error(404, "not_found", f"Couldn't find BillingInfo with account_id = {parts[1]}", remaining, reset)
+            elif method == "DELETE":
+                self._send(204, None, remaining, reset)
+            else:
+                self._send(200, {"object": "billing_info", "account_id": parts[1], "valid": True}, remaining, reset)
+        elif method == "POST" and len(parts) == 3 and parts[0] == "invoices" and parts[2] == "refund":
+            self._send(201, {"object": "invoice", "id": uuid.uuid4().hex[:12], "type": "credit"}, remaining, reset)
+        else:
+            self._error(404, "not_found", f"Couldn't find resource {self.path}", remaining, reset)
+
+    def do_GET(self) -> None:
+        self._handle("GET")
+
+    def do_POST(self) -> None:
+        self._handle("POST")
+
+    def do_PUT(self) -> None:
+        self._handle("PUT")
+
+    def do_DELETE(self) -> None:
+        self._handle("DELETE")
+
+
+def start_server(
+    port: int = DEFAULT_PORT,
+    limit: int = 200,
+    window: float = 10.0,
+    error_rate: float = 0.0,
+) -> Tuple[ThreadingHTTPServer, _Quota]:
+    """Start the fake server on a background thread; returns (server, quota)."""
+    quota = _Quota(limit, window)
+    handler = type(
+        "BoundFakeRecurlyHandler",
+        (FakeRecurlyHandler,),
+        {"quota": quota, "state": _State(), "error_rate": error_rate},
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, name="fake-recurly", daemon=True).start()
+    return server, quota
+
+
+def point_client_at(client: Any, host: str = "127.0.0.1", port: int = DEFAULT_PORT) -> Any:
+    """Swap a recurly.Client's HTTPS connection for plain HTTP to the fake server."""
+    client._BaseClient__conn = http.client.HTTPConnection(host, port, timeout=30)
+    return client
+
+
+def _demo(args: argparse.Namespace) -> int:
+    """Hammer the fake server from several throttled clients and report 429s and throughput."""
+    try:
+        import recurly
+    except ImportError:
+        print("recurly package not installed. pip install recurly~=4.40", file=sys.stderr)
+        return 1
+    from recurly_throttle import RateLimiter, throttle_client
+
+    server, quota = start_server(args.port, args.limit, args.window, args.error_rate)
+    limiter = RateLimiter(max_rate=args.max_rate)
+    counter = iter(range(args.requests))
+    counter_lock = threading.Lock()
+    failures = []
+
+    def _work() -> None:
+        client = throttle_client(point_client_at(recurly.Client("fake-key"), port=args.port), limiter)
+        while True:
+            with counter_lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            try:
+                list(client.list_subscription_invoices(f"uuid-{n}").items())
+            except Exception as e:
+                failures.append(e)
+
+    start = time.time()
+    threads = [threading.Thread(target=_work) for _ in range(args.workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    server.shutdown()
+
+    print(f"Completed {args.requests - len(failures)}/{args.requests} calls in {elapsed:.1f}s "
+          f"({(args.requests - len(failures)) / elapsed:.1f}/s; quota {args.limit / args.window:.1f}/s)")
+    print(f"Server: served={quota.served} rejected_429={quota.rejected}")
+    print(f"Client: {limiter.summary()}")
+    return 0 if not failures else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Fake Recurly API with rate-limit headers (local testing only).")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--limit", type=int, default=200, help="Requests allowed per window (default: 200)")
+    parser.add_argument("--window", type=float, default=10.0, help="Window length in seconds (default: 10)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--demo", action="store_true", help="Run throttled clients against the server and report")
+    parser.add_argument("--workers", type=int, default=8, help="Demo: concurrent clients (default: 8)")
+    parser.add_argument("--requests", type=int, default=600, help="Demo: total list calls (default: 600)")
+    parser.add_argument("--max-rate", type=float, default=None, help="Demo: client-side ceiling in requests/sec")
+    args = parser.parse_args()
+
+    if args.demo:
+        return _demo(args)
+
+    server, _ = start_server(args.port, args.limit, args.window, args.error_rate)
+    print(f"Fake Recurly listening on http://127.0.0.1:{args.port} (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
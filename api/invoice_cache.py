@@ -0,0 +1,159 @@
+"""
+On-disk cache of Recurly subscription invoice listings, shared by the api/ scripts.
+
+Keyed by the subscription id used in the API call (e.g. "uuid-..."), stored in a
+small SQLite file with a TTL, so a "list, review, then expire/refund" workflow
+pages through each subscription's invoices once: list_subscription_invoices.py
+fills the cache and expire_subscriptions.py reads it (and vice versa). A
+successful refund invalidates the subscription's entry, since it adds a credit
+invoice and changes what is eligible.
+
+Listings are stored per scope: the full listing (no filters) or a server-side
+filtered one (e.g. type=charge since a date). A lookup for a filtered scope is
+also served from a fresh full listing, since callers re-check their filters
+client-side.
+
+Cached invoices keep only the fields the scripts read (number, id, type, total,
+currency and the date fields) and come back as attribute objects, so callers
+use getattr() on them exactly like recurly Invoice resources.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+from urllib.parse import urlencode
+
+
+DEFAULT_CACHE_PATH = os.environ.get(
+    "RECURLY_INVOICE_CACHE",
+    str(Path.home() / ".cache" / "pplus-payments" / "recurly_invoice_cache.sqlite"),
+)
+DEFAULT_TTL_HOURS = 12.0
+
+INVOICE_FIELDS = (
+    "id", "number", "type", "state", "total", "currency",
+    "billed_at", "closed_at", "updated_at", "created_at",
+)
+
+
+# Paging options that do not change which invoices a listing contains
+_UNSCOPED_PARAMS = ("limit",)
+
+
+def listing_scope(params: Optional[Dict[str, Any]] = None) -> str:
+    """Cache scope for a listing request: "" for the full listing, else the filter params."""
+    scoped = {k: v for k, v in (params or {}).items() if k not in _UNSCOPED_PARAMS}
+    return urlencode(sorted(scoped.items()))
+
+
+def _invoice_record(inv: Any) -> dict:
+    """Plain JSON-safe dict of the invoice fields the scripts use."""
+    rec = {}
+    for field in INVOICE_FIELDS:
+        val = getattr(inv, field, None)
+        if val is not None and hasattr(val, "isoformat"):
+            val = val.isoformat()
+        rec[field] = val
+    return rec
+
+
+class InvoiceCache:
+    """SQLite-backed invoice listing cache with TTL and hit/miss counters (thread-safe)."""
+
+    def __init__(self, path: Union[str, Path] = DEFAULT_CACHE_PATH, ttl_hours: float = DEFAULT_TTL_HOURS) -> None:
+        self.path = Path(path)
+        self.ttl_seconds = ttl_hours * 3600
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS invoice_listings ("
+            " subscription_id TEXT NOT NULL,"
+            " scope TEXT NOT NULL,"
+            " fetched_at REAL NOT NULL,"
+            " invoices TEXT NOT NULL,"
+            " PRIMARY KEY (subscription_id, scope))"
+        )
+
+    def get(self, subscription_id: str, scope: str = "") -> Optional[List[SimpleNamespace]]:
+        """
+        Cached invoices for the subscription and scope, or None on a miss or expired entry.
+        A filtered scope falls back to a fresh full listing.
+        """
+        scopes = (scope, "") if scope else ("",)
+        with self._lock:
+            found = None
+            for candidate in scopes:
+                cur = self._conn.execute(
+                    "SELECT fetched_at, invoices FROM invoice_listings WHERE subscription_id = ? AND scope = ?",
+                    (subscription_id, candidate),
+                )
+                row = cur.fetchone()
+                if row is not None and time.time() - row[0] <= self.ttl_seconds:
+                    found = row
+                    break
+            if found is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return [SimpleNamespace(**rec) for rec in json.loads(found[1])]
+
+    def put(self, subscription_id: str, invoices: Iterable[Any], scope: str = "") -> List[SimpleNamespace]:
+        """Store an invoice listing for a subscription and scope; returns the cached form."""
+        records = [_invoice_record(inv) for inv in invoices]
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO invoice_listings (subscription_id, scope, fetched_at, invoices) VALUES (?, ?, ?, ?)",
+                (subscription_id, scope, time.time(), json.dumps(records)),
+            )
+        return [SimpleNamespace(**rec) for rec in records]
+
+    def invalidate(self, subscription_id: str) -> None:
+        """Drop every cached listing (all scopes) for the subscription."""
+        with self._lock:
+            self._conn.execute("DELETE FROM invoice_listings WHERE subscription_id = ?", (subscription_id,))
+            self.invalidations += 1
+
+    def summary(self) -> str:
+        return f"hits={self.hits} misses={self.misses} invalidations={self.invalidations} ({self.path})"
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+async def fetch_invoices(
+    api: Any,
+    subscription_id: str,
+    cache: Optional[InvoiceCache] = None,
+    params: Optional[Dict[str, Any]] = None,
+    stop: Optional[Callable[[Any], bool]] = None,
+) -> List[Any]:
+    """
+    Invoices for a subscription: from the cache when fresh, otherwise paged from
+    list_subscription_invoices on the transport `api` (with optional server-side filter
+    `params`) and stored. Paging ends at the first invoice for which `stop` returns True
+    (that invoice is dropped); use it with a sorted listing. Without a cache, returns the
+    raw resources.
+    """
+    scope = listing_scope(params)
+    if cache is not None:
+        cached = cache.get(subscription_id, scope)
+        if cached is not None:
+            return cached
+    kwargs = {"params": params} if params else {}
+    invoices = await api.items("list_subscription_invoices", subscription_id, stop=stop, **kwargs)
+    if cache is None:
+        return invoices
+    return cache.put(subscription_id, invoices, scope)
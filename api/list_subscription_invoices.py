@@ -18,12 +18,16 @@ not pre-encode—the client sends Basic base64(api_key + ":").
 from __future__ import annotations
 
 import argparse
+import asyncio
 import csv
 import os
 import sys
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Union
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Union
 
 RECURLY_KEY_FILE = "/Users/gregory.hamilton/Desktop/Creds/recurly_us_sbx.txt"
 DEFAULT_CSV = "/Users/gregory.hamilton/Downloads/expire_refund_script_test.csv"
@@ -51,6 +55,11 @@ try:
 except ImportError:
     recurly = None
 
+from invoice_cache import DEFAULT_CACHE_PATH, DEFAULT_TTL_HOURS, InvoiceCache, fetch_invoices
+from recurly_async import AsyncRecurlyClient
+from recurly_throttle import RateLimiter, throttle_client
+from recurly_transport import AsyncTransport, SyncTransport, run_sync
+
 
 def _subscription_id(value: str) -> str:
     """Return subscription_id for API: add uuid- prefix if value looks like a UUID."""
@@ -63,17 +72,34 @@ def _subscription_id(value: str) -> str:
     return s
 
 
-def load_subscriptions(csv_path: Union[str, Path]) -> List[Dict[str, Any]]:
-    """Load CSV with at least subscription_guid; optionally account_cd."""
+def iter_subscriptions(csv_path: Union[str, Path]) -> Iterator[Dict[str, Any]]:
+    """
+    Stream CSV rows with at least subscription_guid; optionally account_cd.
+
+    The header (and first row) are checked before this returns, so validation errors are
+    raised up front; remaining rows are read lazily as the caller consumes them.
+    """
     path = Path(csv_path)
     if not path.exists():
         raise FileNotFoundError(f"CSV not found: {path}")
-    with open(path, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        rows = list(reader)
-    if not rows or "subscription_guid" not in rows[0]:
+    f = open(path, newline="", encoding="utf-8")
+    reader = csv.DictReader(f)
+    first = next(reader, None)
+    if first is None or "subscription_guid" not in first:
+        f.close()
         raise ValueError("CSV must have column: subscription_guid")
-    return rows
+
+    def _rows() -> Iterator[Dict[str, Any]]:
+        with f:
+            yield first
+            yield from reader
+
+    return _rows()
+
+
+def load_subscriptions(csv_path: Union[str, Path]) -> List[Dict[str, Any]]:
+    """Load CSV with at least subscription_guid; optionally account_cd."""
+    return list(iter_subscriptions(csv_path))
 
 
 def _format_billed_at(billed_at: Any) -> str:
@@ -89,37 +115,157 @@ def _format_billed_at(billed_at: Any) -> str:
         return str(billed_at)[:10] if billed_at else ""
 
 
+async def invoice_details(api: Any, subscription_id: str, cache: Optional[InvoiceCache] = None) -> List[Dict[str, Any]]:
+    """
+    Call Recurly list_subscription_invoices on either transport (or read the shared invoice
+    cache); return list of dicts with invoice_number, total, currency, billed_date.
+    See: https://recurly.com/developers/api/v2021-02-25/index.html#tag/invoice
+    """
+    # Page size only; the full listing is what gets cached for expire_subscriptions.py
+    return [_invoice_details(inv) for inv in await fetch_invoices(api, subscription_id, cache, params={"limit": 200})]
+
+
 def get_invoice_details_for_subscription(
-    client: Any, subscription_id: str
+    client: Any, subscription_id: str, cache: Optional[InvoiceCache] = None
 ) -> List[Dict[str, Any]]:
+    """invoice_details on a recurly.Client."""
+    return run_sync(invoice_details(SyncTransport(client), subscription_id, cache))
+
+
+def _invoice_details(inv: Any) -> Dict[str, Any]:
+    num = getattr(inv, "number", None)
+    inv_number = str(num) if num is not None else (getattr(inv, "id", None) or "")
+    total = getattr(inv, "total", None)
+    if total is not None and not isinstance(total, str):
+        amount = f"{float(total):.2f}"
+    else:
+        amount = str(total) if total is not None else ""
+    currency = (getattr(inv, "currency", None) or "").strip() or ""
+    billed_at = getattr(inv, "billed_at", None) or getattr(inv, "created_at", None)
+    billed_date = _format_billed_at(billed_at)
+    return {
+        "invoice_number": inv_number,
+        "amount": amount,
+        "currency_cd": currency,
+        "billed_date": billed_date,
+    }
+
+
+OUTPUT_FIELDS = [
+    "account_cd", "subscription_guid", "invoice_number",
+    "amount", "currency_cd", "billed_date", "error",
+]
+
+
+def _result_row(account_cd: str, subscription_guid: str, inv: Optional[Dict[str, Any]] = None, error: str = "") -> Dict[str, Any]:
+    inv = inv or {}
+    return {
+        "account_cd": account_cd,
+        "subscription_guid": subscription_guid,
+        "invoice_number": inv.get("invoice_number", ""),
+        "amount": inv.get("amount", ""),
+        "currency_cd": inv.get("currency_cd", ""),
+        "billed_date": inv.get("billed_date", ""),
+        "error": error,
+    }
+
+
+async def subscription_rows(api: Any, row: Dict[str, Any], cache: Optional[InvoiceCache] = None) -> List[Dict[str, Any]]:
+    """Output rows for one input row, on either transport: one per invoice, or a single blank/error row."""
+    subscription_guid = (row.get("subscription_guid") or "").strip()
+    account_cd = (row.get("account_cd") or "").strip()
+    sub_id = _subscription_id(subscription_guid)
+    if not sub_id:
+        return [_result_row(account_cd, subscription_guid, error="missing subscription_guid")]
+    try:
+        invoices = await invoice_details(api, sub_id, cache)
+    except Exception as e:
+        print(f"Error for {subscription_guid}: {e}", file=sys.stderr)
+        return [_result_row(account_cd, subscription_guid, error=str(e))]
+    if not invoices:
+        return [_result_row(account_cd, subscription_guid)]
+    return [_result_row(account_cd, subscription_guid, inv) for inv in invoices]
+
+
+def rows_for_subscription(client: Any, row: Dict[str, Any], cache: Optional[InvoiceCache] = None) -> List[Dict[str, Any]]:
+    """subscription_rows on a recurly.Client."""
+    return run_sync(subscription_rows(SyncTransport(client), row, cache))
+
+
+def list_rows(
+    client_factory: Callable[[], Any],
+    rows: Iterable[Dict[str, Any]],
+    workers: int = 1,
+    cache: Optional[InvoiceCache] = None,
+) -> Iterator[List[Dict[str, Any]]]:
     """
-    Call Recurly list_subscription_invoices; return list of dicts with
-    invoice_number, total, currency, billed_date.
-    See: https://recurly.com/developers/api/v2021-02-25/index.html#tag/invoice
+    Yield the output rows for each input row, in input order, listing up to `workers`
+    subscriptions at a time. Each worker thread gets its own client (recurly.Client holds
+    a single HTTPS connection), and at most a few subscriptions per worker are in flight,
+    so memory stays bounded however long the input is.
+    """
+    if workers <= 1:
+        client = client_factory()
+        for row in rows:
+            yield rows_for_subscription(client, row, cache)
+        return
+
+    local = threading.local()
+
+    def _task(row: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if getattr(local, "client", None) is None:
+            local.client = client_factory()
+        return rows_for_subscription(local.client, row, cache)
+
+    pending: Deque[Future] = deque()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="invoice-worker") as pool:
+        for row in rows:
+            pending.append(pool.submit(_task, row))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+async def list_rows_async(
+    client: Any,
+    rows: Iterable[Dict[str, Any]],
+    workers: int = 1,
+    cache: Optional[InvoiceCache] = None,
+) -> AsyncIterator[List[Dict[str, Any]]]:
     """
-    out = []
+    list_rows on one event loop: up to `workers` subscriptions in flight on the shared
+    async client, results yielded in input order.
+    """
+    api = AsyncTransport(client)
+    pending: Deque["asyncio.Task[List[Dict[str, Any]]]"] = deque()
     try:
-        pager = client.list_subscription_invoices(subscription_id)
-        for inv in pager.items():
-            num = getattr(inv, "number", None)
-            inv_number = str(num) if num is not None else (getattr(inv, "id", None) or "")
-            total = getattr(inv, "total", None)
-            if total is not None and not isinstance(total, str):
-                amount = f"{float(total):.2f}"
-            else:
-                amount = str(total) if total is not None else ""
-            currency = (getattr(inv, "currency", None) or "").strip() or ""
-            billed_at = getattr(inv, "billed_at", None) or getattr(inv, "created_at", None)
-            billed_date = _format_billed_at(billed_at)
-            out.append({
-                "invoice_number": inv_number,
-                "amount": amount,
-                "currency_cd": currency,
-                "billed_date": billed_date,
-            })
-    except Exception:
-        raise
-    return out
+        for row in rows:
+            pending.append(asyncio.create_task(subscription_rows(api, row, cache)))
+            if len(pending) >= workers:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _write_rows_async(
+    args: argparse.Namespace,
+    rows: Iterable[Dict[str, Any]],
+    limiter: RateLimiter,
+    cache: Optional[InvoiceCache],
+    w: csv.DictWriter,
+    f: Any,
+) -> int:
+    written = 0
+    async with AsyncRecurlyClient(RECURLY_API_KEY, limiter, max_connections=args.workers) as client:
+        async for result_rows in list_rows_async(client, rows, workers=args.workers, cache=cache):
+            w.writerows(result_rows)
+            f.flush()
+            written += len(result_rows)
+    return written
 
 
 def main() -> int:
@@ -136,9 +282,44 @@ def main() -> int:
         default=DEFAULT_OUTPUT_CSV,
         help=f"Output CSV path (default: {DEFAULT_OUTPUT_CSV})",
     )
+    parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=None,
+        help="Ceiling on Recurly requests/sec (default: paced from X-RateLimit-* headers only)",
+    )
+    parser.add_argument(
+        "--invoice-cache",
+        default=DEFAULT_CACHE_PATH,
+        help=f"SQLite invoice cache shared with expire_subscriptions.py (default: {DEFAULT_CACHE_PATH})",
+    )
+    parser.add_argument(
+        "--cache-ttl-hours",
+        type=float,
+        default=DEFAULT_TTL_HOURS,
+        help=f"Max age of cached invoice listings (default: {DEFAULT_TTL_HOURS:g})",
+    )
+    parser.add_argument("--no-invoice-cache", action="store_true", help="Always list invoices from Recurly")
+    parser.add_argument(
+        "--workers", "-w",
+        type=int,
+        default=1,
+        help="Number of subscriptions listed concurrently (default: 1)",
+    )
+    parser.add_argument(
+        "--transport",
+        choices=("sync", "async"),
+        default="sync",
+        help="sync: recurly.Client, one thread per worker (default). "
+        "async: aiohttp client on one event loop; --workers can then be in the hundreds.",
+    )
     args = parser.parse_args()
 
-    if recurly is None:
+    if args.workers < 1:
+        print("--workers must be at least 1", file=sys.stderr)
+        return 1
+
+    if args.transport == "sync" and recurly is None:
         print("recurly package not installed. pip install recurly~=4.40", file=sys.stderr)
         return 1
 
@@ -150,75 +331,38 @@ def main() -> int:
         return 1
 
     try:
-        rows = load_subscriptions(args.input)
+        rows = iter_subscriptions(args.input)
     except Exception as e:
         print(f"Load input failed: {e}", file=sys.stderr)
         return 1
 
     # API key as username in Basic auth; client encodes as Authorization: Basic base64(key + ":")
-    client = recurly.Client(RECURLY_API_KEY)
-    results: List[Dict[str, Any]] = []
-
-    for row in rows:
-        subscription_guid = (row.get("subscription_guid") or "").strip()
-        account_cd = (row.get("account_cd") or "").strip()
-        sub_id = _subscription_id(subscription_guid)
-        if not sub_id:
-            results.append({
-                "account_cd": account_cd,
-                "subscription_guid": subscription_guid,
-                "invoice_number": "",
-                "amount": "",
-                "currency_cd": "",
-                "billed_date": "",
-                "error": "missing subscription_guid",
-            })
-            continue
-        try:
-            invoices = get_invoice_details_for_subscription(client, sub_id)
-            for inv in invoices:
-                results.append({
-                    "account_cd": account_cd,
-                    "subscription_guid": subscription_guid,
-                    "invoice_number": inv.get("invoice_number", ""),
-                    "amount": inv.get("amount", ""),
-                    "currency_cd": inv.get("currency_cd", ""),
-                    "billed_date": inv.get("billed_date", ""),
-                    "error": "",
-                })
-            if not invoices:
-                results.append({
-                    "account_cd": account_cd,
-                    "subscription_guid": subscription_guid,
-                    "invoice_number": "",
-                    "amount": "",
-                    "currency_cd": "",
-                    "billed_date": "",
-                    "error": "",
-                })
-        except Exception as e:
-            results.append({
-                "account_cd": account_cd,
-                "subscription_guid": subscription_guid,
-                "invoice_number": "",
-                "amount": "",
-                "currency_cd": "",
-                "billed_date": "",
-                "error": str(e),
-            })
-            print(f"Error for {subscription_guid}: {e}", file=sys.stderr)
-
-    fieldnames = [
-        "account_cd", "subscription_guid", "invoice_number",
-        "amount", "currency_cd", "billed_date", "error",
-    ]
+    limiter = RateLimiter(max_rate=args.max_rate)
+    cache = None if args.no_invoice_cache else InvoiceCache(args.invoice_cache, args.cache_ttl_hours)
     out_path = Path(args.output)
     out_path.parent.mkdir(parents=True, exist_ok=True)
+    written = 0
     with open(out_path, "w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+        w = csv.DictWriter(f, fieldnames=OUTPUT_FIELDS, extrasaction="ignore")
         w.writeheader()
-        w.writerows(results)
-    print(f"Wrote {len(results)} rows to {out_path}")
+        if args.transport == "async":
+            written = asyncio.run(_write_rows_async(args, rows, limiter, cache, w, f))
+        else:
+            for result_rows in list_rows(
+                lambda: throttle_client(recurly.Client(RECURLY_API_KEY), limiter),
+                rows,
+                workers=args.workers,
+                cache=cache,
+            ):
+                w.writerows(result_rows)
+                # Flush per subscription so an interrupted run keeps everything finished so far
+                f.flush()
+                written += len(result_rows)
+    print(f"Wrote {written} rows to {out_path}")
+    print(f"Recurly API: {limiter.summary()}")
+    if cache is not None:
+        print(f"Invoice cache: {cache.summary()}")
+        cache.close()
 
     return 0
 
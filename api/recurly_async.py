@@ -0,0 +1,213 @@
+"""
+asyncio Recurly v3 client for the calls the api/ scripts make.
+
+recurly.Client is blocking and holds one HTTPS connection, so concurrency costs a
+thread (and a connection) per in-flight request. AsyncRecurlyClient runs every
+request on one event loop over a shared aiohttp connection pool with keep-alive,
+so a single process can keep hundreds of requests in flight on one core.
+
+It implements only what the scripts use, with the same names and arguments as
+recurly.Client:
+  list_subscription_invoices, terminate_subscription, get_subscription,
+  get_billing_info, list_account_notes, create_account_note, remove_billing_info,
+  refund_invoice
+Results are attribute objects (getattr works as on recurly resources; dates stay
+ISO-8601 strings, which the scripts already parse). Errors raise
+RecurlyAsyncError with the same message text as the recurly client.
+
+Requests go through the shared RateLimiter and retry 429 / 5xx / network errors
+with the same policy as recurly_throttle.throttle_client.
+
+Needs aiohttp (pip install aiohttp). RECURLY_API_BASE_URL overrides the API host,
+e.g. http://127.0.0.1:8765 for api/fake_recurly_server.py.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, Optional
+from urllib.parse import quote
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from recurly_throttle import RateLimiter, backoff_delay, is_retryable
+
+API_BASE_URL = os.environ.get("RECURLY_API_BASE_URL", "https://v3.recurly.com")
+API_VERSION = "v2021-02-25"
+DEFAULT_MAX_CONNECTIONS = 100
+
+
+class RecurlyAsyncError(Exception):
+    """Recurly API error (or network failure, status 0) from the async client."""
+
+    def __init__(self, message: str, status: int, error_type: str = "") -> None:
+        super().__init__(message)
+        self.status = status
+        self.error_type = error_type
+
+
+def _resource(data: Any) -> Any:
+    """Top-level JSON object as an attribute object; nested values stay plain JSON."""
+    if isinstance(data, dict):
+        return SimpleNamespace(**data)
+    return data
+
+
+def _url_param(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (list, tuple)):
+        return ",".join(str(v) for v in value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+class AsyncPager:
+    """Lazy pager over a Recurly list endpoint; follows the `next` cursor page by page."""
+
+    def __init__(self, client: "AsyncRecurlyClient", path: str, params: Optional[Dict[str, Any]] = None) -> None:
+        self._client = client
+        self._path = path
+        self._params = params
+
+    async def items(self) -> AsyncIterator[Any]:
+        path: Optional[str] = self._path
+        params = self._params
+        while path:
+            page = await self._client._request("GET", path, params=params)
+            for item in page.get("data") or []:
+                yield _resource(item)
+            # `next` already carries the cursor and original query params
+            path = page.get("next") if page.get("has_more") else None
+            params = None
+
+
+class AsyncRecurlyClient:
+    """Pooled, rate-limited asyncio client; use as `async with AsyncRecurlyClient(key) as client`."""
+
+    def __init__(
+        self,
+        api_key: str,
+        limiter: Optional[RateLimiter] = None,
+        base_url: str = API_BASE_URL,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        timeout: float = 60.0,
+        max_retries: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+    ) -> None:
+        if aiohttp is None:
+            raise RuntimeError("aiohttp package not installed. pip install aiohttp")
+        self._api_key = api_key
+        self._limiter = limiter or RateLimiter()
+        self._base_url = base_url.rstrip("/")
+        self._max_connections = max_connections
+        self._timeout = timeout
+        self._max_retries = max_retries
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._session: Optional["aiohttp.ClientSession"] = None
+
+    async def __aenter__(self) -> "AsyncRecurlyClient":
+        connector = aiohttp.TCPConnector(limit=self._max_connections, keepalive_timeout=30)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            auth=aiohttp.BasicAuth(self._api_key, ""),
+            timeout=aiohttp.ClientTimeout(total=self._timeout),
+            headers={
+                "Accept": f"application/vnd.recurly.{API_VERSION}",
+                "Content-Type": "application/json",
+                "User-Agent": "pplus-payments-api-scripts (aiohttp)",
+            },
+        )
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _send(
+        self, method: str, path: str, params: Optional[Dict[str, Any]], body: Optional[Dict[str, Any]]
+    ) -> Any:
+        """One HTTP round trip; returns parsed JSON (or None) or raises RecurlyAsyncError."""
+        query = {k: _url_param(v) for k, v in params.items()} if params else None
+        try:
+            async with self._session.request(method, self._base_url + path, params=query, json=body) as resp:
+                self._limiter.observe(resp.headers)
+                payload = await resp.read()
+                if resp.status >= 400:
+                    request_id = resp.headers.get("X-Request-Id", "")
+                    error_type, message = "", f"Unexpected {resp.status} Error"
+                    if payload and "json" in resp.headers.get("Content-Type", ""):
+                        err = (await resp.json(content_type=None)).get("error") or {}
+                        error_type, message = err.get("type", ""), err.get("message", message)
+                    raise RecurlyAsyncError(
+                        f"{message}. Recurly Request Id: {request_id}", resp.status, error_type
+                    )
+                if not payload:
+                    return None
+                return await resp.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise RecurlyAsyncError(f"Network error: {e}", 0) from e
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        body: Optional[Dict[str, Any]] = None,
+    ) -> Any:
+        attempt = 0
+        while True:
+            await self._limiter.acquire_async()
+            try:
+                return await self._send(method, path, params, body)
+            except RecurlyAsyncError as e:
+                status = e.status if (e.status == 0 or e.status == 429 or e.status >= 500) else None
+                if not is_retryable(status, method) or attempt >= self._max_retries:
+                    raise
+                delay = backoff_delay(attempt, self._base_delay, self._max_delay)
+                if status == 429:
+                    self._limiter.backoff(delay)
+                self._limiter.record_retry(status == 429)
+                print(
+                    f"  Retrying {method} {path.split('?')[0]} after HTTP {e.status or 'network error'} "
+                    f"(attempt {attempt + 1}/{self._max_retries}, {delay:.1f}s)",
+                    file=sys.stderr,
+                )
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    # --- Endpoints used by the api/ scripts (same names/arguments as recurly.Client) ---
+
+    def list_subscription_invoices(self, subscription_id: str, params: Optional[Dict[str, Any]] = None) -> AsyncPager:
+        return AsyncPager(self, f"/subscriptions/{quote(subscription_id, safe='')}/invoices", params)
+
+    async def terminate_subscription(self, subscription_id: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        return _resource(await self._request("DELETE", f"/subscriptions/{quote(subscription_id, safe='')}", params))
+
+    async def get_subscription(self, subscription_id: str) -> Any:
+        return _resource(await self._request("GET", f"/subscriptions/{quote(subscription_id, safe='')}"))
+
+    async def get_billing_info(self, account_id: str) -> Any:
+        return _resource(await self._request("GET", f"/accounts/{quote(account_id, safe='')}/billing_info"))
+
+    def list_account_notes(self, account_id: str, params: Optional[Dict[str, Any]] = None) -> AsyncPager:
+        return AsyncPager(self, f"/accounts/{quote(account_id, safe='')}/notes", params)
+
+    async def create_account_note(self, account_id: str, body: Dict[str, Any]) -> Any:
+        return _resource(await self._request("POST", f"/accounts/{quote(account_id, safe='')}/notes", body=body))
+
+    async def remove_billing_info(self, account_id: str) -> Any:
+        return _resource(await self._request("DELETE", f"/accounts/{quote(account_id, safe='')}/billing_info"))
+
+    async def refund_invoice(self, invoice_id: str, body: Dict[str, Any]) -> Any:
+        return _resource(await self._request("POST", f"/invoices/{quote(invoice_id, safe='')}/refund", body=body))
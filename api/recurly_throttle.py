@@ -0,0 +1,223 @@
+"""
+Client-side pacing for the Recurly API, shared by the api/ scripts.
+
+Recurly enforces a per-site request quota and reports it on every response:
+  X-RateLimit-Limit      requests allowed in the current window
+  X-RateLimit-Remaining  requests left in the current window
+  X-RateLimit-Reset      epoch seconds when the window resets
+
+RateLimiter is a token bucket whose refill rate is re-sized from those headers
+(remaining / seconds until reset, minus some headroom), so a run spreads its
+remaining quota over the window instead of bursting into 429s. One limiter is
+shared by every worker/client in a process.
+
+throttle_client() wraps a recurly.Client so every request (including pager
+page fetches) first takes a token, and 429 / 5xx / network failures are
+retried with jittered exponential backoff instead of surfacing as row errors.
+recurly-client-python has no transport hook, so this wraps the client's
+_make_request and its connection's getresponse.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import random
+import sys
+import threading
+import time
+from typing import Any, Mapping, Optional
+
+try:
+    import recurly
+except ImportError:
+    recurly = None
+
+# Methods that are safe to repeat after a 5xx or dropped connection. POST
+# (create note, refund) is only retried on 429, where Recurly did not process it.
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE")
+
+DEFAULT_RATE = 5.0       # requests/sec before the first response headers arrive
+DEFAULT_BURST = 5
+MIN_RATE = 0.2           # never stall completely; 429 handling covers overshoot
+DEFAULT_HEADROOM = 0.9   # use up to 90% of the remaining quota
+
+
+def _int_header(headers: Mapping[str, Any], name: str) -> Optional[int]:
+    """Parse an integer header; None when missing or malformed."""
+    val = headers.get(name) if headers is not None else None
+    if val is None:
+        return None
+    try:
+        return int(str(val).strip())
+    except ValueError:
+        return None
+
+
+class RateLimiter:
+    """Thread-safe token bucket sized from Recurly's rate-limit headers."""
+
+    def __init__(
+        self,
+        rate: float = DEFAULT_RATE,
+        burst: int = DEFAULT_BURST,
+        max_rate: Optional[float] = None,
+        headroom: float = DEFAULT_HEADROOM,
+    ) -> None:
+        self._max_rate = max_rate
+        self._rate = min(rate, max_rate) if max_rate else rate
+        self._burst = max(1, burst)
+        self._headroom = headroom
+        self._tokens = float(self._burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.retries = 0
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(float(self._burst), self._tokens + elapsed * self._rate)
+            self._updated = now
+
+    def _try_acquire(self) -> float:
+        """Take a token if one is available; otherwise return how long to wait before retrying."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = self._blocked_until - now
+            if wait <= 0:
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self.requests += 1
+                    return 0.0
+                wait = (1 - self._tokens) / self._rate
+            return wait
+
+    def acquire(self) -> None:
+        """Block until a request may be sent."""
+        while (wait := self._try_acquire()) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        """Wait (without blocking the event loop) until a request may be sent."""
+        while (wait := self._try_acquire()) > 0:
+            await asyncio.sleep(wait)
+
+    def observe(self, headers: Mapping[str, Any]) -> None:
+        """Re-size the bucket from X-RateLimit-Remaining / X-RateLimit-Reset."""
+        remaining = _int_header(headers, "X-RateLimit-Remaining")
+        reset = _int_header(headers, "X-RateLimit-Reset")
+        if remaining is None or reset is None:
+            return
+        seconds = max(reset - time.time(), 1.0)
+        rate = max(remaining * self._headroom / seconds, MIN_RATE)
+        if self._max_rate:
+            rate = min(rate, self._max_rate)
+        with self._lock:
+            self._refill(time.monotonic())
+            self._rate = rate
+            # Never hold more tokens than the server says are left
+            self._tokens = min(self._tokens, float(remaining))
+            if remaining <= 0:
+                self._block(seconds)
+
+    def backoff(self, seconds: float) -> None:
+        """Pause all callers for at least `seconds` (e.g. after a 429)."""
+        with self._lock:
+            self._block(seconds)
+
+    def _block(self, seconds: float) -> None:
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    def record_retry(self, rate_limited: bool) -> None:
+        with self._lock:
+            self.retries += 1
+            if rate_limited:
+                self.rate_limited += 1
+
+    def summary(self) -> str:
+        return (
+            f"requests={self.requests} rate_limited={self.rate_limited} "
+            f"retries={self.retries} current_rate={self._rate:.2f}/s"
+        )
+
+
+def _error_status(exc: Exception) -> Optional[int]:
+    """HTTP status for a Recurly error, or 0 for network errors, None if not retryable."""
+    if recurly is None:
+        return None
+    if isinstance(exc, recurly.NetworkError):
+        return 0
+    errors = recurly.errors
+    if isinstance(exc, errors.TooManyRequestsError):
+        return 429
+    if isinstance(exc, errors.ServerError):
+        return 500
+    return None
+
+
+def is_retryable(status: Optional[int], method: str) -> bool:
+    """429 is always safe to retry; 5xx and network errors (status 0) only for idempotent methods."""
+    return status == 429 or (status is not None and method.upper() in IDEMPOTENT_METHODS)
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Full-jitter exponential backoff so parallel workers do not retry in lockstep."""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def throttle_client(
+    client: Any,
+    limiter: RateLimiter,
+    max_retries: int = 5,
+    base_delay: float = 0.5,
+    max_delay: float = 30.0,
+) -> Any:
+    """
+    Route every request of a recurly.Client through `limiter` and retry transient
+    failures. Returns the same client object.
+    """
+    make_request = client._make_request
+
+    conn = getattr(client, "_BaseClient__conn", None)
+    if conn is not None:
+        getresponse = conn.getresponse
+
+        def _observed_getresponse(*args: Any, **kwargs: Any) -> Any:
+            resp = getresponse(*args, **kwargs)
+            limiter.observe(resp.headers)
+            return resp
+
+        conn.getresponse = _observed_getresponse
+
+    def _throttled_make_request(method: str, path: str, body: Any, **options: Any) -> Any:
+        attempt = 0
+        while True:
+            limiter.acquire()
+            try:
+                return make_request(method, path, body, **options)
+            except Exception as e:
+                status = _error_status(e)
+                if not is_retryable(status, method) or attempt >= max_retries:
+                    raise
+                delay = backoff_delay(attempt, base_delay, max_delay)
+                if status == 429:
+                    limiter.backoff(delay)
+                limiter.record_retry(status == 429)
+                print(
+                    f"  Retrying {method} {path.split('?')[0]} after {type(e).__name__} "
+                    f"(attempt {attempt + 1}/{max_retries}, {delay:.1f}s)",
+                    file=sys.stderr,
+                )
+                time.sleep(delay)
+                attempt += 1
+
+    client._make_request = _throttled_make_request
+    return client
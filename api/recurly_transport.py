@@ -0,0 +1,67 @@
+"""
+One code path for both Recurly transports (--transport sync | async).
+
+Workflows that call Recurly (expire_subscriptions' row steps, invoice listing, note
+indexing) are written once, as coroutines against a transport:
+
+  await api.call("terminate_subscription", sub_id, params={...})   one request
+  await api.items("list_account_notes", acc_id, stop=pred)         page a list endpoint
+
+AsyncTransport awaits recurly_async.AsyncRecurlyClient. SyncTransport calls a blocking
+recurly.Client (plain or throttled) inline, so a coroutine on it never suspends and
+run_sync() runs it to completion on the calling thread, without an event loop.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Callable, Coroutine, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+def run_sync(coro: Coroutine[Any, Any, T]) -> T:
+    """Run a coroutine that never suspends (a workflow on a SyncTransport) and return its result."""
+    try:
+        coro.send(None)
+    except StopIteration as done:
+        return done.value
+    coro.close()
+    raise RuntimeError("coroutine suspended on the sync transport (awaited something other than SyncTransport)")
+
+
+class SyncTransport:
+    """A blocking recurly.Client behind the transport interface."""
+
+    def __init__(self, client: Any) -> None:
+        self.client = client
+
+    async def call(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        return getattr(self.client, method)(*args, **kwargs)
+
+    async def items(self, method: str, *args: Any, stop: Optional[Callable[[Any], bool]] = None, **kwargs: Any) -> List[Any]:
+        """Items of a list endpoint, paging until the first one `stop` returns True for (dropped)."""
+        out = []
+        for item in getattr(self.client, method)(*args, **kwargs).items():
+            if stop is not None and stop(item):
+                break
+            out.append(item)
+        return out
+
+
+class AsyncTransport:
+    """recurly_async.AsyncRecurlyClient behind the transport interface."""
+
+    def __init__(self, client: Any) -> None:
+        self.client = client
+
+    async def call(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        return await getattr(self.client, method)(*args, **kwargs)
+
+    async def items(self, method: str, *args: Any, stop: Optional[Callable[[Any], bool]] = None, **kwargs: Any) -> List[Any]:
+        """Items of a list endpoint, paging until the first one `stop` returns True for (dropped)."""
+        out = []
+        async for item in getattr(self.client, method)(*args, **kwargs).items():
+            if stop is not None and stop(item):
+                break
+            out.append(item)
+        return out
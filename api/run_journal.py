@@ -0,0 +1,131 @@
+"""
+Append-only JSONL journal for resumable expire_subscriptions.py runs.
+
+One line per finished step, written (and flushed) as soon as the step is done:
+  {"run": {...}}                                    header: input path, dry_run
+  {"row": 12, "key": "acct|sub", "step": "terminate", "result": {...}}
+  {"row": 12, "key": "acct|sub", "step": "refund:number-1001", "result": {...}}
+  {"row": 12, "key": "acct|sub", "step": "done", "result": {<log entry>}}
+
+On --resume the journal is replayed: rows with a "done" step are logged from
+the journal without any API call, and partially processed rows skip the steps
+already recorded (terminate, note, billing, each refund). Steps that failed are
+not recorded, so they are attempted again.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+
+def journal_path_for(log_path: Union[str, Path]) -> Path:
+    """Journal file that sits next to the log CSV: <log stem>.journal.jsonl."""
+    path = Path(log_path)
+    return path.with_name(f"{path.stem}.journal.jsonl")
+
+
+def row_key(row: Dict[str, Any]) -> str:
+    """Identity of an input row, used to detect an input file that changed between runs."""
+    return f"{(row.get('account_cd') or '').strip()}|{(row.get('subscription_guid') or '').strip()}"
+
+
+class RunJournal:
+    """Thread-safe append-only step journal; replays an existing file when resuming."""
+
+    def __init__(self, path: Union[str, Path], run_info: Dict[str, Any], resume: bool = False) -> None:
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._steps: Dict[int, Dict[str, Any]] = {}
+        self._keys: Dict[int, str] = {}
+        self.resumed_rows = 0
+
+        if resume:
+            if not self.path.exists():
+                raise FileNotFoundError(f"Journal not found for --resume: {self.path}")
+            self._replay(run_info)
+        elif self.path.exists() and self.path.stat().st_size > 0:
+            raise FileExistsError(f"Journal already exists: {self.path} (use --resume or a new --log path)")
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fh = open(self.path, "a", encoding="utf-8")
+        if not resume:
+            self._append({"run": run_info})
+
+    def _replay(self, run_info: Dict[str, Any]) -> None:
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line from a killed run; everything before it is intact
+                    continue
+                if "run" in rec:
+                    prev = rec["run"]
+                    if bool(prev.get("dry_run")) != bool(run_info.get("dry_run")):
+                        raise ValueError(
+                            f"Journal {self.path} was written with dry_run={prev.get('dry_run')}; "
+                            f"cannot resume with dry_run={run_info.get('dry_run')}"
+                        )
+                    continue
+                row = int(rec["row"])
+                self._keys[row] = rec.get("key", "")
+                self._steps.setdefault(row, {})[rec["step"]] = rec.get("result") or {}
+        self.resumed_rows = sum(1 for steps in self._steps.values() if "done" in steps)
+
+    def _append(self, rec: Dict[str, Any]) -> None:
+        line = json.dumps(rec, default=str)
+        with self._lock:
+            self._fh.write(line + "\n")
+            self._fh.flush()
+
+    def is_done(self, row_index: int) -> bool:
+        """True if the replayed journal has the row finished (it will be skipped)."""
+        return "done" in self._steps.get(row_index, {})
+
+    def for_row(self, row_index: int, row: Dict[str, Any]) -> "RowJournal":
+        key = row_key(row)
+        prev_key = self._keys.get(row_index)
+        if prev_key is not None and prev_key != key:
+            raise ValueError(
+                f"Row {row_index} changed since the journaled run ({prev_key!r} -> {key!r}); "
+                "resume needs the same input file"
+            )
+        # Hand the replayed steps over to the row so they are not held for the whole run
+        return RowJournal(self, row_index, key, self._steps.pop(row_index, {}))
+
+    def close(self) -> None:
+        with self._lock:
+            self._fh.close()
+
+    def __enter__(self) -> "RunJournal":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+class RowJournal:
+    """Steps already completed for one row, plus a recorder for new ones."""
+
+    def __init__(self, journal: RunJournal, row_index: int, key: str, steps: Dict[str, Any]) -> None:
+        self._journal = journal
+        self.row_index = row_index
+        self.key = key
+        self._steps = dict(steps)
+
+    def get(self, step: str) -> Optional[Dict[str, Any]]:
+        """Recorded result of `step`, or None if it has not completed."""
+        return self._steps.get(step)
+
+    def steps_with_prefix(self, prefix: str) -> List[Tuple[str, Dict[str, Any]]]:
+        return [(step, result) for step, result in self._steps.items() if step.startswith(prefix)]
+
+    def record(self, step: str, result: Dict[str, Any]) -> None:
+        self._steps[step] = result
+        self._journal._append({"row": self.row_index, "key": self.key, "step": step, "result": result})
@@ -0,0 +1,109 @@
+-- Parity fixture for scripts/dow_hourly_zscore.py (run via: python scripts/dow_hourly_zscore.py --parity-check).
+-- Same dow_hour_baseline / chg_chk / final-select logic as txn_dow_hourly_bin_stddev_INCREMENTAL.sql, but the hourly
+-- counts come from @fixture_json instead of the table: a JSON array of
+-- [src_system_id, trans_dt, trans_hr, cc_first_6_nbr, hourly_ct, hourly_success_ct] rows. Every chg_chk row is
+-- returned, with in_report = whether the final select would keep it.
+-- Parameters: @fixture_json STRING, @run_dt DATE, @z_threshold FLOAT64, @excluded_dts ARRAY<DATE>
+
+with hourly_counts as
+    (
+        select
+            cast(json_value(r, '$[0]') as int64) as src_system_id
+            , date(json_value(r, '$[1]')) as trans_dt
+            , cast(json_value(r, '$[2]') as int64) as trans_hr
+            , json_value(r, '$[3]') as cc_first_6_nbr
+            , cast(json_value(r, '$[4]') as int64) as hourly_ct
+            , cast(json_value(r, '$[5]') as int64) as hourly_success_ct
+        from unnest(json_query_array(@fixture_json)) r
+    )
+
+, hourly_volume as
+    (
+        select *
+        from hourly_counts
+        where trans_dt = @run_dt
+    )
+
+, max_hr as
+    (
+        select
+            src_system_id
+            , trans_dt
+            , max(trans_hr) as max_hr
+        from hourly_volume
+        group by all
+    )
+
+, dow_hour_baseline as
+    (
+        select
+            hc.src_system_id
+            , @run_dt as run_dt
+            , hc.trans_hr
+            , hc.cc_first_6_nbr
+            , cast(avg(hc.hourly_ct) as int64) as baseline_avg_ct
+            , cast(stddev_samp(hc.hourly_ct) as int64) as baseline_stddev_ct
+            , cast(avg(hc.hourly_success_ct) as int64) as baseline_success_avg_ct
+            , cast(stddev_samp(hc.hourly_success_ct) as int64) as baseline_success_stddev_ct
+        from hourly_counts hc
+        where 1=1
+            and hc.trans_dt >= date_sub(@run_dt, interval 3 month)
+            and hc.trans_dt <= date_sub(@run_dt, interval 1 day)
+            and extract(dayofweek from hc.trans_dt) = extract(dayofweek from @run_dt)
+            and hc.trans_dt not in unnest(@excluded_dts)
+        group by hc.src_system_id, hc.trans_hr, hc.cc_first_6_nbr
+    )
+
+, chg_chk as
+    (
+        select
+            hv.src_system_id
+            , hv.trans_dt
+            , hv.trans_hr
+            , hv.cc_first_6_nbr
+
+            , bl.baseline_success_avg_ct
+            , bl.baseline_success_stddev_ct
+            , hv.hourly_success_ct
+            , cast((hv.hourly_success_ct - bl.baseline_success_avg_ct) as integer) as success_diff
+            , round((hv.hourly_success_ct - bl.baseline_success_avg_ct) / nullif(bl.baseline_success_stddev_ct, 0), 2) as success_z_score
+            , case
+                when (hv.hourly_success_ct - bl.baseline_success_avg_ct) / nullif(bl.baseline_success_stddev_ct, 0) >= @z_threshold then 'large_increase'
+                when (hv.hourly_success_ct - bl.baseline_success_avg_ct) / nullif(bl.baseline_success_stddev_ct, 0) <= -@z_threshold then 'large_decrease'
+                else null
+            end as success_chg_flag
+
+            , bl.baseline_avg_ct
+            , bl.baseline_stddev_ct
+            , hv.hourly_ct
+            , cast((hv.hourly_ct - bl.baseline_avg_ct) as integer) as vol_diff
+            , round((hv.hourly_ct - bl.baseline_avg_ct) / nullif(bl.baseline_stddev_ct, 0), 2) as vol_z_score
+            , case
+                when (hv.hourly_ct - bl.baseline_avg_ct) / nullif(bl.baseline_stddev_ct, 0) >= @z_threshold then 'large_increase'
+                when (hv.hourly_ct - bl.baseline_avg_ct) / nullif(bl.baseline_stddev_ct, 0) <= -@z_threshold then 'large_decrease'
+                else null
+            end as chg_flag
+
+        from hourly_volume hv
+        join dow_hour_baseline bl
+            on hv.src_system_id = bl.src_system_id
+            and hv.trans_dt = bl.run_dt
+            and hv.trans_hr = bl.trans_hr
+            and hv.cc_first_6_nbr = bl.cc_first_6_nbr
+        where 1=1
+            and hv.trans_dt not in unnest(@excluded_dts)
+    )
+select
+    cc.*
+    , coalesce(
+        mh.max_hr is not null
+        and cc.baseline_avg_ct >= 20
+        and (cc.chg_flag is not null or cc.success_chg_flag is not null)
+        , false
+    ) as in_report
+from chg_chk cc
+left join max_hr mh
+    on cc.src_system_id = mh.src_system_id
+    and cc.trans_dt = mh.trans_dt
+    and cc.trans_hr = mh.max_hr
+order by 1, 2, 3, 4
@@ -293,6 +293,8 @@ select
     , hourly_ct as `Hourly Count`
     , vol_diff as `Diff`
     , vol_z_score as `Z Score`
+    , chg_flag as `Volume Flag`
+    , success_chg_flag as `Success Flag`
 from chg_chk cc
 join max_hr mh
     on cc.src_system_id = mh.src_system_id
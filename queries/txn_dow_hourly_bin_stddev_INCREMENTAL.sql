@@ -0,0 +1,194 @@
+-- DOW + hourly BIN anomaly check from the pre-aggregated hourly counts (run_dow_hourly_slack.py --incremental).
+-- Same output as txn_dow_hourly_bin_stddev_EMAIL.sql: today's latest hour per geo, flagged by z-score against the same
+-- day-of-week and hour over the rolling 3-month lookback (excl. today and excluded_dts), baseline_avg_ct >= 20.
+-- Closed hours are read from txn_hourly_bin_counts (kept current by txn_hourly_bin_counts_APPEND.sql); only the hours
+-- after the last loaded one (normally just the open current hour) are counted from the source tables.
+
+declare run_dt date default current_date('America/Los_Angeles');
+declare z_threshold float64 default 3;
+declare excluded_dts array<date> default [date('2026-01-24'), date('2999-12-31')]; -- days to exclude from baseline (like big event days)
+declare loaded_through datetime default (
+    select max(datetime(trans_dt, time(trans_hr, 0, 0)))
+    from i-dss-streaming-data.payment_ops_sandbox.txn_hourly_bin_counts
+    where trans_dt = run_dt
+);
+declare live_start datetime default coalesce(datetime_add(loaded_through, interval 1 hour), datetime(run_dt));
+
+with live_txn as
+    (
+        select
+            src_system_id
+            , cast(account_code as string) as account_cd
+            , transaction_id as transaction_guid
+            , date(datetime(date, 'America/Los_Angeles')) as trans_dt
+            , extract(hour from datetime(date, 'America/Los_Angeles')) as trans_hr
+            , status as trans_status_desc
+            , cast(round(cast(cc_first_6 as float64),0) as string) as cc_first_6_nbr
+        from i-dss-streaming-data.payment_ops_sandbox.transactions_to_bq
+        where 1=1
+            and date >= timestamp(live_start, 'America/Los_Angeles')
+            and type in ('purchase','verify')
+            and status in ('success', 'void', 'declined')
+            and origin in ('api', 'token_api')
+            and payment_method = 'Credit Card'
+
+        union all
+
+        select
+            src_system_id
+            , account_cd
+            , transaction_guid
+            , trans_dt
+            , extract(hour from datetime(trans_dt_ut, 'America/Los_Angeles')) as trans_hr
+            , trans_status_desc
+            , cc_first_6_nbr
+        from i-dss-streaming-data.payment_ops_vw.recurly_transaction_fct txn
+        where 1=1
+            and txn.trans_dt = run_dt
+            and txn.trans_dt_ut >= timestamp(live_start, 'America/Los_Angeles')
+            and txn.trans_type_desc in ('purchase','verify')
+            and txn.trans_status_desc in ('success', 'void', 'declined')
+            and txn.origin_desc in ('api', 'token_api')
+            and txn.payment_method_desc = 'Credit Card'
+    )
+
+, hourly_volume as
+    (
+        select
+            src_system_id
+            , trans_dt
+            , trans_hr
+            , cc_first_6_nbr
+            , hourly_ct
+            , hourly_success_ct
+            , success_acct_ex1
+            , success_acct_ex2
+            , decline_acct_ex1
+            , decline_acct_ex2
+        from i-dss-streaming-data.payment_ops_sandbox.txn_hourly_bin_counts
+        where 1=1
+            and trans_dt = run_dt
+            and datetime(trans_dt, time(trans_hr, 0, 0)) < live_start
+
+        union all
+
+        select
+            src_system_id
+            , trans_dt
+            , trans_hr
+            , cc_first_6_nbr
+            , count(distinct transaction_guid) as hourly_ct
+            , count(distinct case when trans_status_desc in ('success', 'void') then transaction_guid else null end) as hourly_success_ct
+            , min(case when trans_status_desc in ('success', 'void') then account_cd else null end) as success_acct_ex1
+            , max(case when trans_status_desc in ('success', 'void') then account_cd else null end) as success_acct_ex2
+            , min(case when trans_status_desc in ('declined') then account_cd else null end) as decline_acct_ex1
+            , max(case when trans_status_desc in ('declined') then account_cd else null end) as decline_acct_ex2
+        from live_txn
+        where 1=1
+            and trans_dt = run_dt
+        group by src_system_id, trans_dt, trans_hr, cc_first_6_nbr
+    )
+
+, max_hr as
+    (
+        select
+            src_system_id
+            , trans_dt
+            , max(trans_hr) as max_hr
+        from hourly_volume
+        group by all
+    )
+
+, dow_hour_baseline as
+    (
+        select
+            hc.src_system_id
+            , run_dt
+            , hc.trans_hr
+            , hc.cc_first_6_nbr
+            , cast(avg(hc.hourly_ct) as int64) as baseline_avg_ct
+            , cast(stddev_samp(hc.hourly_ct) as int64) as baseline_stddev_ct
+            , cast(avg(hc.hourly_success_ct) as int64) as baseline_success_avg_ct
+            , cast(stddev_samp(hc.hourly_success_ct) as int64) as baseline_success_stddev_ct
+        from i-dss-streaming-data.payment_ops_sandbox.txn_hourly_bin_counts hc
+        where 1=1
+            and hc.trans_dt >= date_sub(run_dt, interval 3 month)
+            and hc.trans_dt <= date_sub(run_dt, interval 1 day)
+            and extract(dayofweek from hc.trans_dt) = extract(dayofweek from run_dt)
+            and hc.trans_dt not in unnest(excluded_dts)
+        group by hc.src_system_id, hc.trans_hr, hc.cc_first_6_nbr
+    )
+
+, chg_chk as
+    (
+        select
+            hv.src_system_id
+            , hv.trans_dt
+            , hv.trans_hr
+            , hv.cc_first_6_nbr
+
+            , bl.baseline_success_avg_ct
+            , bl.baseline_success_stddev_ct
+            , hv.hourly_success_ct
+            , cast((hv.hourly_success_ct - bl.baseline_success_avg_ct) as integer) as success_diff
+            , round((hv.hourly_success_ct - bl.baseline_success_avg_ct) / nullif(bl.baseline_success_stddev_ct, 0), 2) as success_z_score
+            , case
+                when (hv.hourly_success_ct - bl.baseline_success_avg_ct) / nullif(bl.baseline_success_stddev_ct, 0) >= z_threshold then 'large_increase'
+                when (hv.hourly_success_ct - bl.baseline_success_avg_ct) / nullif(bl.baseline_success_stddev_ct, 0) <= -z_threshold then 'large_decrease'
+                else null
+            end as success_chg_flag
+
+            , bl.baseline_avg_ct
+            , bl.baseline_stddev_ct
+            , hv.hourly_ct
+            , cast((hv.hourly_ct - bl.baseline_avg_ct) as integer) as vol_diff
+            , round((hv.hourly_ct - bl.baseline_avg_ct) / nullif(bl.baseline_stddev_ct, 0), 2) as vol_z_score
+            , case
+                when (hv.hourly_ct - bl.baseline_avg_ct) / nullif(bl.baseline_stddev_ct, 0) >= z_threshold then 'large_increase'
+                when (hv.hourly_ct - bl.baseline_avg_ct) / nullif(bl.baseline_stddev_ct, 0) <= -z_threshold then 'large_decrease'
+                else null
+            end as chg_flag
+            , success_acct_ex1
+            , success_acct_ex2
+            , decline_acct_ex1
+            , decline_acct_ex2
+
+        from hourly_volume hv
+        join dow_hour_baseline bl
+            on hv.src_system_id = bl.src_system_id
+            and hv.trans_dt = bl.run_dt
+            and hv.trans_hr = bl.trans_hr
+            and hv.cc_first_6_nbr = bl.cc_first_6_nbr
+        where 1=1
+            and hv.trans_dt not in unnest(excluded_dts)
+    )
+select
+    case
+        when cc.src_system_id = 115 then 'US'
+        when cc.src_system_id = 134 then 'INTL'
+        else 'Legacy AU'
+    end as geo
+    , cc.trans_dt as dt
+    , cc.trans_hr as hr
+    , cc_first_6_nbr as BIN
+    , baseline_avg_ct as `Average Count`
+    , baseline_stddev_ct as `Std Deviation`
+    , hourly_ct as `Hourly Count`
+    , vol_diff as `Diff`
+    , vol_z_score as `Z Score`
+    , chg_flag as `Volume Flag`
+    , success_chg_flag as `Success Flag`
+from chg_chk cc
+join max_hr mh
+    on cc.src_system_id = mh.src_system_id
+    and cc.trans_dt = mh.trans_dt
+    and cc.trans_hr = mh.max_hr
+where 1=1
+    and baseline_avg_ct >= 20
+    and
+        (
+            chg_flag is not null
+            or
+            success_chg_flag is not null
+        )
+order by 1, 2 desc, 3, 4, 5
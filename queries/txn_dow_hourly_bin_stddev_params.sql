@@ -0,0 +1,133 @@
+-- DOW + hourly BIN anomaly check over a run range, parameterized for scripts/bq_query_runner.py (dashboard / backfill).
+-- Same baseline, z-scores and output columns as txn_dow_hourly_bin_stddev_EMAIL.sql, read from the pre-aggregated
+-- txn_hourly_bin_counts table (closed hours only). No current_date(): the text never changes, so BigQuery's result
+-- cache and the runner's local cache can serve repeats.
+-- Params: @run_range_start, @run_range_end (DATE), @z_threshold (FLOAT64), @excluded_dts (ARRAY<DATE>),
+--         @src_system_ids, @hours (ARRAY<INT64>, empty = all), @latest_hour_only (BOOL: only each day's last loaded hour, as the email)
+
+with hourly_counts as
+    (
+        select *
+        from i-dss-streaming-data.payment_ops_sandbox.txn_hourly_bin_counts hc
+        where 1=1
+            and hc.trans_dt >= date_sub(@run_range_start, interval 3 month)
+            and hc.trans_dt <= @run_range_end
+            and (array_length(@src_system_ids) = 0 or hc.src_system_id in unnest(@src_system_ids))
+            and (array_length(@hours) = 0 or hc.trans_hr in unnest(@hours))
+    )
+
+, run_dates as
+    (
+        select run_dt
+        from unnest(generate_date_array(@run_range_start, @run_range_end)) as run_dt
+    )
+
+, baseline_dates as
+    (
+        select
+            rd.run_dt
+            , bd as baseline_dt
+        from run_dates rd
+        , unnest(generate_date_array(date_sub(rd.run_dt, interval 3 month), date_sub(rd.run_dt, interval 1 day))) as bd
+        where 1=1
+            and extract(dayofweek from bd) = extract(dayofweek from rd.run_dt)
+            and bd not in unnest(@excluded_dts)
+    )
+
+, max_hr as
+    (
+        select
+            src_system_id
+            , trans_dt
+            , max(trans_hr) as max_hr
+        from hourly_counts
+        where 1=1
+            and trans_dt between @run_range_start and @run_range_end
+        group by all
+    )
+
+, dow_hour_baseline as
+    (
+        select
+            hc.src_system_id
+            , bd.run_dt
+            , hc.trans_hr
+            , hc.cc_first_6_nbr
+            , cast(avg(hc.hourly_ct) as int64) as baseline_avg_ct
+            , cast(stddev_samp(hc.hourly_ct) as int64) as baseline_stddev_ct
+            , cast(avg(hc.hourly_success_ct) as int64) as baseline_success_avg_ct
+            , cast(stddev_samp(hc.hourly_success_ct) as int64) as baseline_success_stddev_ct
+        from baseline_dates bd
+        join hourly_counts hc
+            on bd.baseline_dt = hc.trans_dt
+        group by hc.src_system_id, bd.run_dt, hc.trans_hr, hc.cc_first_6_nbr
+    )
+
+, chg_chk as
+    (
+        select
+            hv.src_system_id
+            , hv.trans_dt
+            , hv.trans_hr
+            , hv.cc_first_6_nbr
+
+            , bl.baseline_success_avg_ct
+            , bl.baseline_success_stddev_ct
+            , hv.hourly_success_ct
+            , cast((hv.hourly_success_ct - bl.baseline_success_avg_ct) as integer) as success_diff
+            , round((hv.hourly_success_ct - bl.baseline_success_avg_ct) / nullif(bl.baseline_success_stddev_ct, 0), 2) as success_z_score
+            , case
+                when (hv.hourly_success_ct - bl.baseline_success_avg_ct) / nullif(bl.baseline_success_stddev_ct, 0) >= @z_threshold then 'large_increase'
+                when (hv.hourly_success_ct - bl.baseline_success_avg_ct) / nullif(bl.baseline_success_stddev_ct, 0) <= -@z_threshold then 'large_decrease'
+                else null
+            end as success_chg_flag
+
+            , bl.baseline_avg_ct
+            , bl.baseline_stddev_ct
+            , hv.hourly_ct
+            , cast((hv.hourly_ct - bl.baseline_avg_ct) as integer) as vol_diff
+            , round((hv.hourly_ct - bl.baseline_avg_ct) / nullif(bl.baseline_stddev_ct, 0), 2) as vol_z_score
+            , case
+                when (hv.hourly_ct - bl.baseline_avg_ct) / nullif(bl.baseline_stddev_ct, 0) >= @z_threshold then 'large_increase'
+                when (hv.hourly_ct - bl.baseline_avg_ct) / nullif(bl.baseline_stddev_ct, 0) <= -@z_threshold then 'large_decrease'
+                else null
+            end as chg_flag
+
+        from hourly_counts hv
+        join dow_hour_baseline bl
+            on hv.src_system_id = bl.src_system_id
+            and hv.trans_dt = bl.run_dt
+            and hv.trans_hr = bl.trans_hr
+            and hv.cc_first_6_nbr = bl.cc_first_6_nbr
+        where 1=1
+            and hv.trans_dt between @run_range_start and @run_range_end
+            and hv.trans_dt not in unnest(@excluded_dts)
+    )
+select
+    case
+        when cc.src_system_id = 115 then 'US'
+        when cc.src_system_id = 134 then 'INTL'
+        else 'Legacy AU'
+    end as geo
+    , cc.trans_dt as dt
+    , cc.trans_hr as hr
+    , cc_first_6_nbr as BIN
+    , baseline_avg_ct as `Average Count`
+    , baseline_stddev_ct as `Std Deviation`
+    , hourly_ct as `Hourly Count`
+    , vol_diff as `Diff`
+    , vol_z_score as `Z Score`
+from chg_chk cc
+left join max_hr mh
+    on cc.src_system_id = mh.src_system_id
+    and cc.trans_dt = mh.trans_dt
+where 1=1
+    and (not @latest_hour_only or cc.trans_hr = mh.max_hr)
+    and baseline_avg_ct >= 20
+    and
+        (
+            chg_flag is not null
+            or
+            success_chg_flag is not null
+        )
+order by 1, 2 desc, 3, 4, 5
@@ -0,0 +1,113 @@
+-- Incremental hourly BIN counts for the DOW/hourly anomaly check (run_dow_hourly_slack.py --incremental).
+-- Keeps i-dss-streaming-data.payment_ops_sandbox.txn_hourly_bin_counts: one row per (src_system_id, trans_dt, trans_hr, cc_first_6_nbr)
+-- with the same hourly_ct / hourly_success_ct / example accounts as hourly_volume_all in txn_dow_hourly_bin_stddev_EMAIL.sql.
+-- Each run appends only the LA-time hours that closed since the last loaded hour; the last restate_hours hours are
+-- reloaded too, so transactions that land late in the source tables are picked up. An empty table is backfilled
+-- from backfill_start (3 months + margin, enough for the same-DOW baseline). excluded_dts is applied by the report, not here.
+
+declare current_hr_start datetime default datetime_trunc(current_datetime('America/Los_Angeles'), hour);
+declare backfill_start date default date_sub(date_sub(current_date('America/Los_Angeles'), interval 3 month), interval 7 day);
+declare restate_hours int64 default 2;
+declare loaded_through datetime;
+declare load_start datetime;
+
+create table if not exists i-dss-streaming-data.payment_ops_sandbox.txn_hourly_bin_counts
+    (
+        src_system_id int64
+        , trans_dt date
+        , trans_hr int64
+        , cc_first_6_nbr string
+        , hourly_ct int64
+        , hourly_success_ct int64
+        , success_acct_ex1 string
+        , success_acct_ex2 string
+        , decline_acct_ex1 string
+        , decline_acct_ex2 string
+        , loaded_at timestamp
+    )
+partition by trans_dt
+cluster by src_system_id, cc_first_6_nbr;
+
+set loaded_through = (
+    select max(datetime(trans_dt, time(trans_hr, 0, 0)))
+    from i-dss-streaming-data.payment_ops_sandbox.txn_hourly_bin_counts
+    where trans_dt >= backfill_start
+);
+
+set load_start = coalesce(
+    datetime_sub(loaded_through, interval (restate_hours - 1) hour)
+    , datetime(backfill_start)
+);
+
+if load_start < current_hr_start then
+
+    delete from i-dss-streaming-data.payment_ops_sandbox.txn_hourly_bin_counts
+    where 1=1
+        and trans_dt >= date(load_start)
+        and datetime(trans_dt, time(trans_hr, 0, 0)) >= load_start;
+
+    insert into i-dss-streaming-data.payment_ops_sandbox.txn_hourly_bin_counts
+    with txn as
+        (
+            -- Same sources and filters as the txn CTE of txn_dow_hourly_bin_stddev_EMAIL.sql, restricted to the
+            -- hours being loaded. select distinct * is not needed: every measure below is a count(distinct) or min/max.
+            select
+                src_system_id
+                , cast(account_code as string) as account_cd
+                , transaction_id as transaction_guid
+                , date(datetime(date, 'America/Los_Angeles')) as trans_dt
+                , extract(hour from datetime(date, 'America/Los_Angeles')) as trans_hr
+                , status as trans_status_desc
+                , cast(round(cast(cc_first_6 as float64),0) as string) as cc_first_6_nbr
+            from i-dss-streaming-data.payment_ops_sandbox.transactions_to_bq
+            where 1=1
+                and date >= timestamp(load_start, 'America/Los_Angeles')
+                and date < timestamp(current_hr_start, 'America/Los_Angeles')
+                and type in ('purchase','verify')
+                and status in ('success', 'void', 'declined')
+                and origin in ('api', 'token_api')
+                and payment_method = 'Credit Card'
+
+            union all
+
+            select
+                src_system_id
+                , account_cd
+                , transaction_guid
+                , trans_dt
+                , extract(hour from datetime(trans_dt_ut, 'America/Los_Angeles')) as trans_hr
+                , trans_status_desc
+                , cc_first_6_nbr
+            from i-dss-streaming-data.payment_ops_vw.recurly_transaction_fct txn
+            where 1=1
+                and txn.trans_dt >= date(load_start)
+                and txn.trans_dt <= date(current_hr_start)
+                and txn.trans_dt_ut >= timestamp(load_start, 'America/Los_Angeles')
+                and txn.trans_dt_ut < timestamp(current_hr_start, 'America/Los_Angeles')
+                and txn.trans_type_desc in ('purchase','verify')
+                and txn.trans_status_desc in ('success', 'void', 'declined')
+                and txn.origin_desc in ('api', 'token_api')
+                and txn.payment_method_desc = 'Credit Card'
+        )
+    select
+        src_system_id
+        , trans_dt
+        , trans_hr
+        , cc_first_6_nbr
+        , count(distinct transaction_guid) as hourly_ct
+        , count(distinct case when trans_status_desc in ('success', 'void') then transaction_guid else null end) as hourly_success_ct
+        , min(case when trans_status_desc in ('success', 'void') then account_cd else null end) as success_acct_ex1
+        , max(case when trans_status_desc in ('success', 'void') then account_cd else null end) as success_acct_ex2
+        , min(case when trans_status_desc in ('declined') then account_cd else null end) as decline_acct_ex1
+        , max(case when trans_status_desc in ('declined') then account_cd else null end) as decline_acct_ex2
+        , current_timestamp() as loaded_at
+    from txn
+    group by src_system_id, trans_dt, trans_hr, cc_first_6_nbr;
+
+end if;
+
+select
+    loaded_through as previously_loaded_through
+    , load_start
+    , current_hr_start as loaded_until
+    , (select count(*) from i-dss-streaming-data.payment_ops_sandbox.txn_hourly_bin_counts where trans_dt >= date(load_start)) as rows_since_load_start;
@@ -0,0 +1,65 @@
+-- Today's hours not yet in txn_hourly_bin_counts (normally just the open current hour), in the table's row shape.
+-- Used by run_dow_hourly_slack.py --engine local: closed hours come from the locally cached table rows and these
+-- live rows are appended, so scripts/dow_hourly_zscore.py sees the same hourly_volume as
+-- txn_dow_hourly_bin_stddev_INCREMENTAL.sql.
+
+declare run_dt date default current_date('America/Los_Angeles');
+declare loaded_through datetime default (
+    select max(datetime(trans_dt, time(trans_hr, 0, 0)))
+    from i-dss-streaming-data.payment_ops_sandbox.txn_hourly_bin_counts
+    where trans_dt = run_dt
+);
+declare live_start datetime default coalesce(datetime_add(loaded_through, interval 1 hour), datetime(run_dt));
+
+with live_txn as
+    (
+        select
+            src_system_id
+            , cast(account_code as string) as account_cd
+            , transaction_id as transaction_guid
+            , date(datetime(date, 'America/Los_Angeles')) as trans_dt
+            , extract(hour from datetime(date, 'America/Los_Angeles')) as trans_hr
+            , status as trans_status_desc
+            , cast(round(cast(cc_first_6 as float64),0) as string) as cc_first_6_nbr
+        from i-dss-streaming-data.payment_ops_sandbox.transactions_to_bq
+        where 1=1
+            and date >= timestamp(live_start, 'America/Los_Angeles')
+            and type in ('purchase','verify')
+            and status in ('success', 'void', 'declined')
+            and origin in ('api', 'token_api')
+            and payment_method = 'Credit Card'
+
+        union all
+
+        select
+            src_system_id
+            , account_cd
+            , transaction_guid
+            , trans_dt
+            , extract(hour from datetime(trans_dt_ut, 'America/Los_Angeles')) as trans_hr
+            , trans_status_desc
+            , cc_first_6_nbr
+        from i-dss-streaming-data.payment_ops_vw.recurly_transaction_fct txn
+        where 1=1
+            and txn.trans_dt = run_dt
+            and txn.trans_dt_ut >= timestamp(live_start, 'America/Los_Angeles')
+            and txn.trans_type_desc in ('purchase','verify')
+            and txn.trans_status_desc in ('success', 'void', 'declined')
+            and txn.origin_desc in ('api', 'token_api')
+            and txn.payment_method_desc = 'Credit Card'
+    )
+select
+    src_system_id
+    , trans_dt
+    , trans_hr
+    , cc_first_6_nbr
+    , count(distinct transaction_guid) as hourly_ct
+    , count(distinct case when trans_status_desc in ('success', 'void') then transaction_guid else null end) as hourly_success_ct
+    , min(case when trans_status_desc in ('success', 'void') then account_cd else null end) as success_acct_ex1
+    , max(case when trans_status_desc in ('success', 'void') then account_cd else null end) as success_acct_ex2
+    , min(case when trans_status_desc in ('declined') then account_cd else null end) as decline_acct_ex1
+    , max(case when trans_status_desc in ('declined') then account_cd else null end) as decline_acct_ex2
+from live_txn
+where 1=1
+    and trans_dt = run_dt
+group by src_system_id, trans_dt, trans_hr, cc_first_6_nbr
@@ -0,0 +1,190 @@
+"""
+Suite of anomaly checks for run_dow_hourly_slack.py --suite: every check in a TOML manifest
+(default scripts/anomaly_checks.toml) runs each cycle and the results go out as one digest.
+
+All checks are started together on a thread pool sharing one QueryRunner (one BigQuery
+client), so their BigQuery jobs run concurrently and a cycle takes about as long as the
+slowest query rather than the sum of all of them.
+
+Manifest entries ([[check]] tables):
+  name      short id, used in logs (required, unique)
+  title     digest section heading (default: name)
+  sql       queries/ file to run through QueryRunner.run(), or
+  builtin   name of a check supplied by the caller (e.g. "hourly_report": the hourly BIN
+            report in the mode chosen on the command line)
+  params    optional table of query parameters (only @params the SQL references are sent;
+            declare-style scripts run with their declared defaults)
+  max_rows  optional digest row cap for this check (default EMAIL_MAX_ROWS)
+  enabled   optional, false skips the check
+
+A failing check does not stop the others: its error is reported in its digest section.
+"""
+
+from __future__ import annotations
+
+import sys
+import time
+import tomllib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+
+from bq_query_runner import QUERIES_DIR, QueryRunner
+
+SUITE_MANIFEST = Path(__file__).resolve().parent / "anomaly_checks.toml"
+CHECK_KEYS = {"name", "title", "sql", "builtin", "params", "max_rows", "enabled"}
+
+
+class Check:
+    """One manifest entry."""
+
+    def __init__(
+        self,
+        name: str,
+        title: Optional[str] = None,
+        sql: Optional[str] = None,
+        builtin: Optional[str] = None,
+        params: Optional[Dict[str, Any]] = None,
+        max_rows: Optional[int] = None,
+        enabled: bool = True,
+    ) -> None:
+        if (sql is None) == (builtin is None):
+            raise ValueError(f"check {name!r}: set exactly one of sql or builtin")
+        self.name = name
+        self.title = title or name
+        self.sql = sql
+        self.builtin = builtin
+        self.params = dict(params or {})
+        self.max_rows = max_rows
+        self.enabled = enabled
+
+    def __repr__(self) -> str:
+        return f"Check({self.name!r}, {self.sql or 'builtin:' + str(self.builtin)})"
+
+
+class CheckResult:
+    """Outcome of one check in a suite run: rows, or the error that stopped it."""
+
+    def __init__(self, check: Check, rows: Optional[pd.DataFrame], error: Optional[str], seconds: float,
+                 source: Optional[str] = None) -> None:
+        self.check = check
+        self.rows = rows
+        self.error = error
+        self.seconds = seconds
+        self.source = source
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def summary(self) -> str:
+        outcome = f"error ({self.error})" if self.error else f"{len(self.rows)} rows"
+        via = f", {self.source}" if self.source else ""
+        return f"{self.check.name}: {outcome} in {self.seconds:.1f}s{via}"
+
+
+def load_manifest(path: str | Path = SUITE_MANIFEST) -> List[Check]:
+    """Enabled checks of a manifest (raises ValueError on unknown keys, duplicate names or missing SQL files)."""
+    with open(path, "rb") as f:
+        entries = tomllib.load(f).get("check", [])
+    checks, seen = [], set()
+    for entry in entries:
+        unknown = set(entry) - CHECK_KEYS
+        if unknown or "name" not in entry:
+            raise ValueError(f"{path}: bad check entry {entry.get('name', entry)!r} (unknown keys: {sorted(unknown)})")
+        check = Check(**entry)
+        if check.name in seen:
+            raise ValueError(f"{path}: duplicate check name {check.name!r}")
+        seen.add(check.name)
+        if check.sql is not None and not (QUERIES_DIR / check.sql).is_file():
+            raise ValueError(f"{path}: check {check.name!r}: no such query {QUERIES_DIR / check.sql}")
+        if check.enabled:
+            checks.append(check)
+    return checks
+
+
+def run_check(check: Check, runner: QueryRunner,
+              builtins: Optional[Dict[str, Callable[[], pd.DataFrame]]] = None) -> CheckResult:
+    t0 = time.monotonic()
+    try:
+        if check.builtin is not None:
+            if not builtins or check.builtin not in builtins:
+                raise ValueError(f"unknown builtin check {check.builtin!r}")
+            rows, source = pd.DataFrame(builtins[check.builtin]()), None
+        else:
+            rows, info = runner.run_with_info(check.sql, check.params)
+            source = info["source"]
+    except Exception as e:
+        return CheckResult(check, None, f"{type(e).__name__}: {e}", time.monotonic() - t0)
+    return CheckResult(check, rows, None, time.monotonic() - t0, source)
+
+
+def run_suite(checks: List[Check], runner: QueryRunner,
+              builtins: Optional[Dict[str, Callable[[], pd.DataFrame]]] = None) -> List[CheckResult]:
+    """Run all checks concurrently; results in manifest order."""
+    if not checks:
+        return []
+    with ThreadPoolExecutor(max_workers=len(checks), thread_name_prefix="check") as pool:
+        futures = [pool.submit(run_check, check, runner, builtins) for check in checks]
+        results = [f.result() for f in futures]
+    for result in results:
+        print(result.summary(), file=sys.stderr)
+    return results
+
+
+def _section_html(result: CheckResult, default_max_rows: int) -> str:
+    from html import escape
+
+    check = result.check
+    head = f"<h3>{escape(check.title)}</h3>"
+    if not result.ok:
+        return head + f"<p><b>Failed:</b> {escape(result.error)}</p>"
+    n = len(result.rows)
+    if n == 0:
+        return head + "<p>No anomalies.</p>"
+    max_rows = check.max_rows or default_max_rows
+    row_cap = f" (first {min(max_rows, n)} of {n} rows)" if n > max_rows else ""
+    table_html = result.rows.head(max_rows).to_html(index=False, escape=True)
+    return head + f"<p>Rows: {n}{row_cap}</p><div style=\"overflow-x: auto;\">{table_html}</div>"
+
+
+def format_suite_body(results: List[CheckResult], max_rows: int) -> str:
+    """HTML digest: one-line overview per check, then a section (table, 'No anomalies' or the error) for each."""
+    from datetime import datetime
+    from html import escape
+
+    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    overview = "".join(
+        f"<li>{escape(r.check.title)}: "
+        + ("<b>failed</b>" if not r.ok else f"{len(r.rows)} rows" if len(r.rows) else "no anomalies")
+        + "</li>"
+        for r in results
+    )
+    sections = "".join(_section_html(r, max_rows) for r in results)
+    return (
+        "<!DOCTYPE html><html><head><meta charset=\"utf-8\">"
+        "<style>"
+        "table { border-collapse: collapse; border: 1px solid #ccc; width: 100%; font-size: 14px; }"
+        "th, td { border: 1px solid #ccc; padding: 6px 8px; text-align: left; }"
+        "th { background: #eee; }"
+        "</style></head><body>"
+        "<p><b>Anomaly check suite</b> — " + ts + "</p>"
+        "<ul>" + overview + "</ul>"
+        + sections
+        + "</body></html>"
+    )
+
+
+def suite_subject(results: List[CheckResult]) -> str:
+    from datetime import datetime
+
+    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    failed = sum(not r.ok for r in results)
+    flagged = [r for r in results if r.ok and len(r.rows)]
+    if failed:
+        return f"Anomaly suite: {failed} check(s) failed — {ts}"
+    if flagged:
+        return f"Anomalies in {len(flagged)} of {len(results)} checks — {ts}"
+    return f"No anomalies — {ts}"
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Size queries/*.sql files before running them: each file is submitted as a BigQuery dry run
+(with the same query parameters bq_query_runner.py would send) and the estimated bytes
+processed and on-demand cost are reported, with the tables it reads.
+
+A dry run returns one total for the whole query (or script), not a per-table split, so
+each referenced table is listed with its full size and partitioning / clustering: a
+total close to the sum of the full sizes means the filters are not pruning anything.
+
+Usage:
+  python scripts/bq_dry_run.py gateway_performance_example2.sql gateway_performance_by_bin.sql
+  python scripts/bq_dry_run.py txn_dow_hourly_bin_stddev_params.sql --param run_range_start=2026-10-01
+  python scripts/bq_dry_run.py --all --max-bytes-billed 500GB   # exit 1 if any file would bill more
+
+Environment variables:
+  BIGQUERY_PROJECT     (optional, default: i-dss-streaming-data)
+  BQ_MAX_BYTES_BILLED  (optional, default: 2TB; the cap the scheduled runners enforce)
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+if __name__ == "__main__":
+    # Run in project .venv if not already in a virtual environment
+    _root = Path(__file__).resolve().parent.parent
+    _venv_py = _root / ".venv" / "bin" / "python"
+    if _venv_py.exists() and sys.prefix == sys.base_prefix:
+        os.execv(str(_venv_py), [str(_venv_py)] + sys.argv)
+
+from google.cloud import bigquery
+
+from bq_query_runner import (
+    QUERIES_DIR,
+    _parse_param,
+    load_sql,
+    max_bytes_billed_from_env,
+    parse_bytes,
+    query_parameters,
+    referenced_tables,
+)
+
+# On-demand analysis price (USD per TiB billed), for the cost column only
+ON_DEMAND_USD_PER_TIB = 6.25
+
+
+def _format_bytes(n: Optional[int]) -> str:
+    if n is None:
+        return "?"
+    size = float(n)
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.2f} TB"
+
+
+def table_info(client: "bigquery.Client", ref: str) -> Dict[str, Any]:
+    """Size and layout of a referenced table (error text instead when it cannot be read)."""
+    try:
+        table = client.get_table(ref)
+    except Exception as e:
+        return {"table": ref, "error": f"{type(e).__name__}: {e}"}
+    partitioning = None
+    if table.time_partitioning is not None:
+        partitioning = f"{table.time_partitioning.type_} on {table.time_partitioning.field or '_PARTITIONTIME'}"
+    elif table.range_partitioning is not None:
+        partitioning = f"range on {table.range_partitioning.field}"
+    return {
+        "table": ref,
+        "type": table.table_type,
+        "bytes": table.num_bytes,
+        "rows": table.num_rows,
+        "partitioning": partitioning,
+        "require_partition_filter": bool(getattr(table, "require_partition_filter", False)),
+        "clustering": list(table.clustering_fields or []),
+    }
+
+
+def estimate(client: "bigquery.Client", sql_name: str, params: Optional[Dict[str, Any]] = None,
+             max_bytes_billed: Optional[int] = None) -> Dict[str, Any]:
+    """Dry-run one queries/ file: estimated bytes, cost, tables read and whether it exceeds max_bytes_billed."""
+    sql = load_sql(sql_name)
+    job = client.query(
+        sql,
+        job_config=bigquery.QueryJobConfig(
+            dry_run=True,
+            use_query_cache=False,
+            query_parameters=query_parameters(sql, params),
+        ),
+    )
+    refs = [f"{t.project}.{t.dataset_id}.{t.table_id}" for t in (job.referenced_tables or [])]
+    if not refs:
+        # Scripts (declare ...) do not report referenced tables on a dry run
+        refs = referenced_tables(sql)
+    total = job.total_bytes_processed
+    return {
+        "sql": sql_name,
+        "statement_type": job.statement_type,
+        "bytes_processed": total,
+        "est_cost_usd": round((total or 0) / 1024 ** 4 * ON_DEMAND_USD_PER_TIB, 2),
+        "over_cap": bool(max_bytes_billed and total and total > max_bytes_billed),
+        "tables": [table_info(client, ref) for ref in refs],
+    }
+
+
+def format_estimate(result: Dict[str, Any]) -> str:
+    lines = [
+        f"{result['sql']}: {_format_bytes(result['bytes_processed'])} (~${result['est_cost_usd']:.2f} on-demand)"
+        + ("  OVER CAP" if result["over_cap"] else "")
+    ]
+    for info in result["tables"]:
+        if "error" in info:
+            lines.append(f"  {info['table']}: {info['error']}")
+            continue
+        layout = ", ".join(filter(None, [
+            info["partitioning"] and f"partitioned {info['partitioning']}",
+            info["clustering"] and f"clustered by {', '.join(info['clustering'])}",
+        ])) or "not partitioned"
+        lines.append(f"  {info['table']} ({info['type'].lower()}): {_format_bytes(info['bytes'])} full, {layout}")
+    return "\n".join(lines)
+
+
+def main() -> int:
+    from dotenv import load_dotenv
+
+    load_dotenv(Path(__file__).resolve().parent.parent / ".env")
+    parser = argparse.ArgumentParser(description="Dry-run queries/ files and report the bytes they would scan.")
+    parser.add_argument("sql", nargs="*", help="Files under queries/ (or paths to .sql files)")
+    parser.add_argument("--all", action="store_true", help="Every queries/*.sql file")
+    parser.add_argument("--param", action="append", type=_parse_param, default=[], metavar="NAME=VALUE",
+                        help="Query parameter; arrays comma-separated (repeatable)")
+    parser.add_argument("--max-bytes-billed", default=None, metavar="SIZE",
+                        help="Flag (and exit 1 for) files estimated above SIZE (default BQ_MAX_BYTES_BILLED)")
+    args = parser.parse_args()
+
+    names: List[str] = list(args.sql)
+    if args.all:
+        names += sorted(p.name for p in QUERIES_DIR.glob("*.sql"))
+    if not names:
+        parser.error("give SQL files or --all")
+    cap = parse_bytes(args.max_bytes_billed) if args.max_bytes_billed is not None else max_bytes_billed_from_env()
+    client = bigquery.Client(project=os.environ.get("BIGQUERY_PROJECT", "i-dss-streaming-data"))
+    over = failed = 0
+    for name in names:
+        try:
+            result = estimate(client, name, dict(args.param), cap)
+        except Exception as e:
+            print(f"{name}: dry run failed: {type(e).__name__}: {e}")
+            failed += 1
+            continue
+        print(format_estimate(result))
+        over += result["over_cap"]
+    if cap:
+        print(f"\nCap {_format_bytes(cap)}: {over} of {len(names)} files over, {failed} failed to dry-run.")
+    return 1 if over or failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
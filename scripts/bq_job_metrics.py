@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Cost and latency of every BigQuery job the scripts run, for finding the queries/ files
+that burn slots and for checking an optimization against its baseline.
+
+record_job(job, label) is called after each job finishes or fails (QueryRunner, the
+CyberSource load). It appends one JSON line to BQ_JOB_METRICS with the job id, the label (query file,
+or step name for inline SQL and load jobs), the calling script, total_bytes_processed,
+total_bytes_billed, slot-ms, cache hit, queue time (created -> started) and execution
+time (started -> ended), and the error of a failed job (e.g. one stopped by
+maximum_bytes_billed). If BQ_JOB_METRICS_TABLE is set (project.dataset.table) the same
+row is also streamed into that table, created on first use. Recording never raises: a
+metrics failure is printed and the job's caller carries on.
+
+Report per label over the last --days (default 7), with the change against the --days
+before that:
+  python scripts/bq_job_metrics.py --report
+  python scripts/bq_job_metrics.py --report --days 30 --label txn_dow_hourly_bin_stddev_EMAIL.sql
+
+Environment variables:
+  BQ_JOB_METRICS        (optional, default: ~/.cache/pplus-payments/bq_job_metrics.jsonl)
+  BQ_JOB_METRICS_TABLE  (optional: also write rows to this BigQuery table)
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+if __name__ == "__main__":
+    # Run in project .venv if not already in a virtual environment
+    _root = Path(__file__).resolve().parent.parent
+    _venv_py = _root / ".venv" / "bin" / "python"
+    if _venv_py.exists() and sys.prefix == sys.base_prefix:
+        os.execv(str(_venv_py), [str(_venv_py)] + sys.argv)
+
+import pandas as pd
+
+JOB_METRICS_PATH = os.environ.get(
+    "BQ_JOB_METRICS",
+    str(Path.home() / ".cache" / "pplus-payments" / "bq_job_metrics.jsonl"),
+)
+JOB_METRICS_TABLE = os.environ.get("BQ_JOB_METRICS_TABLE") or None
+
+METRIC_FIELDS = [
+    ("recorded_at", "TIMESTAMP"),
+    ("job_id", "STRING"),
+    ("location", "STRING"),
+    ("job_type", "STRING"),
+    ("label", "STRING"),
+    ("script", "STRING"),
+    ("statement_type", "STRING"),
+    ("total_bytes_processed", "INT64"),
+    ("total_bytes_billed", "INT64"),
+    ("slot_ms", "INT64"),
+    ("cache_hit", "BOOL"),
+    ("queue_ms", "INT64"),
+    ("exec_ms", "INT64"),
+    ("output_rows", "INT64"),
+    ("error", "STRING"),
+]
+
+_write_lock = threading.Lock()
+_tables_ready: set = set()
+
+
+def _ms_between(start: Optional[datetime], end: Optional[datetime]) -> Optional[int]:
+    if start is None or end is None:
+        return None
+    return int((end - start).total_seconds() * 1000)
+
+
+def job_metrics(job: Any, label: str) -> Dict[str, Any]:
+    """The metrics row of a finished query or load job (error set if it failed)."""
+    output_rows = getattr(job, "output_rows", None)
+    if output_rows is None:
+        output_rows = getattr(job, "num_dml_affected_rows", None)
+    error = getattr(job, "error_result", None)
+    return {
+        "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "job_id": getattr(job, "job_id", None),
+        "location": getattr(job, "location", None),
+        "job_type": getattr(job, "job_type", None),
+        "label": label,
+        "script": Path(sys.argv[0]).name if sys.argv and sys.argv[0] else None,
+        "statement_type": getattr(job, "statement_type", None),
+        "total_bytes_processed": getattr(job, "total_bytes_processed", None),
+        "total_bytes_billed": getattr(job, "total_bytes_billed", None),
+        "slot_ms": getattr(job, "slot_millis", None),
+        "cache_hit": getattr(job, "cache_hit", None),
+        "queue_ms": _ms_between(getattr(job, "created", None), getattr(job, "started", None)),
+        "exec_ms": _ms_between(getattr(job, "started", None), getattr(job, "ended", None)),
+        "output_rows": output_rows,
+        "error": error.get("message") if isinstance(error, dict) else None,
+    }
+
+
+def _write_table(client: Any, table_id: str, row: Dict[str, Any]) -> None:
+    from google.cloud import bigquery
+
+    if table_id not in _tables_ready:
+        schema = [bigquery.SchemaField(name, kind) for name, kind in METRIC_FIELDS]
+        table = bigquery.Table(table_id, schema=schema)
+        table.time_partitioning = bigquery.TimePartitioning(field="recorded_at")
+        client.create_table(table, exists_ok=True)
+        _tables_ready.add(table_id)
+    errors = client.insert_rows_json(table_id, [row])
+    if errors:
+        raise RuntimeError(f"insert_rows_json: {errors}")
+
+
+def record_job(
+    job: Any,
+    label: str,
+    client: Any = None,
+    path: str | Path = JOB_METRICS_PATH,
+    table_id: Optional[str] = JOB_METRICS_TABLE,
+) -> Optional[Dict[str, Any]]:
+    """Append a finished (or failed) job's metrics to the metrics file (and table); returns the row, None on failure."""
+    try:
+        row = job_metrics(job, label)
+        path = Path(path)
+        with _write_lock:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with path.open("a") as f:
+                f.write(json.dumps(row, default=str) + "\n")
+        if table_id and client is not None:
+            _write_table(client, table_id, row)
+        return row
+    except Exception as e:
+        print(f"Job metrics not recorded for {label}: {type(e).__name__}: {e}", file=sys.stderr)
+        return None
+
+
+def load_metrics(path: str | Path = JOB_METRICS_PATH) -> pd.DataFrame:
+    """All recorded rows (skipping unreadable lines), recorded_at as UTC timestamps."""
+    path = Path(path)
+    rows = []
+    if path.exists():
+        with path.open() as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    df = pd.DataFrame(rows, columns=[name for name, _ in METRIC_FIELDS])
+    df["recorded_at"] = pd.to_datetime(df["recorded_at"], utc=True)
+    return df
+
+
+def _window_stats(df: pd.DataFrame) -> pd.DataFrame:
+    jobs = df.assign(
+        gb_billed=df["total_bytes_billed"].astype("float64") / 1024 ** 3,
+        slot_s=df["slot_ms"].astype("float64") / 1000,
+        exec_s=df["exec_ms"].astype("float64") / 1000,
+        queue_s=df["queue_ms"].astype("float64") / 1000,
+        cache_hit=df["cache_hit"].astype("float64"),
+    )
+    grouped = jobs.groupby("label")
+    return pd.DataFrame({
+        "jobs": grouped.size(),
+        "cache_hit_pct": grouped["cache_hit"].mean() * 100,
+        "gb_billed": grouped["gb_billed"].sum(),
+        "avg_gb_billed": grouped["gb_billed"].mean(),
+        "avg_slot_s": grouped["slot_s"].mean(),
+        "p50_exec_s": grouped["exec_s"].median(),
+        "p95_exec_s": grouped["exec_s"].quantile(0.95),
+        "avg_queue_s": grouped["queue_s"].mean(),
+    })
+
+
+def metrics_report(df: pd.DataFrame, days: int = 7, now: Optional[datetime] = None) -> pd.DataFrame:
+    """
+    Per label over the last `days`: jobs, cache hit %, GB billed (total, per job), slot
+    seconds per job, p50 / p95 execution and mean queue seconds, plus the % change of
+    per-job GB billed and slot seconds against the `days` before. Sorted by GB billed.
+    """
+    now = now or datetime.now(timezone.utc)
+    current_start = pd.Timestamp(now - timedelta(days=days))
+    previous_start = pd.Timestamp(now - timedelta(days=2 * days))
+    current = _window_stats(df.loc[df["recorded_at"] >= current_start])
+    previous = _window_stats(df.loc[(df["recorded_at"] >= previous_start) & (df["recorded_at"] < current_start)])
+    report = current.join(previous[["avg_gb_billed", "avg_slot_s"]], rsuffix="_prev")
+    for col in ("avg_gb_billed", "avg_slot_s"):
+        prev = report[f"{col}_prev"].where(report[f"{col}_prev"] > 0)
+        report[f"{col}_chg_pct"] = (report[col] / prev - 1) * 100
+        report = report.drop(columns=f"{col}_prev")
+    return report.sort_values("gb_billed", ascending=False).round(2).reset_index()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="BigQuery job cost / latency metrics recorded by the scripts.")
+    parser.add_argument("--report", action="store_true", help="Summarize recorded jobs per label")
+    parser.add_argument("--days", type=int, default=7, help="Report window in days, compared with the window before (default 7)")
+    parser.add_argument("--label", default=None, help="Only this label (query file or step)")
+    parser.add_argument("--csv", default=None, help="Write the report to this CSV file")
+    args = parser.parse_args()
+    if not args.report:
+        parser.error("nothing to do (use --report)")
+
+    df = load_metrics()
+    if args.label:
+        df = df.loc[df["label"] == args.label]
+    if df.empty:
+        print(f"No job metrics recorded in {JOB_METRICS_PATH}", file=sys.stderr)
+        return 1
+    report = metrics_report(df, args.days)
+    if args.csv:
+        report.to_csv(args.csv, index=False)
+    else:
+        print(f"Last {args.days} days (change vs the {args.days} days before), from {JOB_METRICS_PATH}")
+        print(report.to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+"""
+Run any queries/*.sql file with BigQuery query parameters and a local result cache.
+
+Values are passed as ScalarQueryParameter / ArrayQueryParameter, never spliced into the
+SQL, so a file's text is the same on every run and BigQuery's own result cache can serve
+repeats. Names and types of the anomaly-check knobs and the docs/FILTER_CONTRACT.md
+dimensions are in PARAM_TYPES; other names are typed from the Python value. Only the
+parameters the SQL references (@name) are sent. A contract array filter the SQL
+references but the caller omits is sent empty, which means "no filter".
+
+Local result cache: results are pickled under QUERY_RESULT_CACHE, keyed by
+sha256(SQL text, parameters, data-freshness watermark). The watermark is the
+last-modified time and row counts of every table the SQL reads; views are resolved to
+their underlying tables. A source that cannot be inspected contributes the current hour
+instead, so such entries live at most an hour. SQL calling current_date /
+current_datetime / current_timestamp (the same rule BigQuery applies, e.g. the
+declare-based hourly report) or containing DML/DDL is never cached locally.
+
+Usage:
+  python scripts/bq_query_runner.py txn_dow_hourly_bin_stddev_params.sql \\
+      --param run_range_start=2026-10-01 --param run_range_end=2026-10-14 --param src_system_ids=115,134
+  --no-cache   always run a job (the result still refreshes the cache)
+  --csv PATH   write the result to a CSV file instead of printing it
+  --fetch      storage (default) | arrow-rest | rest
+
+Results are downloaded as Arrow through the BigQuery Storage Read API when
+google-cloud-bigquery-storage and pyarrow are installed (and the caller may create read
+sessions), else as Arrow over the REST tabledata API, else as one dict per row. Each
+path falls back to the next on error. To compare them on a synthetic result:
+  python scripts/bq_query_runner.py --benchmark-fetch 2000000
+
+Each job is capped with maximum_bytes_billed (--max-bytes-billed, BQ_MAX_BYTES_BILLED,
+default 2TB): a query that would bill more fails before it runs. Size a file first with
+scripts/bq_dry_run.py.
+
+Environment variables:
+  BIGQUERY_PROJECT     (optional, default: i-dss-streaming-data)
+  QUERY_RESULT_CACHE   (optional, default: ~/.cache/pplus-payments/query_results)
+  BQ_MAX_BYTES_BILLED  (optional, default: 2TB; 0 or none = no cap)
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+if __name__ == "__main__":
+    # Run in project .venv if not already in a virtual environment
+    _root = Path(__file__).resolve().parent.parent
+    _venv_py = _root / ".venv" / "bin" / "python"
+    if _venv_py.exists() and sys.prefix == sys.base_prefix:
+        os.execv(str(_venv_py), [str(_venv_py)] + sys.argv)
+
+import pandas as pd
+
+from google.cloud import bigquery
+
+from bq_job_metrics import record_job
+
+try:
+    import pyarrow  # noqa: F401  (RowIterator.to_dataframe needs it)
+except ImportError:
+    pyarrow = None
+
+try:
+    from google.cloud import bigquery_storage
+except ImportError:
+    bigquery_storage = None
+
+QUERIES_DIR = Path(__file__).resolve().parent.parent / "queries"
+QUERY_RESULT_CACHE = os.environ.get(
+    "QUERY_RESULT_CACHE",
+    str(Path.home() / ".cache" / "pplus-payments" / "query_results"),
+)
+CACHE_MAX_AGE_DAYS = 7
+# Watermark bucket for sources whose freshness cannot be read (views we cannot resolve, permission errors)
+UNKNOWN_SOURCE_BUCKET_SECONDS = 3600
+VIEW_RESOLVE_DEPTH = 3
+# Per-job maximum_bytes_billed: a query that would bill more fails instead of running
+# (a broken date filter must not become a full-history scan). "0" / "none" disables it.
+DEFAULT_MAX_BYTES_BILLED = "2TB"
+
+FETCH_STORAGE = "storage"  # Storage Read API (Arrow record batches over gRPC)
+FETCH_ARROW_REST = "arrow-rest"  # tabledata pages converted through Arrow
+FETCH_REST = "rest"  # tabledata pages, one dict per row
+
+PARAM_TYPES = {
+    # Run range and anomaly knobs (see the declare blocks of the *_EMAIL / _params queries)
+    "run_range_start": "DATE",
+    "run_range_end": "DATE",
+    "run_dt": "DATE",
+    "z_threshold": "FLOAT64",
+    "excluded_dts": "ARRAY<DATE>",
+    "latest_hour_only": "BOOL",
+    # docs/FILTER_CONTRACT.md dimensions (multi-selects are arrays; empty = all values)
+    "src_system_ids": "ARRAY<INT64>",
+    "country_cds": "ARRAY<STRING>",
+    "gateway_cds": "ARRAY<STRING>",
+    "gateway_regions": "ARRAY<STRING>",
+    "payment_method_descs": "ARRAY<STRING>",
+    "card_brand_nms": "ARRAY<STRING>",
+    "plan_cds": "ARRAY<STRING>",
+    "plan_tiers": "ARRAY<STRING>",
+    "trans_type_descs": "ARRAY<STRING>",
+    "trans_status_descs": "ARRAY<STRING>",
+    "failure_types": "ARRAY<STRING>",
+    "origin_descs": "ARRAY<STRING>",
+    "dows": "ARRAY<INT64>",
+    "hours": "ARRAY<INT64>",
+}
+# Scalars the SQL may reference without the caller giving a value
+PARAM_DEFAULTS = {"z_threshold": 3.0, "latest_hour_only": False}
+
+_NONDETERMINISTIC = re.compile(r"\bcurrent_(date|datetime|timestamp|time)\b|\brand\(\)|\bsession_user\(\)", re.I)
+_STATEMENTS_WITH_EFFECTS = re.compile(r"\b(insert|delete|update|merge|create|drop|alter|truncate)\s", re.I)
+_PARAM_REF = re.compile(r"@(\w+)")
+_TABLE_REF = re.compile(r"`?\b([a-z][a-z0-9-]{4,}[a-z0-9])\.([A-Za-z_][A-Za-z0-9_]*)\.([A-Za-z_][A-Za-z0-9_]*)\b`?")
+
+
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4, "P": 1024 ** 5}
+
+
+def parse_bytes(text: str | int | None) -> Optional[int]:
+    """"500GB" / "2TB" / "1048576" (binary units) as a byte count; None for "", "0" or "none"."""
+    if text is None or isinstance(text, int):
+        return text or None
+    if text.strip().lower() in ("", "none"):
+        return None
+    match = re.fullmatch(r"([\d.]+)\s*([KMGTP]?)I?B?", text.strip().upper())
+    if not match:
+        raise ValueError(f"Not a byte size: {text!r} (e.g. 500GB, 2TB)")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)]) or None
+
+
+def max_bytes_billed_from_env() -> Optional[int]:
+    """BQ_MAX_BYTES_BILLED (default DEFAULT_MAX_BYTES_BILLED) as bytes, None when disabled."""
+    return parse_bytes(os.environ.get("BQ_MAX_BYTES_BILLED", DEFAULT_MAX_BYTES_BILLED))
+
+
+def load_sql(name: str) -> str:
+    """Text of queries/<name> (or of a path to a .sql file)."""
+    path = Path(name)
+    if not path.exists():
+        path = QUERIES_DIR / name
+    if not path.exists():
+        raise FileNotFoundError(f"SQL file not found: {path}")
+    return path.read_text()
+
+
+def _strip_comments_and_strings(sql: str) -> str:
+    sql = re.sub(r"--[^\n]*", "", sql)
+    sql = re.sub(r"/\*.*?\*/", "", sql, flags=re.S)
+    return re.sub(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"", "''", sql)
+
+
+def referenced_params(sql: str) -> List[str]:
+    """Names of the @parameters the SQL uses, in first-use order."""
+    seen: Dict[str, None] = {}
+    for name in _PARAM_REF.findall(_strip_comments_and_strings(sql)):
+        seen.setdefault(name, None)
+    return list(seen)
+
+
+def referenced_tables(sql: str) -> List[str]:
+    """project.dataset.table references in the SQL."""
+    seen: Dict[str, None] = {}
+    for project, dataset, table in _TABLE_REF.findall(_strip_comments_and_strings(sql)):
+        seen.setdefault(f"{project}.{dataset}.{table}", None)
+    return list(seen)
+
+
+def is_cacheable(sql: str) -> bool:
+    """Deterministic read-only SQL (no current_* calls, no DML/DDL)."""
+    text = _strip_comments_and_strings(sql)
+    return not _NONDETERMINISTIC.search(text) and not _STATEMENTS_WITH_EFFECTS.search(text)
+
+
+def _infer_type(value: Any) -> str:
+    if isinstance(value, (list, tuple, set)):
+        items = list(value)
+        if not items:
+            raise ValueError("Cannot infer the element type of an empty array parameter; add it to PARAM_TYPES")
+        return f"ARRAY<{_infer_type(items[0])}>"
+    if isinstance(value, bool):
+        return "BOOL"
+    if isinstance(value, int):
+        return "INT64"
+    if isinstance(value, float):
+        return "FLOAT64"
+    if isinstance(value, datetime):
+        return "TIMESTAMP" if value.tzinfo else "DATETIME"
+    if isinstance(value, date):
+        return "DATE"
+    return "STRING"
+
+
+def _coerce(value: Any, type_: str) -> Any:
+    """Python value for a BigQuery scalar type (accepts strings, e.g. from the command line)."""
+    if value is None or not isinstance(value, str):
+        return value
+    if type_ == "DATE":
+        return date.fromisoformat(value)
+    if type_ in ("DATETIME", "TIMESTAMP"):
+        return datetime.fromisoformat(value)
+    if type_ == "INT64":
+        return int(value)
+    if type_ in ("FLOAT64", "NUMERIC"):
+        return float(value)
+    if type_ == "BOOL":
+        return value.strip().lower() in ("1", "true", "yes", "y")
+    return value
+
+
+def query_parameters(sql: str, params: Optional[Dict[str, Any]] = None) -> List[Any]:
+    """Scalar/Array query parameters for every @name the SQL references."""
+    params = params or {}
+    out = []
+    for name in referenced_params(sql):
+        type_ = PARAM_TYPES.get(name)
+        if name in params:
+            value = params[name]
+        elif name in PARAM_DEFAULTS:
+            value = PARAM_DEFAULTS[name]
+        elif type_ and type_.startswith("ARRAY<"):
+            value = []
+        else:
+            raise ValueError(f"SQL references @{name} but no value was given")
+        type_ = type_ or _infer_type(value)
+        if type_.startswith("ARRAY<"):
+            elem = type_[len("ARRAY<"):-1]
+            items = value.split(",") if isinstance(value, str) else list(value)
+            items = [v.strip() if isinstance(v, str) else v for v in items if v != ""]
+            out.append(bigquery.ArrayQueryParameter(name, elem, [_coerce(v, elem) for v in items]))
+        else:
+            out.append(bigquery.ScalarQueryParameter(name, type_, _coerce(value, type_)))
+    return out
+
+
+def rows_frame(job: Any) -> pd.DataFrame:
+    """REST fetch: one dict per row, then a frame (always available)."""
+    return pd.DataFrame([dict(row.items()) for row in job.result()])
+
+
+def result_frame(job: Any, bqstorage_client: Any = None, path: str = FETCH_STORAGE) -> tuple:
+    """
+    Rows of a query job as a columnar frame and the path that produced it. Prefers the
+    Storage Read API (bqstorage_client), then Arrow over REST; each falls back to the next
+    on error or when pyarrow / google-cloud-bigquery-storage are not installed.
+    """
+    if path == FETCH_STORAGE and bqstorage_client is not None and pyarrow is not None:
+        try:
+            return job.result().to_dataframe(bqstorage_client=bqstorage_client, create_bqstorage_client=False), FETCH_STORAGE
+        except Exception as e:
+            print(f"Storage Read API fetch failed, using REST: {type(e).__name__}: {e}", file=sys.stderr)
+    if path in (FETCH_STORAGE, FETCH_ARROW_REST) and pyarrow is not None:
+        try:
+            return job.result().to_dataframe(create_bqstorage_client=False), FETCH_ARROW_REST
+        except Exception as e:
+            print(f"Arrow fetch failed, using row dicts: {type(e).__name__}: {e}", file=sys.stderr)
+    return rows_frame(job), FETCH_REST
+
+
+def _param_key(parameters: Iterable[Any]) -> list:
+    return [p.to_api_repr() for p in parameters]
+
+
+class QueryRunner:
+    """Runs queries/ files with query parameters, through BigQuery's result cache and a local one."""
+
+    def __init__(
+        self,
+        client: "bigquery.Client",
+        cache_dir: str | Path = QUERY_RESULT_CACHE,
+        use_cache: bool = True,
+        fetch: str = FETCH_STORAGE,
+        max_bytes_billed: Optional[int] = None,
+    ) -> None:
+        self.client = client
+        self.max_bytes_billed = max_bytes_billed
+        self.fetch = fetch
+        self.fetch_paths: Dict[str, int] = {}
+        self._bqstorage: Any = None
+        self.cache_dir = Path(cache_dir)
+        self.use_cache = use_cache
+        self.local_hits = 0
+        self.jobs = 0
+        self.bq_cache_hits = 0
+        self.bytes_processed = 0
+        self._view_sources: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+
+    # --- freshness watermark ---
+
+    def _source_marks(self, ref: str, depth: int, marks: Dict[str, str]) -> None:
+        if ref in marks:
+            return
+        try:
+            if ref in self._view_sources:
+                table = None
+                sources = self._view_sources[ref]
+            else:
+                table = self.client.get_table(ref)
+                sources = referenced_tables(table.view_query) if table.table_type == "VIEW" else None
+            if sources is not None:
+                self._view_sources[ref] = sources
+                marks[ref] = "view"
+                if depth >= VIEW_RESOLVE_DEPTH or not sources:
+                    raise LookupError("view sources not resolved")
+                for source in sources:
+                    self._source_marks(source, depth + 1, marks)
+                return
+            streaming = table.streaming_buffer.estimated_rows if table.streaming_buffer else 0
+            marks[ref] = f"{table.modified.isoformat() if table.modified else ''}|{table.num_rows}|{streaming}"
+        except Exception:
+            marks[ref] = f"unknown@{int(time.time() // UNKNOWN_SOURCE_BUCKET_SECONDS)}"
+
+    def watermark(self, sql: str) -> Dict[str, str]:
+        """Freshness marks of every table the SQL reads (resolving views)."""
+        marks: Dict[str, str] = {}
+        for ref in referenced_tables(sql):
+            self._source_marks(ref, 0, marks)
+        return dict(sorted(marks.items()))
+
+    # --- local cache ---
+
+    def _cache_path(self, sql: str, parameters: List[Any], watermark: Dict[str, str]) -> Path:
+        payload = json.dumps([sql, _param_key(parameters), watermark], sort_keys=True, default=str)
+        return self.cache_dir / f"{hashlib.sha256(payload.encode()).hexdigest()}.pkl"
+
+    def _prune(self) -> None:
+        cutoff = time.time() - CACHE_MAX_AGE_DAYS * 86400
+        for path in self.cache_dir.glob("*.pkl"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass
+
+    # --- run ---
+
+    def _count(self, **deltas: int) -> None:
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def execute_job(self, sql: str, parameters: List[Any], label: Optional[str] = None) -> tuple:
+        """
+        Run SQL text with query parameters (no local cache); returns (frame, finished job).
+        The job's cost and latency (or error) are recorded under label (see bq_job_metrics).
+        """
+        job = self.client.query(
+            sql,
+            job_config=bigquery.QueryJobConfig(
+                query_parameters=parameters,
+                use_query_cache=True,
+                maximum_bytes_billed=self.max_bytes_billed,
+            ),
+        )
+        try:
+            job.result()
+        finally:
+            # Failed jobs too (e.g. stopped by maximum_bytes_billed): their error is recorded
+            record_job(job, label or "inline", client=self.client)
+        self._count(jobs=1, bytes_processed=job.total_bytes_processed or 0, bq_cache_hits=1 if job.cache_hit else 0)
+        return self.fetch_frame(job), job
+
+    def execute(self, sql: str, parameters: List[Any], label: Optional[str] = None) -> pd.DataFrame:
+        """Run SQL text with query parameters (no local cache) and fetch the result as a frame."""
+        return self.execute_job(sql, parameters, label)[0]
+
+    def bqstorage_client(self) -> Any:
+        """Storage Read API client (None if not installed), on the application default credentials like bigquery.Client."""
+        with self._lock:
+            if self._bqstorage is None and bigquery_storage is not None and self.fetch == FETCH_STORAGE:
+                self._bqstorage = bigquery_storage.BigQueryReadClient()
+            return self._bqstorage
+
+    def fetch_frame(self, job: Any) -> pd.DataFrame:
+        """Result of a finished job as a frame via self.fetch; a failing Storage API is not retried this run."""
+        storage = self.bqstorage_client() if self.fetch == FETCH_STORAGE else None
+        df, used = result_frame(job, storage, self.fetch)
+        with self._lock:
+            if self.fetch == FETCH_STORAGE and used != FETCH_STORAGE and storage is not None:
+                self.fetch = FETCH_ARROW_REST
+            self.fetch_paths[used] = self.fetch_paths.get(used, 0) + 1
+        return df
+
+    def run_with_info(self, sql_name: str, params: Optional[Dict[str, Any]] = None) -> tuple:
+        """
+        run() plus what served it: {"source": "local-cache" | "bigquery-cache" | "job",
+        "bytes_processed": int} (safe to call from several threads).
+        """
+        sql = load_sql(sql_name)
+        parameters = query_parameters(sql, params)
+        path = None
+        if is_cacheable(sql):
+            path = self._cache_path(sql, parameters, self.watermark(sql))
+            if self.use_cache and path.exists():
+                self._count(local_hits=1)
+                return pd.read_pickle(path), {"source": "local-cache", "bytes_processed": 0}
+        df, job = self.execute_job(sql, parameters, Path(sql_name).name)
+        if path is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            df.to_pickle(tmp)
+            tmp.replace(path)
+            self._prune()
+        source = "bigquery-cache" if job.cache_hit else "job"
+        return df, {"source": source, "bytes_processed": job.total_bytes_processed or 0}
+
+    def run(self, sql_name: str, params: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+        """Result of queries/<sql_name> for params, from the local cache when the sources have not changed."""
+        return self.run_with_info(sql_name, params)[0]
+
+    def summary(self) -> str:
+        return (
+            f"jobs={self.jobs} bigquery_cache_hits={self.bq_cache_hits} local_hits={self.local_hits} "
+            f"bytes_processed={self.bytes_processed} fetch={self.fetch_paths}"
+        )
+
+
+# Synthetic result shaped like the hourly counts rows, @rows long
+BENCHMARK_SQL = """
+select
+    n as row_id
+    , 115 + mod(n, 3) as src_system_id
+    , date_sub(date '2026-10-18', interval mod(n, 100) day) as trans_dt
+    , mod(n, 24) as trans_hr
+    , format('%06d', mod(n * 7919, 1000000)) as cc_first_6_nbr
+    , mod(n * 31, 500) as hourly_ct
+    , mod(n * 17, 400) as hourly_success_ct
+    , cast(n * 13 as string) as success_acct_ex1
+    , if(mod(n, 5) = 0, null, cast(n * 29 as string)) as decline_acct_ex1
+from unnest(generate_array(0, div(@rows - 1, 1000))) a, unnest(generate_array(0, 999)) b, unnest([a * 1000 + b]) n
+where n < @rows
+"""
+
+
+def benchmark_fetch(client: "bigquery.Client", rows: int) -> List[Dict[str, Any]]:
+    """Run BENCHMARK_SQL once and time fetching its result through each path."""
+    job = client.query(BENCHMARK_SQL, job_config=bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter("rows", "INT64", rows)]))
+    job.result()
+    results = []
+    for path in (FETCH_REST, FETCH_ARROW_REST, FETCH_STORAGE):
+        runner = QueryRunner(client, use_cache=False, fetch=path)
+        started = time.monotonic()
+        df = runner.fetch_frame(job)
+        results.append({
+            "requested": path,
+            "used": next(iter(runner.fetch_paths)),
+            "rows": len(df),
+            "seconds": round(time.monotonic() - started, 2),
+            "frame_mb": round(df.memory_usage(deep=True).sum() / 2**20, 1),
+        })
+    return results
+
+
+def _parse_param(text: str) -> tuple:
+    name, sep, value = text.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"Expected NAME=VALUE, got {text!r}")
+    return name.strip().lstrip("@"), value
+
+
+def main() -> int:
+    from dotenv import load_dotenv
+
+    load_dotenv(Path(__file__).resolve().parent.parent / ".env")
+    parser = argparse.ArgumentParser(description="Run a queries/ file with BigQuery query parameters.")
+    parser.add_argument("sql", nargs="?", help="File under queries/ (or a path to a .sql file)")
+    parser.add_argument("--param", action="append", type=_parse_param, default=[], metavar="NAME=VALUE",
+                        help="Query parameter; arrays comma-separated (repeatable)")
+    parser.add_argument("--no-cache", action="store_true", help="Skip the local result cache lookup")
+    parser.add_argument("--csv", default=None, help="Write the result to this CSV file")
+    parser.add_argument("--fetch", choices=(FETCH_STORAGE, FETCH_ARROW_REST, FETCH_REST), default=FETCH_STORAGE,
+                        help="Result download path (falls back storage -> arrow-rest -> rest)")
+    parser.add_argument("--max-bytes-billed", default=None, metavar="SIZE",
+                        help=f"Fail instead of billing more than SIZE, e.g. 500GB (default BQ_MAX_BYTES_BILLED or "
+                             f"{DEFAULT_MAX_BYTES_BILLED}; 0 = no cap)")
+    parser.add_argument("--benchmark-fetch", type=int, default=None, metavar="ROWS",
+                        help="Compare the fetch paths on a synthetic result of ROWS rows")
+    args = parser.parse_args()
+
+    project = os.environ.get("BIGQUERY_PROJECT", "i-dss-streaming-data")
+    if args.benchmark_fetch:
+        results = benchmark_fetch(bigquery.Client(project=project), args.benchmark_fetch)
+        print(pd.DataFrame(results).to_string(index=False))
+        return 0
+    if not args.sql:
+        parser.error("sql is required unless --benchmark-fetch is given")
+    cap = parse_bytes(args.max_bytes_billed) if args.max_bytes_billed is not None else max_bytes_billed_from_env()
+    runner = QueryRunner(bigquery.Client(project=project), use_cache=not args.no_cache, fetch=args.fetch,
+                         max_bytes_billed=cap)
+    started = time.monotonic()
+    df = runner.run(args.sql, dict(args.param))
+    print(f"{args.sql}: {len(df)} rows in {time.monotonic() - started:.2f}s ({runner.summary()})", file=sys.stderr)
+    if args.csv:
+        df.to_csv(args.csv, index=False)
+    else:
+        print(df.to_string(index=False, max_rows=200))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
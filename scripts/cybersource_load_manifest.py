@@ -0,0 +1,277 @@
+"""
+Load manifest for download_cybersource_daily_report.py: which report versions are already
+in d2c_cybs_dmdr, so reruns do only the work that changed.
+
+  - Per report date: sha256 of the raw report, row count, when it was loaded and how long
+    the load took. A report whose hash matches the last successful load is skipped
+    entirely (no staging load, no MERGE).
+  - Per (merchant_id, request_id): the report date and a 64-bit hash of the row last
+    MERGEd for it, i.e. the row from the newest report loaded so far (the MERGE keeps the
+    newest report's row). changed_rows() drops a row when the stored one is from a newer
+    report, or from the same report with the same hash; the rest are new or would win, so
+    the MERGE touches just those. A change in an older report therefore never overwrites
+    a newer report's row, whether the newer report is staged in the same run or skipped
+    as unchanged.
+  - Per key also the request day of the stored row. The MERGE reads only the target's
+    request-date partitions of the staged rows, plus those of stored rows whose request
+    day a new report changed (moved_dates()). That is only sound while every key in the
+    target is in the manifest ("complete"): seed() takes the keys of an existing target
+    once, a first load records all of its keys, and a load that failed after begin_merge()
+    leaves the flag cleared so the next run seeds again.
+
+Hashes of the reports being loaded are collected in a temporary table as chunks are
+staged; commit(), after the MERGE succeeded, stores each key's newest one. A failed load
+leaves the stored rows as they were. Stored in a small SQLite file (CYBS_LOAD_MANIFEST).
+Deleting it (or --force) just means the next run loads everything again.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, List, Optional, Sequence, Union
+
+import pandas as pd
+
+LOAD_MANIFEST_PATH = os.environ.get(
+    "CYBS_LOAD_MANIFEST",
+    str(Path.home() / ".cache" / "pplus-payments" / "cybersource_dmdr_manifest.sqlite"),
+)
+HASH_BLOCK_BYTES = 1024 * 1024
+
+
+def file_sha256(raw: BinaryIO) -> str:
+    """sha256 of a file object's content (rewound afterwards)."""
+    raw.seek(0)
+    digest = hashlib.sha256()
+    for block in iter(lambda: raw.read(HASH_BLOCK_BYTES), b""):
+        digest.update(block)
+    raw.seek(0)
+    return digest.hexdigest()
+
+
+def row_days(values: pd.Series) -> List[Optional[str]]:
+    """YYYY-MM-DD of each date / datetime / timestamp text (UTC day, like BigQuery DATE()); None if unparsable."""
+    parsed = pd.to_datetime(values, errors="coerce", utc=True, format="ISO8601")
+    rest = parsed.isna() & values.notna()
+    if rest.any():
+        parsed[rest] = pd.to_datetime(values[rest], errors="coerce", utc=True, format="mixed")
+    days = parsed.dt.tz_localize(None).to_numpy().astype("datetime64[D]").astype(str)
+    return [None if day == "NaT" else day for day in days.tolist()]
+
+
+def row_hashes(chunk: pd.DataFrame) -> pd.Series:
+    """Deterministic 64-bit hash of each row's values (as signed ints for SQLite)."""
+    return pd.util.hash_pandas_object(chunk, index=False).astype("int64")
+
+
+class LoadManifest:
+    """SQLite-backed report hashes per date and the row last MERGEd per key (thread-safe)."""
+
+    def __init__(
+        self,
+        path: Union[str, Path] = LOAD_MANIFEST_PATH,
+        keys: Sequence[str] = ("merchant_id", "request_id"),
+        date_column: Optional[str] = "request_date",
+    ) -> None:
+        self.path = Path(path)
+        self.keys = tuple(keys)
+        self.date_column = date_column
+        self._lock = threading.Lock()
+        self._moved: set = set()
+        self._was_complete: Optional[bool] = None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS report_loads ("
+            " report_date TEXT PRIMARY KEY,"
+            " content_sha256 TEXT NOT NULL,"
+            " row_count INTEGER NOT NULL,"
+            " changed_rows INTEGER NOT NULL,"
+            " loaded_at TEXT NOT NULL,"
+            " load_seconds REAL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS merged_rows ("
+            " k1 TEXT NOT NULL, k2 TEXT NOT NULL, report_date TEXT NOT NULL, row_hash INTEGER NOT NULL,"
+            " request_day TEXT, PRIMARY KEY (k1, k2))"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS manifest_info (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        # Rows of this run: every staged chunk, and the chunk being filtered
+        for table in ("seen_rows", "chunk_rows"):
+            self._conn.execute(
+                f"CREATE TEMP TABLE {table} ("
+                " k1 TEXT NOT NULL, k2 TEXT NOT NULL, report_date TEXT NOT NULL, row_hash INTEGER NOT NULL,"
+                " request_day TEXT, PRIMARY KEY (k1, k2, report_date))"
+            )
+        self._conn.execute(
+            "CREATE TEMP TABLE target_keys (k1 TEXT NOT NULL, k2 TEXT NOT NULL, request_day TEXT, PRIMARY KEY (k1, k2))"
+        )
+
+    def loaded_sha256(self, report_date: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_sha256 FROM report_loads WHERE report_date = ?", (report_date,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _complete(self) -> bool:
+        row = self._conn.execute("SELECT value FROM manifest_info WHERE name = 'complete'").fetchone()
+        return bool(row and row[0] == "1")
+
+    def _set_complete(self, complete: bool) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO manifest_info VALUES ('complete', ?)", ("1" if complete else "0",))
+
+    @property
+    def complete(self) -> bool:
+        """Whether every key in the target is in the manifest, with its request day."""
+        with self._lock:
+            return self._complete()
+
+    def seed(self, rows: Iterable[tuple]) -> int:
+        """
+        Take (k1, k2, request day) of every row in the target: keys gone from the target are
+        dropped, keys not in the manifest yet are added with no report (any staged row
+        replaces them). Marks the manifest complete; returns the number of keys.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("DELETE FROM target_keys")
+                self._conn.executemany("INSERT OR REPLACE INTO target_keys VALUES (?, ?, ?)", rows)
+                self._conn.execute(
+                    "DELETE FROM merged_rows WHERE NOT EXISTS"
+                    " (SELECT 1 FROM target_keys t WHERE t.k1 = merged_rows.k1 AND t.k2 = merged_rows.k2)"
+                )
+                self._conn.execute(
+                    "INSERT INTO merged_rows SELECT k1, k2, '', 0, request_day FROM target_keys WHERE TRUE"
+                    " ON CONFLICT (k1, k2) DO UPDATE SET request_day = excluded.request_day"
+                )
+                (n,) = self._conn.execute("SELECT count(*) FROM target_keys").fetchone()
+                self._conn.execute("DELETE FROM target_keys")
+                self._set_complete(True)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return n
+
+    def changed_rows(self, report_date: str, chunk: pd.DataFrame, force: bool = False) -> pd.DataFrame:
+        """
+        Record the chunk's row hashes for commit() and return its rows that are new, or whose
+        key was last MERGEd from an older report or with a different hash (all rows with
+        force, or if a key column is missing). The stored request days of the returned
+        rows' keys that differ from the rows' own are collected for moved_dates().
+        """
+        if not all(k in chunk.columns for k in self.keys) or chunk.empty:
+            return chunk
+        k1 = chunk[self.keys[0]].astype(str).tolist()
+        k2 = chunk[self.keys[1]].astype(str).tolist()
+        hashes = row_hashes(chunk).tolist()
+        if self.date_column in chunk.columns:
+            days = row_days(chunk[self.date_column])
+        else:
+            days = [None] * len(hashes)
+        superseded_sql = "FALSE" if force else (
+            "m.report_date > c.report_date OR (m.report_date = c.report_date AND m.row_hash = c.row_hash)"
+        )
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("DELETE FROM chunk_rows")
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO chunk_rows VALUES (?, ?, ?, ?, ?)",
+                    zip(k1, k2, [report_date] * len(hashes), hashes, days),
+                )
+                self._conn.execute("INSERT OR REPLACE INTO seen_rows SELECT * FROM chunk_rows")
+                superseded = set(self._conn.execute(
+                    f"SELECT c.k1, c.k2 FROM chunk_rows c JOIN merged_rows m USING (k1, k2) WHERE {superseded_sql}"
+                ).fetchall())
+                self._moved.update(day for (day,) in self._conn.execute(
+                    "SELECT DISTINCT m.request_day FROM chunk_rows c JOIN merged_rows m USING (k1, k2)"
+                    f" WHERE m.request_day IS NOT c.request_day AND NOT ({superseded_sql})"
+                ))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if not superseded:
+            return chunk
+        keep = [(a, b) not in superseded for a, b in zip(k1, k2)]
+        return chunk.loc[keep]
+
+    def moved_dates(self) -> Optional[List[Optional[str]]]:
+        """
+        Request days (None for NULL) of stored rows whose staged row has another request day,
+        i.e. target partitions the MERGE has to read besides the staged ones. None when the
+        manifest is not complete, so where the stored rows are is unknown.
+        """
+        with self._lock:
+            if not self._complete():
+                return None
+            return sorted(self._moved, key=lambda day: day or "")
+
+    def begin_merge(self) -> None:
+        """
+        Before the MERGE: until commit() the manifest may miss keys of the target. A load that
+        fails from here on leaves it incomplete (the MERGE may have gone through), so the next
+        run seeds again.
+        """
+        with self._lock:
+            self._was_complete = self._complete()
+            self._set_complete(False)
+
+    def commit(
+        self,
+        report_sha256: Dict[str, str],
+        changed: Dict[str, int],
+        load_seconds: Optional[float],
+        force: bool = False,
+        created: bool = False,
+    ) -> None:
+        """
+        After a successful load: store each key's row from the newest report staged (unless a
+        newer report's row is already stored; always with force), and record the loads. With
+        created (the load created the target) the manifest starts over from these rows.
+        """
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                if created:
+                    self._conn.execute("DELETE FROM merged_rows")
+                    self._conn.execute("DELETE FROM report_loads")
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO merged_rows"
+                    " SELECT s.k1, s.k2, s.report_date, s.row_hash, s.request_day FROM seen_rows s"
+                    " WHERE s.report_date = (SELECT max(report_date) FROM seen_rows n WHERE n.k1 = s.k1 AND n.k2 = s.k2)"
+                    " AND (? OR NOT EXISTS (SELECT 1 FROM merged_rows m"
+                    " WHERE m.k1 = s.k1 AND m.k2 = s.k2 AND m.report_date > s.report_date))",
+                    (force,),
+                )
+                for report_date, sha in report_sha256.items():
+                    (rows,) = self._conn.execute(
+                        "SELECT count(*) FROM seen_rows WHERE report_date = ?", (report_date,)
+                    ).fetchone()
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO report_loads VALUES (?, ?, ?, ?, ?, ?)",
+                        (report_date, sha, rows, changed.get(report_date, 0), now, load_seconds),
+                    )
+                if created or self._was_complete is not None:
+                    self._set_complete(created or bool(self._was_complete))
+                self._conn.execute("DELETE FROM seen_rows")
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._was_complete = None
+            self._moved.clear()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
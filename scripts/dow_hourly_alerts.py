@@ -0,0 +1,207 @@
+"""
+Alert state for the hourly BIN check (run_dow_hourly_slack.py), so a BIN that stays
+anomalous is emailed once, not every hour.
+
+An alert is one (geo, BIN, flag). The flag is the report row's Volume Flag
+("large_increase" / "large_decrease"); a row reported only for its success count has
+"success_large_increase" / "success_large_decrease" instead, so a success drop is never
+mistaken for (or merged with) a volume increase. It stays open while consecutive runs keep reporting it, whatever
+the hour or date of the row; dt / hr / Z Score are updated as the last seen values.
+Comparing a run's report rows with the open alerts gives the transitions:
+
+  new         reported now, no open alert (also a BIN that comes back after resolving)
+  escalating  open, and |Z Score| is at least ESCALATION_Z_STEP above the largest one
+              already emailed for it
+  resolved    open, not in this run's report
+
+Everything else is a repeat and is only recorded. diff() does not write: the caller
+emails the changes and calls apply() once that succeeded, so a failed send is retried
+on the next run. Stored in a small SQLite file (DOW_ALERT_STATE), with an event log of
+every emitted transition.
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Union
+
+ALERT_STATE_PATH = os.environ.get(
+    "DOW_ALERT_STATE",
+    str(Path.home() / ".cache" / "pplus-payments" / "dow_hourly_alerts.sqlite"),
+)
+ESCALATION_Z_STEP = 1.0
+TRANSITIONS = ("new", "escalating", "resolved")
+
+
+def _abs_z(row: Dict[str, Any]) -> float:
+    z = row.get("Z Score")
+    try:
+        return abs(float(z)) if z is not None and z == z else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _flag(value: Any) -> Any:
+    return value if isinstance(value, str) and value else None
+
+
+def alert_key(row: Dict[str, Any]) -> tuple:
+    """(geo, BIN, flag) of a report row: its Volume Flag, else success_ + its Success Flag."""
+    flag = _flag(row.get("Volume Flag"))
+    if flag is None and _flag(row.get("Success Flag")) is not None:
+        flag = "success_" + row["Success Flag"]
+    if flag is None:
+        # A report without the flag columns: the sign of the volume Diff
+        diff = row.get("Diff")
+        flag = "large_decrease" if diff is not None and diff == diff and diff < 0 else "large_increase"
+    return (str(row.get("geo")), str(row.get("BIN")), flag)
+
+
+def _dt(value: Any) -> str:
+    return str(value)[:10] if value is not None else ""
+
+
+def _int(value: Any) -> Any:
+    return int(value) if value is not None and value == value else None
+
+
+def _seen(dt: str, hr: Any) -> str:
+    return f"{dt} {hr:02d}h" if hr is not None else dt
+
+
+class AlertStore:
+    """SQLite-backed open/resolved alerts and transition log (thread-safe)."""
+
+    def __init__(self, path: Union[str, Path] = ALERT_STATE_PATH, escalation_z_step: float = ESCALATION_Z_STEP) -> None:
+        self.path = Path(path)
+        self.escalation_z_step = escalation_z_step
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS alerts ("
+            " geo TEXT NOT NULL,"
+            " bin TEXT NOT NULL,"
+            " flag TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " first_dt TEXT, first_hr INTEGER,"
+            " last_dt TEXT, last_hr INTEGER,"
+            " last_z REAL, max_emitted_abs_z REAL NOT NULL,"
+            " opened_at TEXT NOT NULL, updated_at TEXT NOT NULL,"
+            " PRIMARY KEY (geo, bin, flag))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS alert_events ("
+            " at TEXT NOT NULL, transition TEXT NOT NULL,"
+            " geo TEXT NOT NULL, bin TEXT NOT NULL, flag TEXT NOT NULL,"
+            " dt TEXT, hr INTEGER, z_score REAL, hourly_ct INTEGER, avg_ct INTEGER)"
+        )
+
+    def open_alerts(self) -> Dict[tuple, Dict[str, Any]]:
+        with self._lock:
+            cur = self._conn.execute(
+                "SELECT geo, bin, flag, first_dt, first_hr, last_dt, last_hr, last_z, max_emitted_abs_z"
+                " FROM alerts WHERE status = 'open'"
+            )
+            names = [d[0] for d in cur.description]
+            return {row[:3]: dict(zip(names, row)) for row in cur.fetchall()}
+
+    def diff(self, rows: Any) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Transitions of this run's report rows (DataFrame or dicts) against the open alerts,
+        without writing: {"new": [...], "escalating": [...], "resolved": [...], "repeat": [...]}.
+        Entries are the report row (largest |Z Score| per alert) plus "flag"; escalating ones
+        carry "Previous max |Z|", resolved ones are built from the stored alert.
+        """
+        if hasattr(rows, "to_dict"):
+            # Only the flagged rows of the report, so records are cheap here
+            rows = rows.astype(object).where(rows.notna(), None).to_dict("records")
+        current: Dict[tuple, Dict[str, Any]] = {}
+        for row in rows:
+            key = alert_key(row)
+            if key not in current or _abs_z(row) > _abs_z(current[key]):
+                current[key] = row
+        open_ = self.open_alerts()
+        changes: Dict[str, List[Dict[str, Any]]] = {name: [] for name in TRANSITIONS + ("repeat",)}
+        for key, row in current.items():
+            entry = dict(row, flag=key[2])
+            alert = open_.get(key)
+            if alert is None:
+                changes["new"].append(entry)
+            elif _abs_z(row) >= alert["max_emitted_abs_z"] + self.escalation_z_step:
+                entry["Previous max |Z|"] = alert["max_emitted_abs_z"]
+                changes["escalating"].append(entry)
+            else:
+                changes["repeat"].append(entry)
+        for key, alert in open_.items():
+            if key not in current:
+                changes["resolved"].append({
+                    "geo": key[0], "BIN": key[1], "flag": key[2],
+                    "First seen": _seen(alert["first_dt"], alert["first_hr"]),
+                    "Last seen": _seen(alert["last_dt"], alert["last_hr"]),
+                    "Last Z Score": alert["last_z"],
+                })
+        return changes
+
+    def apply(self, changes: Dict[str, List[Dict[str, Any]]]) -> None:
+        """Record a diff() result (after its changes were sent)."""
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for transition in ("new", "escalating", "repeat"):
+                    for entry in changes.get(transition, []):
+                        self._record(transition, entry, now)
+                for entry in changes.get("resolved", []):
+                    key = (entry["geo"], entry["BIN"], entry["flag"])
+                    self._conn.execute(
+                        "UPDATE alerts SET status = 'resolved', updated_at = ? WHERE geo = ? AND bin = ? AND flag = ?",
+                        (now, *key),
+                    )
+                    self._conn.execute(
+                        "INSERT INTO alert_events (at, transition, geo, bin, flag) VALUES (?, 'resolved', ?, ?, ?)",
+                        (now, *key),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _record(self, transition: str, entry: Dict[str, Any], now: str) -> None:
+        key = alert_key(entry)
+        dt, hr, z = _dt(entry.get("dt")), _int(entry.get("hr")), entry.get("Z Score")
+        z = float(z) if z is not None and z == z else None
+        if transition == "new":
+            self._conn.execute(
+                "INSERT OR REPLACE INTO alerts (geo, bin, flag, status, first_dt, first_hr, last_dt, last_hr,"
+                " last_z, max_emitted_abs_z, opened_at, updated_at) VALUES (?, ?, ?, 'open', ?, ?, ?, ?, ?, ?, ?, ?)",
+                (*key, dt, hr, dt, hr, z, _abs_z(entry), now, now),
+            )
+        else:
+            emitted = ", max_emitted_abs_z = ?" if transition == "escalating" else ""
+            params = [dt, hr, z, now] + ([_abs_z(entry)] if emitted else []) + list(key)
+            self._conn.execute(
+                f"UPDATE alerts SET last_dt = ?, last_hr = ?, last_z = ?, updated_at = ?{emitted}"
+                " WHERE geo = ? AND bin = ? AND flag = ?",
+                params,
+            )
+        if transition != "repeat":
+            self._conn.execute(
+                "INSERT INTO alert_events (at, transition, geo, bin, flag, dt, hr, z_score, hourly_ct, avg_ct)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (now, transition, *key, dt, hr, z, _int(entry.get("Hourly Count")), _int(entry.get("Average Count"))),
+            )
+
+    def summary(self) -> str:
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, count(*) FROM alerts GROUP BY status").fetchall())
+        return f"open={counts.get('open', 0)} resolved={counts.get('resolved', 0)} ({self.path})"
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,194 @@
+"""
+Persisted running baseline for the DOW/hour BIN check (run_dow_hourly_slack.py --engine local).
+
+Instead of re-reading ~13 same-weekday samples per BIN and hour for every check,
+BaselineState keeps, per (src_system_id, dow, trans_hr, cc_first_6_nbr), the sample
+count, sum and sum of squares of hourly_ct and hourly_success_ct over the baseline
+window of one run date: [run_dt - 3 months, run_dt), skipping excluded_dts.
+
+  - advance(counts, run_dt) moves the window: days that closed since the last run are
+    added, days that fell out of the 3-month window are subtracted. Sums are integers,
+    so removal is exact (no drift, unlike a floating-point Welford downdate).
+  - The newest baseline day is kept as it was applied and re-applied on every advance,
+    so hours the append job restates after midnight are picked up.
+  - chg_chk(hourly_volume, z_threshold) is a keyed lookup plus the avg / stddev_samp /
+    z-score arithmetic of dow_hourly_zscore.chg_from_sums.
+
+days_to_read(run_dt) names the days advance() needs (the days leaving the window and the
+newest applied day onwards), so a run reads just those. A state built with different
+excluded_dts, a run date going backwards, a state more than MAX_ADVANCE_DAYS behind or
+counts that do not cover those days trigger a full rebuild from the counts frame, which
+then has to hold the whole window.
+"""
+
+from __future__ import annotations
+
+import os
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from dow_hourly_zscore import (
+    BASELINE_MONTHS,
+    DEFAULT_EXCLUDED_DTS,
+    DEFAULT_Z_THRESHOLD,
+    KEY_COLUMNS,
+    SAMPLE_COLUMNS,
+    chg_from_sums,
+    normalize_counts,
+    usable_counts,
+)
+
+BASELINE_STATE_PATH = os.environ.get(
+    "DOW_BASELINE_STATE",
+    str(Path.home() / ".cache" / "pplus-payments" / "dow_hourly_baseline_state.pkl"),
+)
+STATE_VERSION = 1
+# A state further behind than this is rebuilt rather than moved day by day
+MAX_ADVANCE_DAYS = 7
+
+STATE_KEYS = ["src_system_id", "dow"] + KEY_COLUMNS[1:]
+SUM_COLUMNS = ["n"] + [f"{col}_{agg}" for col in SAMPLE_COLUMNS for agg in ("sum", "sumsq")]
+
+
+def window_start(run_dt: date) -> date:
+    """First baseline day for run_dt (BigQuery date_sub(run_dt, interval 3 month))."""
+    return (pd.Timestamp(run_dt) - pd.DateOffset(months=BASELINE_MONTHS)).date()
+
+
+def _sums(rows: pd.DataFrame) -> pd.DataFrame:
+    """n / sum / sum of squares per state key of usable_counts() rows."""
+    if rows.empty:
+        return pd.DataFrame(columns=SUM_COLUMNS, index=pd.MultiIndex.from_tuples([], names=STATE_KEYS), dtype=np.int64)
+    parts = {"n": np.ones(len(rows), dtype=np.int64)}
+    for col in SAMPLE_COLUMNS:
+        vals = rows[col].astype(np.int64)
+        parts[f"{col}_sum"] = vals
+        parts[f"{col}_sumsq"] = vals * vals
+    frame = pd.DataFrame(parts)
+    for key in STATE_KEYS:
+        frame[key] = rows[key].to_numpy()
+    return frame.groupby(STATE_KEYS, sort=False)[SUM_COLUMNS].sum()
+
+
+def _days_between(usable: pd.DataFrame, start: date, end: date) -> pd.DataFrame:
+    """Rows with start <= trans_dt < end."""
+    return usable.loc[(usable["trans_dt"] >= pd.Timestamp(start)) & (usable["trans_dt"] < pd.Timestamp(end))]
+
+
+class BaselineState:
+    """Running same-DOW/hour sums for the baseline window of run_dt (pickled between runs)."""
+
+    def __init__(self, excluded_dts: Iterable[date] = DEFAULT_EXCLUDED_DTS) -> None:
+        self.excluded_dts = tuple(sorted(set(excluded_dts)))
+        self.run_dt: Optional[date] = None
+        self.stats = _sums(pd.DataFrame(columns=STATE_KEYS + SAMPLE_COLUMNS + ["trans_dt"]))
+        # Rows of the newest baseline day (run_dt - 1) as applied, re-applied on the next advance
+        self.last_day = pd.DataFrame()
+        self.rebuilds = 0
+        self.days_added = 0
+        self.days_removed = 0
+
+    @classmethod
+    def load(cls, path: str | Path = BASELINE_STATE_PATH,
+             excluded_dts: Iterable[date] = DEFAULT_EXCLUDED_DTS) -> "BaselineState":
+        """Saved state, or an empty one if missing, from another version or for other excluded_dts."""
+        state = cls(excluded_dts)
+        path = Path(path)
+        if not path.exists():
+            return state
+        saved = pd.read_pickle(path)
+        if saved.get("version") != STATE_VERSION or tuple(saved.get("excluded_dts", ())) != state.excluded_dts:
+            return state
+        state.run_dt = saved["run_dt"]
+        state.stats = saved["stats"]
+        state.last_day = saved["last_day"]
+        return state
+
+    def save(self, path: str | Path = BASELINE_STATE_PATH) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        pd.to_pickle({
+            "version": STATE_VERSION,
+            "excluded_dts": self.excluded_dts,
+            "run_dt": self.run_dt,
+            "stats": self.stats,
+            "last_day": self.last_day,
+        }, path)
+
+    def _apply(self, rows: pd.DataFrame, sign: int) -> None:
+        if rows.empty:
+            return
+        delta = _sums(rows) * sign
+        stats = self.stats.add(delta, fill_value=0).astype(np.int64)
+        self.stats = stats.loc[stats["n"] != 0]
+
+    def rebuild(self, usable: pd.DataFrame, run_dt: date) -> None:
+        """Recompute the window of run_dt from scratch."""
+        self.stats = _sums(_days_between(usable, window_start(run_dt), run_dt))
+        self.last_day = _days_between(usable, run_dt - timedelta(days=1), run_dt)
+        self.run_dt = run_dt
+        self.rebuilds += 1
+
+    def days_to_read(self, run_dt: date) -> Optional[List[Tuple[date, date]]]:
+        """
+        Day ranges [start, end) advance() reads to move to run_dt: the newest applied day
+        through run_dt - 1, and the days leaving the window. None when it has to rebuild.
+        """
+        old = self.run_dt
+        if old is None or run_dt < old or (run_dt - old).days > MAX_ADVANCE_DAYS or window_start(run_dt) >= old:
+            return None
+        days = [(old - timedelta(days=1), run_dt)]
+        if window_start(old) < window_start(run_dt):
+            days.append((window_start(old), window_start(run_dt)))
+        return days
+
+    def covers(self, counts: pd.DataFrame, run_dt: date) -> bool:
+        """Whether counts hold rows in every range of days_to_read(run_dt) (so advance() need not rebuild)."""
+        days = self.days_to_read(run_dt)
+        if days is None or counts.empty:
+            return False
+        trans_dt = normalize_counts(counts)["trans_dt"]
+        return all(((trans_dt >= pd.Timestamp(start)) & (trans_dt < pd.Timestamp(end))).any() for start, end in days)
+
+    def advance(self, counts: pd.DataFrame, run_dt: date) -> None:
+        """
+        Move the window to run_dt using hourly counts of the days_to_read(run_dt) (more is
+        fine); falls back to rebuild(), which needs the whole window, when they are not covered.
+        """
+        usable = usable_counts(counts, self.excluded_dts)
+        old = self.run_dt
+        if not self.covers(counts, run_dt):
+            self.rebuild(usable, run_dt)
+            return
+        # Newest applied day: replace it with its current (possibly restated) rows
+        self._apply(self.last_day, -1)
+        added = _days_between(usable, old - timedelta(days=1), run_dt)
+        self._apply(added, +1)
+        removed = _days_between(usable, window_start(old), window_start(run_dt))
+        self._apply(removed, -1)
+        self.last_day = _days_between(usable, run_dt - timedelta(days=1), run_dt)
+        self.days_added += (run_dt - old).days
+        self.days_removed += (window_start(run_dt) - window_start(old)).days
+        self.run_dt = run_dt
+
+    def lookup(self, hv: pd.DataFrame) -> pd.DataFrame:
+        """hourly_volume() rows of run_dt with their baseline n / *_sum / *_sumsq (0 when no samples)."""
+        if self.run_dt is None or not (hv["trans_dt"] == pd.Timestamp(self.run_dt)).all():
+            raise ValueError(f"BaselineState is for run date {self.run_dt}; advance() it first")
+        out = hv.join(self.stats, on=STATE_KEYS)
+        out[SUM_COLUMNS] = out[SUM_COLUMNS].fillna(0).astype(np.int64)
+        return out
+
+    def chg_chk(self, hv: pd.DataFrame, z_threshold: float = DEFAULT_Z_THRESHOLD) -> pd.DataFrame:
+        """The chg_chk rows for run_dt's hours: lookup plus arithmetic."""
+        return chg_from_sums(self.lookup(hv), z_threshold)
+
+    def summary(self) -> str:
+        return (
+            f"run_dt={self.run_dt} keys={len(self.stats)} rebuilds={self.rebuilds} "
+            f"days_added={self.days_added} days_removed={self.days_removed}"
+        )
@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""
+Same-DOW / same-hour BIN baselines and z-scores computed locally with pandas.
+
+Mirrors dow_hour_baseline, chg_chk and the final select of
+queries/txn_dow_hourly_bin_stddev_EMAIL.sql (and its _INCREMENTAL variant) on a frame of
+hourly counts, i.e. rows of payment_ops_sandbox.txn_hourly_bin_counts:
+
+  baseline  avg / stddev_samp of hourly_ct and hourly_success_ct over the same weekday and
+            hour in [run_dt - 3 months, run_dt - 1 day], skipping excluded_dts. Only hours
+            that had transactions are samples, as in the SQL.
+  chg_chk   diff and z-score of each run-date hour against its baseline, flagged at
+            +/- z_threshold (volume and success-count variants)
+  report    latest hour of the run date per geo, baseline_avg_ct >= 20, either flag set
+
+BigQuery's cast(float64 as int64) and round(x, 2) round half away from zero; so do these.
+Baselines for any number of run dates come from per-key prefix sums and two binary
+searches per hour, so reruns and backfills are cheap local compute.
+
+Hourly counts for a whole window are cached in a local pickle (DOW_HOURLY_COUNTS_CACHE)
+and refreshed by re-reading only the newest partitions of the counts table;
+load_hourly_count_days() reads just a few given days.
+
+Parity with the SQL (needs BigQuery credentials):
+  python scripts/dow_hourly_zscore.py --parity-check
+runs queries/dow_hourly_zscore_PARITY.sql and this module on the same synthetic fixture
+and exits non-zero on any difference.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Iterable, Sequence
+
+if __name__ == "__main__":
+    # Run in project .venv if not already in a virtual environment
+    _root = Path(__file__).resolve().parent.parent
+    _venv_py = _root / ".venv" / "bin" / "python"
+    if _venv_py.exists() and sys.prefix == sys.base_prefix:
+        os.execv(str(_venv_py), [str(_venv_py)] + sys.argv)
+
+import numpy as np
+import pandas as pd
+
+HOURLY_COUNTS_TABLE = "i-dss-streaming-data.payment_ops_sandbox.txn_hourly_bin_counts"
+HOURLY_COUNTS_CACHE = os.environ.get(
+    "DOW_HOURLY_COUNTS_CACHE",
+    str(Path.home() / ".cache" / "pplus-payments" / "txn_hourly_bin_counts.pkl"),
+)
+PARITY_SQL = "dow_hourly_zscore_PARITY.sql"
+
+# Same defaults as the declare block of txn_dow_hourly_bin_stddev_EMAIL.sql
+DEFAULT_Z_THRESHOLD = 3.0
+DEFAULT_EXCLUDED_DTS = (date(2026, 1, 24), date(2999, 12, 31))
+MIN_BASELINE_AVG_CT = 20
+BASELINE_MONTHS = 3
+
+GEO_BY_SRC = {115: "US", 134: "INTL"}
+OTHER_GEO = "Legacy AU"
+
+COUNT_COLUMNS = [
+    "src_system_id", "trans_dt", "trans_hr", "cc_first_6_nbr",
+    "hourly_ct", "hourly_success_ct",
+    "success_acct_ex1", "success_acct_ex2", "decline_acct_ex1", "decline_acct_ex2",
+]
+KEY_COLUMNS = ["src_system_id", "trans_hr", "cc_first_6_nbr"]
+SAMPLE_COLUMNS = ["hourly_ct", "hourly_success_ct"]
+REPORT_COLUMNS = [
+    "geo", "dt", "hr", "BIN", "Average Count", "Std Deviation", "Hourly Count", "Diff", "Z Score",
+    "Volume Flag", "Success Flag",
+]
+
+# Composite sort key: group id in the high bits, days since epoch in the low 20 bits
+_DAY_BITS = 20
+_EPOCH = pd.Timestamp("1970-01-01")
+
+
+def _round_half_away(values: np.ndarray, decimals: int = 0) -> np.ndarray:
+    """BigQuery ROUND / CAST(float64 AS INT64): halves round away from zero (NaN stays NaN)."""
+    scale = 10.0 ** decimals
+    return np.sign(values) * np.floor(np.abs(values) * scale + 0.5) / scale
+
+
+def _days(values: pd.Series) -> np.ndarray:
+    return ((values - _EPOCH) // pd.Timedelta(days=1)).to_numpy(dtype=np.int64)
+
+
+def normalize_counts(counts: pd.DataFrame) -> pd.DataFrame:
+    """Hourly counts with trans_dt as datetime64 and integer counts (as read from BigQuery or the cache)."""
+    out = counts.copy()
+    out["trans_dt"] = pd.to_datetime(out["trans_dt"])
+    for col in ("src_system_id", "trans_hr", "hourly_ct", "hourly_success_ct"):
+        out[col] = out[col].astype(np.int64)
+    for col in COUNT_COLUMNS:
+        if col not in out:
+            out[col] = None
+    return out
+
+
+def window_sums(
+    samples: pd.DataFrame,
+    queries: pd.DataFrame,
+    value_columns: Sequence[str],
+    keys: Sequence[str] = KEY_COLUMNS,
+) -> pd.DataFrame:
+    """
+    For each query row (keys, dow, window_start, run_dt), the count, sum and sum of squares of
+    each value column over the sample rows with the same keys and weekday and
+    window_start <= trans_dt < run_dt. Integer prefix sums keep the sums exact.
+    """
+    group_keys = list(keys) + ["dow"]
+    combined = pd.concat([samples[group_keys], queries[group_keys]], ignore_index=True)
+    gid = combined.groupby(group_keys, sort=False, dropna=False).ngroup().to_numpy(dtype=np.int64)
+    sample_gid, query_gid = gid[: len(samples)], gid[len(samples):]
+
+    composite = (sample_gid << _DAY_BITS) + _days(samples["trans_dt"])
+    order = np.argsort(composite, kind="stable")
+    composite = composite[order]
+    hi = np.searchsorted(composite, (query_gid << _DAY_BITS) + _days(queries["run_dt"]), side="left")
+    lo = np.searchsorted(composite, (query_gid << _DAY_BITS) + _days(queries["window_start"]), side="left")
+
+    out = queries.copy()
+    out["n"] = hi - lo
+    for col in value_columns:
+        vals = samples[col].to_numpy(dtype=np.int64)[order]
+        csum = np.concatenate(([0], np.cumsum(vals)))
+        csq = np.concatenate(([0], np.cumsum(vals * vals)))
+        out[f"{col}_sum"] = csum[hi] - csum[lo]
+        out[f"{col}_sumsq"] = csq[hi] - csq[lo]
+    return out
+
+
+def mean_and_stddev(n: np.ndarray, total: np.ndarray, sumsq: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """avg and stddev_samp from count / sum / sum of squares (stddev NaN below 2 samples)."""
+    n_f = n.astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = total / n_f
+        # n * sumsq - sum^2 is exact in int64 for hourly counts
+        var = (n * sumsq - total * total) / (n_f * (n_f - 1))
+    std = np.where(n >= 2, np.sqrt(np.maximum(var, 0.0)), np.nan)
+    return mean, std
+
+
+def _as_int(values: np.ndarray) -> pd.Series:
+    return pd.Series(_round_half_away(values), dtype="Float64").astype("Int64")
+
+
+def _z_columns(actual: np.ndarray, avg_ct: pd.Series, std_ct: pd.Series, z_threshold: float) -> tuple:
+    avg = avg_ct.to_numpy(dtype=np.float64, na_value=np.nan)
+    std = std_ct.to_numpy(dtype=np.float64, na_value=np.nan)
+    diff = actual - avg
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.where(std == 0, np.nan, diff / std)
+    flag = np.full(len(z), None, dtype=object)
+    flag[z >= z_threshold] = "large_increase"
+    flag[z <= -z_threshold] = "large_decrease"
+    return pd.Series(diff).astype("Int64"), _round_half_away(z, 2), flag
+
+
+def usable_counts(counts: pd.DataFrame, excluded_dts: Iterable[date] = DEFAULT_EXCLUDED_DTS) -> pd.DataFrame:
+    """Rows that can be baseline samples or run-date hours: not excluded, BIN set (NULL never joins in SQL), with dow."""
+    counts = normalize_counts(counts)
+    excluded = pd.to_datetime(list(excluded_dts))
+    usable = counts.loc[~counts["trans_dt"].isin(excluded) & counts["cc_first_6_nbr"].notna()]
+    return usable.assign(dow=usable["trans_dt"].dt.dayofweek)
+
+
+def hourly_volume(usable: pd.DataFrame, run_dates: Iterable[date]) -> pd.DataFrame:
+    """Run-date hours of usable_counts() rows, with the run date and baseline window start."""
+    hv = usable.loc[usable["trans_dt"].isin(pd.to_datetime(list(run_dates)))].copy()
+    hv["run_dt"] = hv["trans_dt"]
+    hv["window_start"] = hv["run_dt"] - pd.DateOffset(months=BASELINE_MONTHS)
+    return hv.reset_index(drop=True)
+
+
+def chg_from_sums(stats: pd.DataFrame, z_threshold: float = DEFAULT_Z_THRESHOLD) -> pd.DataFrame:
+    """
+    chg_chk columns from run-date hours carrying their baseline n / *_sum / *_sumsq
+    (window_sums() or a BaselineState lookup). Hours without samples have no baseline and are dropped.
+    """
+    stats = stats.loc[stats["n"] > 0].reset_index(drop=True)
+    n = stats["n"].to_numpy(dtype=np.int64)
+
+    out = stats[["src_system_id", "trans_dt", "trans_hr", "cc_first_6_nbr"]].copy()
+    s_mean, s_std = mean_and_stddev(
+        n, stats["hourly_success_ct_sum"].to_numpy(dtype=np.int64), stats["hourly_success_ct_sumsq"].to_numpy(dtype=np.int64)
+    )
+    out["baseline_success_avg_ct"] = _as_int(s_mean)
+    out["baseline_success_stddev_ct"] = _as_int(s_std)
+    out["hourly_success_ct"] = stats["hourly_success_ct"].to_numpy()
+    diff, z, flag = _z_columns(out["hourly_success_ct"].to_numpy(dtype=np.float64),
+                               out["baseline_success_avg_ct"], out["baseline_success_stddev_ct"], z_threshold)
+    out["success_diff"], out["success_z_score"], out["success_chg_flag"] = diff, z, flag
+
+    mean, std = mean_and_stddev(
+        n, stats["hourly_ct_sum"].to_numpy(dtype=np.int64), stats["hourly_ct_sumsq"].to_numpy(dtype=np.int64)
+    )
+    out["baseline_avg_ct"] = _as_int(mean)
+    out["baseline_stddev_ct"] = _as_int(std)
+    out["hourly_ct"] = stats["hourly_ct"].to_numpy()
+    diff, z, flag = _z_columns(out["hourly_ct"].to_numpy(dtype=np.float64),
+                               out["baseline_avg_ct"], out["baseline_stddev_ct"], z_threshold)
+    out["vol_diff"], out["vol_z_score"], out["chg_flag"] = diff, z, flag
+
+    for col in ("success_acct_ex1", "success_acct_ex2", "decline_acct_ex1", "decline_acct_ex2"):
+        out[col] = stats[col].to_numpy()
+    return out
+
+
+def chg_chk(
+    counts: pd.DataFrame,
+    run_dates: Iterable[date],
+    z_threshold: float = DEFAULT_Z_THRESHOLD,
+    excluded_dts: Iterable[date] = DEFAULT_EXCLUDED_DTS,
+) -> pd.DataFrame:
+    """The chg_chk CTE: every run-date hour with a baseline, its diffs, z-scores and flags."""
+    usable = usable_counts(counts, excluded_dts)
+    hv = hourly_volume(usable, run_dates)
+    return chg_from_sums(window_sums(usable, hv, SAMPLE_COLUMNS), z_threshold)
+
+
+def report_mask(chg: pd.DataFrame, counts: pd.DataFrame, min_baseline_avg: int = MIN_BASELINE_AVG_CT) -> pd.Series:
+    """Rows of chg that the final select keeps: latest hour of the day per geo, floor and either flag."""
+    counts = normalize_counts(counts)
+    max_hr = counts.groupby(["src_system_id", "trans_dt"])["trans_hr"].max().rename("max_hr")
+    latest = chg.join(max_hr, on=["src_system_id", "trans_dt"])["max_hr"]
+    return (
+        (chg["trans_hr"] == latest)
+        & (chg["baseline_avg_ct"] >= min_baseline_avg).fillna(False).astype(bool)
+        & (chg["chg_flag"].notna() | chg["success_chg_flag"].notna())
+    )
+
+
+def report_from_chg(chg: pd.DataFrame, day_counts: pd.DataFrame, min_baseline_avg: int = MIN_BASELINE_AVG_CT) -> pd.DataFrame:
+    """The final select: report columns and order for the rows report_mask() keeps."""
+    rows = chg.loc[report_mask(chg, day_counts, min_baseline_avg)]
+    report = pd.DataFrame({
+        "geo": rows["src_system_id"].map(GEO_BY_SRC).fillna(OTHER_GEO),
+        "dt": rows["trans_dt"].dt.date,
+        "hr": rows["trans_hr"],
+        "BIN": rows["cc_first_6_nbr"],
+        "Average Count": rows["baseline_avg_ct"],
+        "Std Deviation": rows["baseline_stddev_ct"],
+        "Hourly Count": rows["hourly_ct"],
+        "Diff": rows["vol_diff"],
+        "Z Score": rows["vol_z_score"],
+        "Volume Flag": rows["chg_flag"],
+        "Success Flag": rows["success_chg_flag"],
+    })
+    report = report.sort_values(
+        ["geo", "dt", "hr", "BIN", "Average Count"], ascending=[True, False, True, True, True], kind="stable"
+    )
+    return report.reset_index(drop=True)[REPORT_COLUMNS]
+
+
+def anomaly_report(
+    counts: pd.DataFrame,
+    run_dt: date | None = None,
+    z_threshold: float = DEFAULT_Z_THRESHOLD,
+    excluded_dts: Iterable[date] = DEFAULT_EXCLUDED_DTS,
+    min_baseline_avg: int = MIN_BASELINE_AVG_CT,
+) -> pd.DataFrame:
+    """The email report (same columns and order as the SQL) for run_dt's latest hour (default: last day in counts)."""
+    counts = normalize_counts(counts)
+    if run_dt is None:
+        run_dt = counts["trans_dt"].max().date()
+    day = counts.loc[counts["trans_dt"] == pd.Timestamp(run_dt)]
+    return report_from_chg(chg_chk(counts, [run_dt], z_threshold, excluded_dts), day, min_baseline_avg)
+
+
+# --- Hourly counts from BigQuery, cached locally ---
+
+
+def load_hourly_counts(
+    runner: "QueryRunner",
+    start: date,
+    end: date,
+    cache_path: str | Path = HOURLY_COUNTS_CACHE,
+) -> pd.DataFrame:
+    """
+    Hourly counts for trans_dt in [start, end] (fetched through a bq_query_runner.QueryRunner).
+    Cached days are reused; the newest cached day and everything after it are re-read, since
+    the append job restates its latest hours.
+    """
+    from google.cloud import bigquery
+
+    path = Path(cache_path)
+    cached = None
+    if path.exists():
+        cached = normalize_counts(pd.read_pickle(path))
+        cached = cached.loc[(cached["trans_dt"] >= pd.Timestamp(start)) & (cached["trans_dt"] <= pd.Timestamp(end))]
+    fetch_from = start
+    if cached is not None and len(cached) and cached["trans_dt"].min() <= pd.Timestamp(start) + pd.Timedelta(days=7):
+        fetch_from = max(cached["trans_dt"].max().date(), start)
+    else:
+        cached = None
+
+    fresh = runner.execute(
+        f"select {', '.join(COUNT_COLUMNS)} from `{HOURLY_COUNTS_TABLE}` where trans_dt between @start and @end",
+        [
+            bigquery.ScalarQueryParameter("start", "DATE", fetch_from),
+            bigquery.ScalarQueryParameter("end", "DATE", end),
+        ],
+        label="txn_hourly_bin_counts (local cache refresh)",
+    )
+    fresh = normalize_counts(fresh.reindex(columns=COUNT_COLUMNS))
+    print(f"Hourly counts: {len(fresh)} rows fetched from {fetch_from}", file=sys.stderr)
+
+    if cached is not None:
+        counts = pd.concat([cached.loc[cached["trans_dt"] < pd.Timestamp(fetch_from)], fresh], ignore_index=True)
+    else:
+        counts = fresh
+    path.parent.mkdir(parents=True, exist_ok=True)
+    counts.to_pickle(path)
+    return counts
+
+
+def load_hourly_count_days(runner: "QueryRunner", days: Sequence[tuple]) -> pd.DataFrame:
+    """
+    Hourly counts for trans_dt in each [start, end) of days, in one query and without the
+    local cache (a few days, including the restated newest one).
+    """
+    from google.cloud import bigquery
+
+    where = " or ".join(f"(trans_dt >= @start_{i} and trans_dt < @end_{i})" for i in range(len(days)))
+    params = []
+    for i, (start, end) in enumerate(days):
+        params += [
+            bigquery.ScalarQueryParameter(f"start_{i}", "DATE", start),
+            bigquery.ScalarQueryParameter(f"end_{i}", "DATE", end),
+        ]
+    fresh = runner.execute(
+        f"select {', '.join(COUNT_COLUMNS)} from `{HOURLY_COUNTS_TABLE}` where {where}",
+        params,
+        label="txn_hourly_bin_counts (baseline days)",
+    )
+    fresh = normalize_counts(fresh.reindex(columns=COUNT_COLUMNS))
+    print(f"Hourly counts: {len(fresh)} rows fetched for " + ", ".join(f"{s}..{e}" for s, e in days), file=sys.stderr)
+    return fresh
+
+
+# --- Parity with the SQL on a synthetic fixture ---
+
+
+def fixture_counts(run_dt: date, days: int = 110, seed: int = 7) -> pd.DataFrame:
+    """
+    Deterministic hourly counts covering more than the 3-month window: steady BINs, a
+    constant BIN (stddev 0), a low-volume BIN (under the floor), missing hours, a spike on
+    an excluded date and spikes/drops on run_dt.
+    """
+    rng = np.random.default_rng(seed)
+    levels = {"411111": 60, "522222": 140, "601100": 25, "370000": 8, "400000": 30}
+    rows = []
+    for offset in range(days, -1, -1):
+        dt = run_dt - timedelta(days=offset)
+        for src in (115, 134, 999):
+            for hr in (0, 9, 13, 23):
+                for bin_nbr, level in levels.items():
+                    if bin_nbr == "400000":
+                        ct = level  # constant: stddev 0, z-score null
+                    else:
+                        if rng.random() < 0.08:
+                            continue  # hour with no transactions: not a baseline sample
+                        ct = int(rng.poisson(level * (1.5 if hr == 13 else 1.0)))
+                    if offset == 21:
+                        ct *= 6  # event day, listed in fixture_excluded_dts
+                    if offset == 0 and bin_nbr == "411111":
+                        ct = ct * 3 if src != 134 else ct // 4
+                    success = int(ct * rng.uniform(0.6, 0.95))
+                    if offset == 0 and bin_nbr == "522222":
+                        success = success // 5
+                    rows.append((src, dt, hr, bin_nbr, ct, success))
+    counts = pd.DataFrame(rows, columns=COUNT_COLUMNS[:6])
+    return normalize_counts(counts)
+
+
+def fixture_excluded_dts(run_dt: date) -> list[date]:
+    return [run_dt - timedelta(days=21), date(2999, 12, 31)]
+
+
+def parity_check(project: str, run_dt: date | None = None) -> int:
+    """Run the SQL and this module on the fixture; print and return the number of mismatching rows."""
+    from google.cloud import bigquery
+
+    from bq_query_runner import QueryRunner, load_sql, query_parameters
+
+    run_dt = run_dt or date.today()
+    counts = fixture_counts(run_dt)
+    excluded = fixture_excluded_dts(run_dt)
+
+    local = chg_chk(counts, [run_dt], DEFAULT_Z_THRESHOLD, excluded)
+    local["in_report"] = report_mask(local, counts).to_numpy()
+
+    records = counts.assign(trans_dt=counts["trans_dt"].dt.strftime("%Y-%m-%d"))[COUNT_COLUMNS[:6]]
+    runner = QueryRunner(bigquery.Client(project=project), use_cache=False)
+    sql = load_sql(PARITY_SQL)
+    remote = normalize_counts(runner.execute(sql, query_parameters(sql, {
+        "fixture_json": json.dumps(records.to_numpy().tolist()),
+        "run_dt": run_dt,
+        "z_threshold": DEFAULT_Z_THRESHOLD,
+        "excluded_dts": excluded,
+    }), label=PARITY_SQL))
+
+    keys = ["src_system_id", "trans_hr", "cc_first_6_nbr"]
+    compare = [
+        "baseline_avg_ct", "baseline_stddev_ct", "vol_diff", "vol_z_score", "chg_flag",
+        "baseline_success_avg_ct", "baseline_success_stddev_ct", "success_diff", "success_z_score",
+        "success_chg_flag", "in_report",
+    ]
+    merged = local.merge(remote, on=keys, how="outer", suffixes=("_local", "_sql"), indicator=True)
+    bad = merged["_merge"] != "both"
+    for col in compare:
+        a, b = merged[f"{col}_local"], merged[f"{col}_sql"]
+        if col.endswith("_z_score"):
+            a, b = a.to_numpy(dtype=np.float64, na_value=np.nan), b.to_numpy(dtype=np.float64, na_value=np.nan)
+            same = np.isclose(a, b, rtol=0, atol=1e-9) | (np.isnan(a) & np.isnan(b))
+        else:
+            same = (a.isna() & b.isna()).to_numpy() | (a.astype(object) == b.astype(object)).to_numpy()
+        bad |= ~same
+    mismatches = merged.loc[bad]
+    print(f"Parity on {len(counts)} fixture rows, run_dt={run_dt}: {len(local)} local rows, "
+          f"{len(remote)} SQL rows, {len(mismatches)} mismatches "
+          f"({int(local['in_report'].sum())} report rows)")
+    if len(mismatches):
+        print(mismatches.to_string(max_rows=50))
+    return len(mismatches)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Local DOW/hour BIN z-scores; parity check against the SQL.")
+    parser.add_argument("--parity-check", action="store_true", help="Compare with BigQuery on the synthetic fixture")
+    parser.add_argument("--run-dt", type=date.fromisoformat, default=None, help="Fixture run date (default: today)")
+    args = parser.parse_args()
+    if not args.parity_check:
+        parser.print_help()
+        return 0
+    from dotenv import load_dotenv
+
+    load_dotenv(Path(__file__).resolve().parent.parent / ".env")
+    project = os.environ.get("BIGQUERY_PROJECT", "i-dss-streaming-data")
+    return 1 if parity_check(project, args.run_dt) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
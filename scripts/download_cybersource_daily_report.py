@@ -5,10 +5,44 @@ Download the CyberSource daily_dmdr_dom report and upsert into BigQuery.
 Downloads from CyberSource Reporting API (production), skips row 1 (row 2 = headers),
 normalizes headers (spaces → underscores, lowercase), and MERGEs into
 i-dss-streaming-data.payment_ops_sandbox.d2c_cybs_dmdr on merchant_id and request_id.
+The report is streamed to a spooled temp file and parsed in chunks of CSV_CHUNK_ROWS, so
+memory use stays flat however large the report (monthly files, backfills).
+
+Backfill: --start-date/--end-date (YYYYMMDD, inclusive) downloads every day concurrently
+(--workers, default 4), retries days that return 404 "not generated yet" (--retries,
+--retry-wait), then does one staging load and one MERGE for the whole range; a key in
+several reports takes the newest report's row. Days that still fail are listed and the
+exit code is 1 after the rest are loaded:
+
+  .venv/bin/python scripts/download_cybersource_daily_report.py --start-date 20260701 --end-date 20260928
+
+Staging is typed Parquet: each column is converted to the target table's type (columns
+the target lacks are STRING and added to it, bumping its schema_version label), so the
+staging schema cannot drift between days. The first load (no target yet), a missing
+pyarrow, --csv, or a value that does not convert fall back to CSV with autodetect.
+
+Layout: the target is created partitioned by day on request_date and clustered on
+merchant_id, request_id, and the MERGE is limited to the request-date range of the staged
+rows, widened to the stored row of any staged key whose request_date moved (so the key is
+updated, not inserted twice), so a daily upsert reads a few partitions however long the
+history. The stored request dates come from the load manifest below, seeded once from the
+target's key and date columns; without them the MERGE reads the whole target. An older,
+unpartitioned target is rebuilt once with --relayout.
+
+Change detection: a manifest of past loads (scripts/cybersource_load_manifest.py) keeps each
+report's sha256 and, per (merchant_id, request_id), the report date and hash of the row last
+MERGEd. A rerun skips reports identical to their last load, and of a report that did change
+stages only rows that are new or would replace an older report's row (or changed within
+the same report), so a newer report's row is never overwritten by an older one. The
+manifest is written only after the MERGE succeeds; --force loads everything again.
 
 Environment variables (placeholders; set before running):
   CYBERSOURCE_KEY_ID       – API key / serial number (placeholder: YOUR_KEY_ID)
   CYBERSOURCE_SHARED_SECRET – Shared secret (placeholder: YOUR_SHARED_SECRET)
+  BQ_MAX_BYTES_BILLED      – Optional per-query byte cap (default 2TB; 0 = no cap)
+  CYBS_LOAD_MANIFEST       – Optional manifest path (default ~/.cache/pplus-payments/cybersource_dmdr_manifest.sqlite)
+
+Each BigQuery job's bytes, slot time and latency are recorded (scripts/bq_job_metrics.py).
 
 BigQuery uses Application Default Credentials (run gcloud auth application-default login
 or scripts/setup-adc.sh once).
@@ -35,8 +69,13 @@ import hmac
 import io
 import os
 import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from decimal import Decimal
 from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
 from urllib.parse import urlencode, urlparse
 
 # Run in project .venv if not already in a virtual environment
@@ -57,6 +96,16 @@ import requests
 from google.cloud import bigquery
 from google.api_core import exceptions as google_exceptions
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from bq_job_metrics import record_job
+from cybersource_load_manifest import LoadManifest, file_sha256
+from bq_query_runner import max_bytes_billed_from_env
+
 load_dotenv(_root / ".env")
 
 # --- Config (fixed per plan) ---
@@ -68,6 +117,26 @@ BQ_DATASET = "payment_ops_sandbox"
 BQ_TABLE = "d2c_cybs_dmdr"
 BQ_STAGING_TABLE = "d2c_cybs_dmdr_staging"
 MERGE_KEYS = ("merchant_id", "request_id")
+# Streaming: report bodies spill from memory to a temp file past SPOOL_MAX_BYTES, and are
+# parsed CSV_CHUNK_ROWS rows at a time, so peak memory does not grow with the report
+SPOOL_MAX_BYTES = 16 * 1024 * 1024
+DOWNLOAD_BLOCK_BYTES = 1024 * 1024
+CSV_CHUNK_ROWS = 50_000
+# Staging-only column: the report a row came from (a backfill MERGE keeps the newest row per key)
+REPORT_DATE_COLUMN = "_report_date"
+# Target layout: day partitions on the request date column, clustered on the MERGE keys,
+# so the MERGE only reads the partitions of the request dates in the staging batch (and of
+# the stored rows of staged keys, which the load manifest tracks)
+PARTITION_COLUMN = "request_date"
+CLUSTER_COLUMNS = MERGE_KEYS
+PARTITION_TYPES = ("DATE", "DATETIME", "TIMESTAMP")
+MANIFEST_SEED_PAGE_ROWS = 100_000
+# Label on the target table, bumped whenever report columns are added to it
+SCHEMA_VERSION_LABEL = "schema_version"
+# Backfill (--start-date/--end-date): parallel downloads, 404 ("not generated yet") retried
+DEFAULT_WORKERS = 4
+DEFAULT_RETRIES = 2
+DEFAULT_RETRY_WAIT_SECONDS = 120
 
 # Placeholders: read from env; user must set real values
 CYBERSOURCE_KEY_ID = os.environ.get("CYBERSOURCE_KEY_ID", "YOUR_KEY_ID")
@@ -113,11 +182,11 @@ def _build_signature(
     )
 
 
-def download_report(report_date: str) -> bytes:
+def download_report(report_date: str, dest: Optional[BinaryIO] = None) -> BinaryIO:
     """
     GET report from CyberSource Reporting API (production).
     report_date: YYYYMMDD.
-    Returns raw CSV bytes.
+    Streams the raw CSV into dest (default: a spooled temp file) and returns it rewound.
     """
     if CYBERSOURCE_KEY_ID == "YOUR_KEY_ID" or CYBERSOURCE_SHARED_SECRET == "YOUR_SHARED_SECRET":
         raise ValueError(
@@ -159,88 +228,510 @@ def download_report(report_date: str) -> bytes:
         "Accept": "text/csv",
     }
 
-    resp = requests.get(url, headers=headers, timeout=120)
-    if resp.status_code == 404:
-        raise FileNotFoundError(
-            f"Report not found (404) for reportDate={report_date}, reportName={REPORT_NAME}. "
-            "Report may not be generated yet."
-        )
-    if resp.status_code == 400:
-        raise ValueError(f"Bad request (400): {resp.text[:500]}")
-    resp.raise_for_status()
-    return resp.content
+    with requests.get(url, headers=headers, timeout=120, stream=True) as resp:
+        if resp.status_code == 404:
+            raise FileNotFoundError(
+                f"Report not found (404) for reportDate={report_date}, reportName={REPORT_NAME}. "
+                "Report may not be generated yet."
+            )
+        if resp.status_code == 400:
+            raise ValueError(f"Bad request (400): {resp.text[:500]}")
+        resp.raise_for_status()
+        out = dest if dest is not None else tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        for block in resp.iter_content(chunk_size=DOWNLOAD_BLOCK_BYTES):
+            out.write(block)
+    out.seek(0)
+    return out
+
+
+def _read_header(text: io.TextIOWrapper) -> List[str]:
+    # Row 0 = junk, row 1 = header
+    junk_row, header_row = text.readline(), text.readline()
+    if not junk_row or not header_row:
+        raise ValueError("CSV has fewer than 2 lines (need at least junk row + header).")
+    return [_normalize_header(h) for h in next(csv.reader([header_row]))]
 
 
-def process_csv(raw_csv: bytes) -> pd.DataFrame:
+def report_columns(raw: BinaryIO) -> List[str]:
+    """Normalized header of a raw report (file is rewound afterwards)."""
+    text = io.TextIOWrapper(raw, encoding="utf-8", errors="replace", newline="")
+    try:
+        return _read_header(text)
+    finally:
+        text.detach()
+        raw.seek(0)
+
+
+def read_report_chunks(raw: BinaryIO, chunk_rows: int = CSV_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
     """
     Skip first row; use row 2 as header; normalize header names
-    (spaces → underscores, lowercase).
+    (spaces → underscores, lowercase). Yields the data rows chunk_rows at a time,
+    read from the byte stream (values kept as text, empty / NA markers as missing).
     """
-    text = raw_csv.decode("utf-8", errors="replace")
-    lines = text.splitlines()
-    if len(lines) < 2:
-        raise ValueError("CSV has fewer than 2 lines (need at least junk row + header).")
-    # Row 0 = junk, row 1 = header
-    header_row = lines[1]
-    data_lines = lines[2:]
-    reader = csv.reader(io.StringIO(header_row))
-    raw_headers = next(reader)
-    normalized_headers = [_normalize_header(h) for h in raw_headers]
-    buf = io.StringIO()
-    buf.write(",".join(normalized_headers) + "\n")
-    buf.write("\n".join(lines[2:]))
-    buf.seek(0)
-    return pd.read_csv(buf)
-
-
-def load_staging_and_merge(df: pd.DataFrame) -> None:
-    """Load DataFrame to staging table, then MERGE into target on merchant_id and request_id."""
-    client = bigquery.Client(project=BQ_PROJECT)
+    text = io.TextIOWrapper(raw, encoding="utf-8", errors="replace", newline="")
+    try:
+        normalized_headers = _read_header(text)
+        yield from pd.read_csv(text, header=None, names=normalized_headers, dtype=str, chunksize=chunk_rows)
+    finally:
+        text.detach()
+
+
+def dated_chunks(
+    reports: Dict[str, BinaryIO],
+    row_counts: Optional[Dict[str, int]] = None,
+    row_filter: Optional[Callable[[str, pd.DataFrame], pd.DataFrame]] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Chunks of each report (YYYYMMDD -> raw file) tagged with REPORT_DATE_COLUMN; counts rows
+    per report. row_filter(report_date, chunk), if given, picks the rows to keep.
+    """
+    for report_date, raw in reports.items():
+        tag = datetime.strptime(report_date, "%Y%m%d").strftime("%Y-%m-%d")
+        for chunk in read_report_chunks(raw):
+            if row_filter is not None:
+                chunk = row_filter(report_date, chunk)
+            chunk[REPORT_DATE_COLUMN] = tag
+            if row_counts is not None:
+                row_counts[report_date] = row_counts.get(report_date, 0) + len(chunk)
+            yield chunk
+
+
+def stage_csv(chunks: Iterator[pd.DataFrame], columns: Optional[List[str]] = None) -> Tuple[List[str], BinaryIO, int]:
+    """
+    Write parsed chunks to one normalized CSV (header + rows) in a spooled temp file for the
+    load job, aligned to columns if given (missing ones left empty). Returns (columns, file
+    rewound, data row count).
+    """
+    staged = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    rows = 0
+    for i, chunk in enumerate(chunks):
+        if columns is None:
+            columns = list(chunk.columns)
+        elif list(chunk.columns) != columns:
+            chunk = chunk.reindex(columns=columns)
+        staged.write(chunk.to_csv(index=False, header=i == 0).encode("utf-8"))
+        rows += len(chunk)
+    staged.seek(0)
+    return columns or [], staged, rows
+
+
+class SchemaMismatch(ValueError):
+    """Report values that do not convert to the target table's column type."""
+
+
+_TRUE = {"true", "t", "yes", "y", "1"}
+_FALSE = {"false", "f", "no", "n", "0"}
+
+
+def _to_int(text: str) -> int:
+    try:
+        return int(text)
+    except ValueError:
+        value = float(text)
+        if not value.is_integer():
+            raise
+        return int(value)
+
+
+def _to_bool(text: str) -> bool:
+    lowered = text.strip().lower()
+    if lowered in _TRUE:
+        return True
+    if lowered in _FALSE:
+        return False
+    raise ValueError(text)
+
+
+def _typed_array(name: str, values: pd.Series, field_type: str) -> "pa.Array":
+    """Text values of one column as an Arrow array of the BigQuery type (raises SchemaMismatch)."""
+    present = values.notna()
+    kind = field_type.upper()
+    try:
+        if kind == "STRING":
+            return pa.array(values, type=pa.string(), from_pandas=True)
+        if kind in ("DATE", "DATETIME", "TIMESTAMP", "TIME"):
+            parsed = pd.to_datetime(values, errors="coerce", utc=kind == "TIMESTAMP")
+            bad = present & parsed.isna()
+            if bad.any():
+                raise ValueError(values[bad].iloc[0])
+            if kind == "DATE":
+                return pa.array(parsed.dt.date, type=pa.date32(), from_pandas=True)
+            if kind == "TIME":
+                return pa.array(parsed.dt.time, type=pa.time64("us"), from_pandas=True)
+            tz = "UTC" if kind == "TIMESTAMP" else None
+            return pa.array(parsed, type=pa.timestamp("us", tz=tz), from_pandas=True)
+        convert = {
+            "INTEGER": _to_int, "INT64": _to_int,
+            "FLOAT": float, "FLOAT64": float,
+            "BOOLEAN": _to_bool, "BOOL": _to_bool,
+            "NUMERIC": Decimal, "BIGNUMERIC": Decimal,
+        }.get(kind)
+        if convert is None:
+            raise SchemaMismatch(f"{name}: no Parquet conversion for BigQuery type {field_type}")
+        arrow_type = {
+            "INTEGER": pa.int64(), "INT64": pa.int64(),
+            "FLOAT": pa.float64(), "FLOAT64": pa.float64(),
+            "BOOLEAN": pa.bool_(), "BOOL": pa.bool_(),
+            "NUMERIC": pa.decimal128(38, 9), "BIGNUMERIC": pa.decimal256(76, 38),
+        }[kind]
+        converted = [convert(v.strip()) if isinstance(v, str) else None for v in values.where(present, None)]
+        return pa.array(converted, type=arrow_type)
+    except SchemaMismatch:
+        raise
+    except (ValueError, ArithmeticError, pa.ArrowInvalid) as e:
+        raise SchemaMismatch(f"{name}: {e} (target type {field_type})") from None
+
+
+def staging_schema(columns: List[str], target_schema: List["bigquery.SchemaField"]) -> List["bigquery.SchemaField"]:
+    """Staging columns typed as in the target table; columns the target lacks are STRING, _report_date DATE."""
+    target_types = {f.name: f.field_type for f in target_schema}
+    schema = []
+    for col in columns:
+        if col == REPORT_DATE_COLUMN:
+            schema.append(bigquery.SchemaField(col, "DATE"))
+        else:
+            schema.append(bigquery.SchemaField(col, target_types.get(col, "STRING")))
+    return schema
+
+
+def stage_parquet(chunks: Iterator[pd.DataFrame], schema: List["bigquery.SchemaField"]) -> Tuple[BinaryIO, int]:
+    """
+    Convert parsed chunks to typed Arrow (one Parquet row group per chunk) in a temp file.
+    Returns (file rewound, data row count); raises SchemaMismatch on a value the type rejects.
+    """
+    columns = [f.name for f in schema]
+    staged = tempfile.TemporaryFile()
+    writer = None
+    rows = 0
+    try:
+        for chunk in chunks:
+            chunk = chunk.reindex(columns=columns)
+            batch = pa.table({f.name: _typed_array(f.name, chunk[f.name], f.field_type) for f in schema})
+            if writer is None:
+                writer = pq.ParquetWriter(staged, batch.schema, compression="snappy")
+            writer.write_table(batch)
+            rows += len(chunk)
+        if writer is not None:
+            writer.close()
+    except BaseException:
+        staged.close()
+        raise
+    staged.seek(0)
+    return staged, rows
+
+
+def report_dates(start: str, end: str) -> List[str]:
+    """YYYYMMDD dates from start to end inclusive."""
+    first, last = datetime.strptime(start, "%Y%m%d"), datetime.strptime(end, "%Y%m%d")
+    if last < first:
+        raise ValueError(f"--end-date {end} is before --start-date {start}")
+    return [(first + timedelta(days=i)).strftime("%Y%m%d") for i in range((last - first).days + 1)]
+
+
+def download_with_retry(report_date: str, retries: int = DEFAULT_RETRIES,
+                        retry_wait: float = DEFAULT_RETRY_WAIT_SECONDS) -> BinaryIO:
+    """download_report() into an on-disk temp file, retrying a 404 (report not generated yet)."""
+    for attempt in range(retries + 1):
+        dest = tempfile.TemporaryFile()
+        try:
+            return download_report(report_date, dest)
+        except FileNotFoundError:
+            dest.close()
+            if attempt == retries:
+                raise
+            print(f"{report_date}: not generated yet, retrying in {retry_wait:.0f}s", file=sys.stderr)
+            time.sleep(retry_wait)
+        except BaseException:
+            dest.close()
+            raise
+    raise AssertionError("unreachable")
+
+
+def download_reports(
+    dates: List[str],
+    workers: int = DEFAULT_WORKERS,
+    retries: int = DEFAULT_RETRIES,
+    retry_wait: float = DEFAULT_RETRY_WAIT_SECONDS,
+) -> Tuple[Dict[str, BinaryIO], Dict[str, str]]:
+    """
+    Download reports concurrently on a bounded pool. Returns ({date: raw file} in date
+    order, {date: error} for days that could not be downloaded).
+    """
+    reports: Dict[str, BinaryIO] = {}
+    problems: Dict[str, str] = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(dates))), thread_name_prefix="download") as pool:
+        futures = {d: pool.submit(download_with_retry, d, retries, retry_wait) for d in dates}
+        for report_date, future in futures.items():
+            try:
+                reports[report_date] = future.result()
+            except Exception as e:
+                problems[report_date] = f"{type(e).__name__}: {e}"
+    return reports, problems
+
+
+def run_job(client: bigquery.Client, sql: str, label: str) -> bigquery.QueryJob:
+    """Run a statement (capped at BQ_MAX_BYTES_BILLED), wait for it and record its cost / latency or error (bq_job_metrics)."""
+    job = client.query(sql, job_config=bigquery.QueryJobConfig(maximum_bytes_billed=max_bytes_billed_from_env()))
+    try:
+        job.result()
+    finally:
+        record_job(job, label, client=client)
+    return job
+
+
+def get_target_table(client: bigquery.Client) -> Optional[bigquery.Table]:
+    """The target table, or None before the first load."""
+    try:
+        return client.get_table(f"{BQ_PROJECT}.{BQ_DATASET}.{BQ_TABLE}")
+    except google_exceptions.NotFound:
+        return None
+
+
+def stage_reports(
+    reports: Dict[str, BinaryIO],
+    columns: List[str],
+    target: Optional[bigquery.Table],
+    row_counts: Dict[str, int],
+    row_filter: Optional[Callable[[str, pd.DataFrame], pd.DataFrame]] = None,
+) -> Tuple[BinaryIO, int, Optional[List[bigquery.SchemaField]]]:
+    """
+    Staging file for the reports: typed Parquet with the target table's column types when the
+    target exists and pyarrow is installed, else (or when a value does not fit its type) CSV
+    for autodetect. Returns (file, data row count, Parquet schema or None for CSV).
+    row_filter is passed to dated_chunks() (and must be safe to apply twice).
+    """
+    columns = columns + [REPORT_DATE_COLUMN]
+    if target is not None and pa is not None:
+        schema = staging_schema(columns, target.schema)
+        try:
+            staged, n_rows = stage_parquet(dated_chunks(reports, row_counts, row_filter), schema)
+            return staged, n_rows, schema
+        except SchemaMismatch as e:
+            print(f"Typed Parquet staging not possible ({e}); loading CSV with autodetect.", file=sys.stderr)
+            row_counts.clear()
+            for raw in reports.values():
+                raw.seek(0)
+    _, staged, n_rows = stage_csv(dated_chunks(reports, row_counts, row_filter), columns)
+    return staged, n_rows, None
+
+
+def add_target_columns(client: bigquery.Client, target: bigquery.Table, staging_ref: str) -> bigquery.Table:
+    """Add report columns the target lacks (typed as staged) and bump its schema_version label."""
+    known = {f.name for f in target.schema}
+    new = [
+        bigquery.SchemaField(f.name, f.field_type)
+        for f in client.get_table(staging_ref).schema
+        if f.name not in known and f.name != REPORT_DATE_COLUMN
+    ]
+    if not new:
+        return target
+    version = int((target.labels or {}).get(SCHEMA_VERSION_LABEL, "1")) + 1
+    target.schema = list(target.schema) + new
+    target.labels = {**(target.labels or {}), SCHEMA_VERSION_LABEL: str(version)}
+    print(f"Target schema v{version}: added {', '.join(f.name for f in new)}", file=sys.stderr)
+    return client.update_table(target, ["schema", "labels"])
+
+
+def layout_clause(schema: List[bigquery.SchemaField]) -> str:
+    """PARTITION BY / CLUSTER BY for a table with this schema (no partitioning if PARTITION_COLUMN is not a date type)."""
+    types = {f.name: f.field_type.upper() for f in schema}
+    kind = types.get(PARTITION_COLUMN)
+    parts = []
+    if kind == "DATE":
+        parts.append(f"PARTITION BY {PARTITION_COLUMN}")
+    elif kind in PARTITION_TYPES:
+        parts.append(f"PARTITION BY DATE({PARTITION_COLUMN})")
+    else:
+        print(
+            f"Warning: {PARTITION_COLUMN} is {kind or 'missing'}, not one of {PARTITION_TYPES}; target is not partitioned.",
+            file=sys.stderr,
+        )
+    cluster = [c for c in CLUSTER_COLUMNS if c in types]
+    if cluster:
+        parts.append("CLUSTER BY " + ", ".join(cluster))
+    return " ".join(parts)
+
+
+def has_layout(target: bigquery.Table) -> bool:
+    tp = target.time_partitioning
+    return bool(tp is not None and tp.field == PARTITION_COLUMN and target.clustering_fields)
+
+
+def partition_predicate(
+    client: bigquery.Client,
+    staging_ref: str,
+    target: bigquery.Table,
+    moved_dates: Optional[List[Optional[str]]] = None,
+) -> str:
+    """
+    MERGE ON condition limiting the target to the request-date partitions in staging and
+    those of moved_dates (stored rows of staged keys that are on another day; None for a
+    NULL request_date), with constant bounds so BigQuery prunes. "" (the whole target) when
+    the target is not partitioned on PARTITION_COLUMN or moved_dates is None, i.e. where the
+    stored rows are is unknown: a stored row outside the bounds would not match, and its
+    key would be INSERTed a second time.
+    """
+    tp = target.time_partitioning
+    if tp is None or tp.field != PARTITION_COLUMN:
+        return ""
+    if moved_dates is None:
+        print(f"MERGE reads the whole target: the load manifest does not have every stored {PARTITION_COLUMN}.",
+              file=sys.stderr)
+        return ""
+    kind = {f.name: f.field_type.upper() for f in target.schema}[PARTITION_COLUMN]
+    job = run_job(
+        client,
+        f"SELECT CAST(MIN(DATE({PARTITION_COLUMN})) AS STRING) AS lo, CAST(MAX(DATE({PARTITION_COLUMN})) AS STRING) AS hi,"
+        f" COUNTIF({PARTITION_COLUMN} IS NULL) AS nulls FROM `{staging_ref}`",
+        "cybersource_dmdr: staging partition range",
+    )
+    row = next(iter(job.result()))
+    days = [d for d in [row["lo"], row["hi"]] + list(moved_dates) if d is not None]
+    lo, hi = (min(days), max(days)) if days else (None, None)
+    nulls = bool(row["nulls"]) or None in moved_dates
+    conditions = []
+    if lo is not None:
+        end = (datetime.strptime(hi, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+        if kind == "DATE":
+            conditions.append(f"target.{PARTITION_COLUMN} BETWEEN DATE '{lo}' AND DATE '{hi}'")
+        else:
+            conditions.append(f"target.{PARTITION_COLUMN} >= {kind} '{lo}' AND target.{PARTITION_COLUMN} < {kind} '{end}'")
+    if nulls:
+        conditions.append(f"target.{PARTITION_COLUMN} IS NULL")
+    if not conditions:
+        return ""
+    moved = f" (including {len(moved_dates)} stored day(s) of keys whose {PARTITION_COLUMN} moved)" if moved_dates else ""
+    print(f"MERGE limited to {PARTITION_COLUMN} {lo}..{hi}" + (" and NULL" if nulls else "") + moved, file=sys.stderr)
+    return " AND (" + " OR ".join(conditions) + ")"
+
+
+def seed_manifest(client: bigquery.Client, manifest: LoadManifest) -> None:
+    """
+    Record the key and request day of every target row in the load manifest, so the MERGE
+    can prune to the partitions of the staged keys' stored rows (first run with a manifest,
+    or after a load that failed mid-way). Reads only the key and date columns.
+    """
+    keys = ", ".join(f"CAST({k} AS STRING)" for k in MERGE_KEYS)
+    job = run_job(
+        client,
+        f"SELECT {keys}, CAST(DATE({PARTITION_COLUMN}) AS STRING) FROM `{BQ_PROJECT}.{BQ_DATASET}.{BQ_TABLE}`",
+        "cybersource_dmdr: seed load manifest",
+    )
+    n = manifest.seed(tuple(row.values()) for row in job.result(page_size=MANIFEST_SEED_PAGE_ROWS))
+    print(f"Load manifest seeded with {n} keys of {BQ_TABLE}.", file=sys.stderr)
+
+
+def relayout_target(client: bigquery.Client) -> None:
+    """
+    Rebuild an existing target with the partitioning / clustering layout: copy to a new table,
+    rename the old one to a backup, rename the new one into place, and drop the backup last,
+    so a failed step never leaves the target missing. Labels are carried over.
+    """
+    target = get_target_table(client)
+    if target is None:
+        print("No target table yet; it is created partitioned on the first load.", file=sys.stderr)
+        return
+    if has_layout(target):
+        print(f"{BQ_TABLE} is already partitioned on {PARTITION_COLUMN} and clustered.", file=sys.stderr)
+        return
+    target_ref = f"{BQ_PROJECT}.{BQ_DATASET}.{BQ_TABLE}"
+    new_ref = f"{target_ref}__relayout"
+    backup_ref = f"{target_ref}__prelayout"
+    labels = dict(target.labels or {})
+    run_job(client, f"CREATE OR REPLACE TABLE `{new_ref}` {layout_clause(target.schema)} AS SELECT * FROM `{target_ref}`",
+            "cybersource_dmdr: relayout copy")
+    run_job(client, f"ALTER TABLE `{target_ref}` RENAME TO `{BQ_TABLE}__prelayout`", "cybersource_dmdr: relayout backup")
+    try:
+        run_job(client, f"ALTER TABLE `{new_ref}` RENAME TO `{BQ_TABLE}`", "cybersource_dmdr: relayout rename")
+    except Exception:
+        # Put the original back; the copy stays as __relayout for a retry
+        run_job(client, f"ALTER TABLE `{backup_ref}` RENAME TO `{BQ_TABLE}`", "cybersource_dmdr: relayout restore")
+        raise
+    run_job(client, f"DROP TABLE `{backup_ref}`", "cybersource_dmdr: relayout drop backup")
+    if labels:
+        table = client.get_table(target_ref)
+        table.labels = labels
+        client.update_table(table, ["labels"])
+    print(f"Rebuilt {target_ref} with {layout_clause(target.schema)}", file=sys.stderr)
+
+
+def load_staging_and_merge(
+    columns: List[str],
+    staged: BinaryIO,
+    client: Optional[bigquery.Client] = None,
+    schema: Optional[List[bigquery.SchemaField]] = None,
+    moved_dates: Optional[List[Optional[str]]] = None,
+) -> None:
+    """
+    Load a stage_reports() file to staging table (Parquet with schema, else CSV autodetect),
+    then MERGE into target on merchant_id and request_id.
+    A key present in several reports (backfill) is taken from the newest one.
+    moved_dates: see partition_predicate() (None: the MERGE reads the whole target).
+    """
+    client = client or bigquery.Client(project=BQ_PROJECT)
     staging_ref = f"{BQ_PROJECT}.{BQ_DATASET}.{BQ_STAGING_TABLE}"
     target_ref = f"{BQ_PROJECT}.{BQ_DATASET}.{BQ_TABLE}"
 
-    # Use CSV load to avoid pyarrow dependency
-    buf = io.BytesIO()
-    df.to_csv(buf, index=False, date_format="%Y-%m-%d %H:%M:%S")
-    buf.seek(0)
-    job_config = bigquery.LoadJobConfig(
-        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
-        autodetect=True,
-        source_format=bigquery.SourceFormat.CSV,
-        skip_leading_rows=0,
+    if schema is not None:
+        job_config = bigquery.LoadJobConfig(
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+            source_format=bigquery.SourceFormat.PARQUET,
+            schema=schema,
+        )
+    else:
+        # CSV with autodetect: first load (no target to take types from) or no pyarrow
+        job_config = bigquery.LoadJobConfig(
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+            autodetect=True,
+            source_format=bigquery.SourceFormat.CSV,
+            skip_leading_rows=0,
+        )
+    load_job = client.load_table_from_file(staged, staging_ref, job_config=job_config, rewind=True)
+    try:
+        load_job.result()
+    finally:
+        record_job(load_job, f"cybersource_dmdr: load staging ({'parquet' if schema else 'csv'})", client=client)
+
+    # One row per key: the one from the latest report
+    keys = ", ".join(MERGE_KEYS)
+    source_sql = (
+        f"SELECT * EXCEPT ({REPORT_DATE_COLUMN}) FROM `{staging_ref}` WHERE TRUE "
+        f"QUALIFY ROW_NUMBER() OVER (PARTITION BY {keys} ORDER BY {REPORT_DATE_COLUMN} DESC) = 1"
     )
-    load_job = client.load_table_from_file(buf, staging_ref, job_config=job_config)
-    load_job.result()
+    columns = [c for c in columns if c != REPORT_DATE_COLUMN]
 
     # If target table does not exist, create it from staging (first run)
-    dataset_ref = bigquery.DatasetReference(BQ_PROJECT, BQ_DATASET)
-    target_table_ref = dataset_ref.table(BQ_TABLE)
-    try:
-        client.get_table(target_table_ref)
-    except google_exceptions.NotFound:
-        create_sql = f"CREATE TABLE `{target_ref}` AS SELECT * FROM `{staging_ref}` LIMIT 0"
-        client.query(create_sql).result()
+    target = get_target_table(client)
+    if target is None:
+        layout = layout_clause(client.get_table(staging_ref).schema)
+        create_sql = f"CREATE TABLE `{target_ref}` {layout} AS {source_sql} LIMIT 0"
+        run_job(client, create_sql, "cybersource_dmdr: create target")
         # Now append staging into empty target
-        client.query(f"INSERT `{target_ref}` SELECT * FROM `{staging_ref}`").result()
+        run_job(client, f"INSERT `{target_ref}` {source_sql}", "cybersource_dmdr: initial insert")
         return
+    target = add_target_columns(client, target, staging_ref)
+    if not has_layout(target):
+        print(f"Warning: {BQ_TABLE} is not partitioned on {PARTITION_COLUMN} and clustered; the MERGE scans "
+              "the whole table. Run once with --relayout.", file=sys.stderr)
 
     # Build MERGE: update all columns on match, insert on no match
-    columns = list(df.columns)
     set_clause = ", ".join(f"target.{c} = staging.{c}" for c in columns)
     insert_cols = ", ".join(columns)
     insert_vals = ", ".join(f"staging.{c}" for c in columns)
     on_clause = " AND ".join(f"target.{k} = staging.{k}" for k in MERGE_KEYS)
+    on_clause += partition_predicate(client, staging_ref, target, moved_dates)
 
     merge_sql = f"""
     MERGE `{target_ref}` AS target
-    USING `{staging_ref}` AS staging
+    USING ({source_sql}) AS staging
     ON {on_clause}
     WHEN MATCHED THEN
       UPDATE SET {set_clause}
     WHEN NOT MATCHED THEN
       INSERT ({insert_cols}) VALUES ({insert_vals})
     """
-    client.query(merge_sql).result()
+    job = run_job(client, merge_sql, "cybersource_dmdr: merge")
+    print(f"MERGE affected {job.num_dml_affected_rows} rows", file=sys.stderr)
 
 
 def main() -> None:
@@ -264,36 +755,156 @@ def main() -> None:
         metavar="FILE",
         help="Skip download; load from local CSV file and upsert to BigQuery.",
     )
+    parser.add_argument("--start-date", metavar="YYYYMMDD", help="Backfill: first report date (with --end-date)")
+    parser.add_argument("--end-date", metavar="YYYYMMDD", help="Backfill: last report date, inclusive")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Backfill: concurrent downloads (default {DEFAULT_WORKERS})",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=None,
+        help=f"Retries of a 404 (report not generated yet) per day (default {DEFAULT_RETRIES} for a backfill, 0 otherwise)",
+    )
+    parser.add_argument(
+        "--retry-wait",
+        type=float,
+        default=DEFAULT_RETRY_WAIT_SECONDS,
+        metavar="SECONDS",
+        help=f"Wait between 404 retries (default {DEFAULT_RETRY_WAIT_SECONDS})",
+    )
+    parser.add_argument(
+        "--csv",
+        action="store_true",
+        help="Stage as CSV with autodetect instead of typed Parquet",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Load every report and row even if unchanged since the last load (the manifest is still updated)",
+    )
+    parser.add_argument(
+        "--relayout",
+        action="store_true",
+        help=f"Rebuild the existing target partitioned on {PARTITION_COLUMN} and clustered on the MERGE keys, then exit",
+    )
     args = parser.parse_args()
 
+    if args.relayout:
+        try:
+            relayout_target(bigquery.Client(project=BQ_PROJECT))
+        except Exception as e:
+            print(f"BigQuery error: {e}", file=sys.stderr)
+            sys.exit(1)
+        return
+
+    backfill = bool(args.start_date or args.end_date)
+    if backfill and not (args.start_date and args.end_date):
+        parser.error("--start-date and --end-date go together")
+    if backfill and args.load_only:
+        parser.error("--load-only loads one file; it cannot be combined with --start-date/--end-date")
+
+    problems: Dict[str, str] = {}
     if args.load_only:
         path = Path(args.load_only)
         if not path.exists():
             print(f"Error: file not found: {path}", file=sys.stderr)
             sys.exit(1)
-        raw = path.read_bytes()
+        reports = {args.report_date: path.open("rb")}
     else:
         try:
-            raw = download_report(args.report_date)
-        except (ValueError, FileNotFoundError) as e:
-            print(f"Error: {e}", file=sys.stderr)
+            dates = report_dates(args.start_date, args.end_date) if backfill else [args.report_date]
+        except ValueError as e:
+            parser.error(str(e))
+        retries = args.retries if args.retries is not None else (DEFAULT_RETRIES if backfill else 0)
+        reports, problems = download_reports(dates, args.workers, retries, args.retry_wait)
+        for report_date, error in problems.items():
+            print(f"Error: {report_date}: {error}", file=sys.stderr)
+        if not reports:
             sys.exit(1)
 
-    df = process_csv(raw)
-    if df.empty:
-        print("No data rows after header; nothing to load.", file=sys.stderr)
-        sys.exit(0)
+    exit_code = 1 if problems else 0
+    client = target = None
+    try:
+        if not args.dry_run:
+            client = bigquery.Client(project=BQ_PROJECT)
+            target = get_target_table(client)
+    except Exception as e:
+        print(f"BigQuery error: {e}", file=sys.stderr)
+        sys.exit(1)
+    # Without a target (first load) nothing in the manifest is in BigQuery
+    force = args.force or (client is not None and target is None)
+
+    manifest = LoadManifest(keys=MERGE_KEYS, date_column=PARTITION_COLUMN)
+    if target is not None and has_layout(target) and not manifest.complete:
+        # The pruned MERGE needs the request date of every stored key
+        try:
+            seed_manifest(client, manifest)
+        except Exception as e:
+            print(f"Warning: load manifest not seeded ({type(e).__name__}: {e}); the MERGE reads the whole target.",
+                  file=sys.stderr)
+
+    # Skip reports identical to their last successful load
+    report_sha256 = {d: file_sha256(raw) for d, raw in reports.items()}
+    for report_date in list(reports):
+        if not force and manifest.loaded_sha256(report_date) == report_sha256[report_date]:
+            print(f"{report_date}: unchanged since last load; skipped.", file=sys.stderr)
+            reports.pop(report_date).close()
+            del report_sha256[report_date]
+    if not reports:
+        sys.exit(exit_code)
+
+    def changed_rows(report_date: str, chunk: pd.DataFrame) -> pd.DataFrame:
+        return manifest.changed_rows(report_date, chunk, force=force)
+
+    # One staging file for every report: columns are the union of their headers
+    columns: List[str] = []
+    for raw in reports.values():
+        columns += [c for c in report_columns(raw) if c not in columns]
+    row_counts: Dict[str, int] = {}
+    try:
+        if args.dry_run or args.csv:
+            _, staged, n_rows = stage_csv(dated_chunks(reports, row_counts, changed_rows), columns + [REPORT_DATE_COLUMN])
+            schema = None
+        else:
+            staged, n_rows, schema = stage_reports(reports, columns, target, row_counts, changed_rows)
+    except Exception as e:
+        print(f"Error: {type(e).__name__}: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        for raw in reports.values():
+            raw.close()
+    if len(reports) > 1:
+        print(f"Staged {n_rows} new or changed rows from {len(reports)} reports ({min(reports)}..{max(reports)})",
+              file=sys.stderr)
 
     if args.dry_run:
-        print(f"Dry run: would load {len(df)} rows. Columns: {list(df.columns)}")
-        return
+        print(f"Dry run: would load {n_rows} new or changed rows. Columns: {columns}")
+        if len(reports) > 1:
+            print("Rows per report: " + ", ".join(f"{d}={row_counts.get(d, 0)}" for d in reports))
+        sys.exit(exit_code)
+
+    if n_rows == 0:
+        print("No new or changed data rows; nothing to load.", file=sys.stderr)
+        manifest.commit(report_sha256, row_counts, None, force)
+        sys.exit(exit_code)
 
     try:
-        load_staging_and_merge(df)
-        print(f"Upserted {len(df)} rows into {BQ_PROJECT}.{BQ_DATASET}.{BQ_TABLE}")
+        t0 = time.monotonic()
+        moved_dates = manifest.moved_dates()
+        manifest.begin_merge()
+        with staged:
+            load_staging_and_merge(columns, staged, client, schema, moved_dates)
+        print(f"Upserted {n_rows} rows into {BQ_PROJECT}.{BQ_DATASET}.{BQ_TABLE}")
     except Exception as e:
         print(f"BigQuery error: {e}", file=sys.stderr)
         sys.exit(1)
+    manifest.commit(report_sha256, row_counts, time.monotonic() - t0, force, created=target is None)
+    manifest.close()
+    sys.exit(exit_code)
 
 
 if __name__ == "__main__":
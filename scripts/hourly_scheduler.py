@@ -0,0 +1,145 @@
+"""
+In-process scheduler for run_dow_hourly_slack.py --daemon.
+
+Runs a job at a fixed minute past the hour (default :10), or every N minutes counted from
+that minute, in one long-lived process, so the job keeps its warm state (BigQuery
+client and auth token, SMTP session, imported pandas) between runs instead of paying
+for a cron re-exec each time.
+
+  - Job errors are recorded and the schedule continues; a run that overruns its next
+    slot is not queued twice (the next run is the first slot after it finished).
+  - The last-run status is written as JSON to DOW_DAEMON_STATUS after every state
+    change (see read_status()), and SIGUSR1 prints it to stderr.
+  - SIGTERM / SIGINT stop the loop: a running job finishes, then the status is
+    written as "stopped" and run_forever() returns.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+STATUS_PATH = os.environ.get(
+    "DOW_DAEMON_STATUS",
+    str(Path.home() / ".cache" / "pplus-payments" / "dow_hourly_daemon_status.json"),
+)
+
+
+def next_run_at(now: datetime, minute: int = 10, every_minutes: int = 60) -> datetime:
+    """First slot after now: minute past midnight plus a multiple of every_minutes, restarting each day."""
+    day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    slot = day + timedelta(minutes=minute)
+    while slot <= now:
+        slot += timedelta(minutes=every_minutes)
+        if slot.date() != day.date():
+            day += timedelta(days=1)
+            slot = day + timedelta(minutes=minute)
+    return slot
+
+
+def read_status(path: str | Path = STATUS_PATH) -> Optional[Dict[str, Any]]:
+    path = Path(path)
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())
+
+
+class HourlyScheduler:
+    """Calls job() (returning an exit code) on the schedule until stop() or a signal."""
+
+    def __init__(
+        self,
+        job: Callable[[], int],
+        minute: int = 10,
+        every_minutes: int = 60,
+        status_path: str | Path = STATUS_PATH,
+        run_now: bool = False,
+    ) -> None:
+        if not 0 <= minute < 60 or every_minutes <= 0:
+            raise ValueError("minute must be 0-59 and every_minutes positive")
+        self.job = job
+        self.minute = minute
+        self.every_minutes = every_minutes
+        self.status_path = Path(status_path)
+        self.run_now = run_now
+        self._stop = threading.Event()
+        self.status: Dict[str, Any] = {
+            "pid": os.getpid(),
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "state": "starting",
+            "schedule": f"every {every_minutes} min from :{minute:02d}",
+            "runs": 0,
+            "failures": 0,
+            "last_run": None,
+            "last_success_at": None,
+            "next_run_at": None,
+        }
+
+    def install_signal_handlers(self) -> None:
+        signal.signal(signal.SIGTERM, self._on_stop_signal)
+        signal.signal(signal.SIGINT, self._on_stop_signal)
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda *_: print(json.dumps(self.status, indent=2), file=sys.stderr))
+
+    def _on_stop_signal(self, signum: int, _frame: Any) -> None:
+        print(f"Received {signal.Signals(signum).name}; stopping after the current run.", file=sys.stderr)
+        self.stop()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _write_status(self, **changes: Any) -> None:
+        self.status.update(changes)
+        self.status_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.status_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.status, indent=2, default=str))
+        tmp.replace(self.status_path)
+
+    def run_once(self) -> int:
+        started = datetime.now()
+        self._write_status(state="running", current_run_started_at=started.isoformat(timespec="seconds"))
+        t0 = time.monotonic()
+        error = None
+        try:
+            code = int(self.job() or 0)
+        except Exception as e:
+            traceback.print_exc()
+            code, error = 1, f"{type(e).__name__}: {e}"
+        run = {
+            "started_at": started.isoformat(timespec="seconds"),
+            "seconds": round(time.monotonic() - t0, 1),
+            "exit_code": code,
+            "error": error,
+        }
+        changes: Dict[str, Any] = {"last_run": run, "runs": self.status["runs"] + 1, "current_run_started_at": None}
+        if code == 0:
+            changes["last_success_at"] = run["started_at"]
+        else:
+            changes["failures"] = self.status["failures"] + 1
+        self._write_status(**changes)
+        return code
+
+    def run_forever(self) -> int:
+        """Loop until stopped; returns 0 (job failures are in the status, not the exit code)."""
+        if self.run_now and not self._stop.is_set():
+            self.run_once()
+        while not self._stop.is_set():
+            due = next_run_at(datetime.now(), self.minute, self.every_minutes)
+            self._write_status(state="idle", next_run_at=due.isoformat(timespec="seconds"))
+            print(f"Next run at {due:%Y-%m-%d %H:%M}.", file=sys.stderr)
+            # Sleep in short steps so a wall-clock change (suspend, NTP) cannot skip a slot for long
+            while not self._stop.is_set() and datetime.now() < due:
+                self._stop.wait(min(30.0, max(0.0, (due - datetime.now()).total_seconds())))
+            if self._stop.is_set():
+                break
+            self.run_once()
+        self._write_status(state="stopped", next_run_at=None, stopped_at=datetime.now().isoformat(timespec="seconds"))
+        return 0
@@ -9,11 +9,44 @@ Environment variables:
   SMTP_PASSWORD_FILE  (optional: path to file containing password; used instead of SMTP_PASSWORD)
   BIGQUERY_PROJECT  (optional, default: i-dss-streaming-data)
   EMAIL_MAX_ROWS    (optional, default: 25 — max rows included in email body)
+  BQ_MAX_BYTES_BILLED (optional, default: 2TB — per-job cap; a query that would bill more fails; 0 = no cap)
 
 Cron example (run at 10 minutes past every hour):
   10 * * * * cd /path/to/pplus-web-payments-cursor-explore && .venv/bin/python scripts/run_dow_hourly_slack.py
   (Or: python scripts/run_dow_hourly_slack.py — script re-execs with .venv if not already in a venv.)
 
+Incremental mode (--incremental): instead of rescanning three months of transactions every
+hour, first run queries/txn_hourly_bin_counts_APPEND.sql, which appends the hours closed since
+the last run to the txn_hourly_bin_counts table (backfilling it on first use), then compute
+the same report from those hourly rows with txn_dow_hourly_bin_stddev_INCREMENTAL.sql.
+
+Local engine (--engine local, implies --incremental): after the append, only the hourly rows
+of the days entering and leaving the baseline window since the last run are read (the whole
+window, through a local cache in scripts/dow_hourly_zscore.py, only when the baseline state is
+rebuilt), the open hour is added with txn_hourly_bin_counts_LIVE.sql, and z-scores and the report
+are computed with pandas. The baseline is a running count/sum/sum-of-squares state per BIN,
+weekday and hour (scripts/dow_hourly_baseline_state.py) that each run moves forward by the
+days that closed and left the 3-month window. DOW_HOURLY_COUNTS_CACHE and DOW_BASELINE_STATE
+(optional) set the cache and state files.
+
+Daemon mode (--daemon): instead of cron, keep one process running that checks at :10 past
+every hour (--at-minute, --every MINUTES for other cadences; --run-now to also run at startup),
+reusing its BigQuery client and SMTP session between runs. The last-run status is written to
+DOW_DAEMON_STATUS (default ~/.cache/pplus-payments/dow_hourly_daemon_status.json); print it with
+--status. SIGTERM or Ctrl-C stops the daemon after the current run.
+
+Alerts are de-duplicated: each (geo, BIN, volume or success-count flag) stays an open alert
+while it keeps being reported, and the email lists only new, escalating (|z| up by 1 or more since last emailed)
+and resolved alerts. No email is sent when nothing changed. The state is a SQLite file,
+DOW_ALERT_STATE (default ~/.cache/pplus-payments/dow_hourly_alerts.sqlite); --no-dedup emails
+the full table every run as before.
+
+Suite mode (--suite [MANIFEST]): run every check listed in scripts/anomaly_checks.toml (the
+hourly BIN report in the mode chosen above, plus the daily AVS-failure, decline-type, BIN/country
+and BIN-rate checks) with all BigQuery jobs in flight at once, and send one combined digest.
+The hourly BIN section is de-duplicated as above (only new / escalating / resolved alerts;
+--no-dedup for the full table). Works with --daemon.
+
 Set SMTP_* and optionally BIGQUERY_PROJECT in crontab or via a wrapper that sources .env.
 BigQuery uses Application Default Credentials (run scripts/setup-adc.sh first).
 
@@ -25,7 +58,9 @@ loaded from the project venv. Create the venv with:
 
 from __future__ import annotations
 
+import argparse
 import io
+import json
 import os
 import smtplib
 import sys
@@ -50,6 +85,20 @@ import pandas as pd
 
 from google.cloud import bigquery
 
+from anomaly_suite import SUITE_MANIFEST, format_suite_body, load_manifest, run_suite, suite_subject
+from bq_query_runner import QueryRunner, max_bytes_billed_from_env
+from dow_hourly_alerts import TRANSITIONS, AlertStore
+from dow_hourly_baseline_state import BaselineState, window_start
+from dow_hourly_zscore import (
+    hourly_volume,
+    load_hourly_count_days,
+    load_hourly_counts,
+    normalize_counts,
+    report_from_chg,
+    usable_counts,
+)
+from hourly_scheduler import STATUS_PATH, HourlyScheduler, read_status
+
 load_dotenv(_root / ".env")
 
 # Fixed recipient: Slack channel email (emails post to channel)
@@ -65,20 +114,95 @@ def repo_root() -> Path:
     return script_dir
 
 
-def load_sql() -> str:
-    path = repo_root() / "queries" / "txn_dow_hourly_bin_stddev_EMAIL.sql"
-    if not path.exists():
-        raise FileNotFoundError(f"SQL file not found: {path}")
-    return path.read_text()
+REPORT_SQL = "txn_dow_hourly_bin_stddev_EMAIL.sql"
+# --incremental: keep the hourly counts table current, then report from it
+HOURLY_COUNTS_APPEND_SQL = "txn_hourly_bin_counts_APPEND.sql"
+INCREMENTAL_REPORT_SQL = "txn_dow_hourly_bin_stddev_INCREMENTAL.sql"
+# --engine local: hours after the last loaded one, in the hourly counts row shape
+HOURLY_COUNTS_LIVE_SQL = "txn_hourly_bin_counts_LIVE.sql"
+
+
+def _format_bytes(n: int | None) -> str:
+    if n is None:
+        return "unknown bytes"
+    size = float(n)
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.2f} TB"
+
+
+_runners: dict[str, QueryRunner] = {}
+
+
+def query_runner(project: str) -> QueryRunner:
+    """One BigQuery client and query runner per project for the process."""
+    runner = _runners.get(project)
+    if runner is None:
+        runner = _runners[project] = QueryRunner(
+            bigquery.Client(project=project), max_bytes_billed=max_bytes_billed_from_env()
+        )
+    return runner
+
+
+def run_query(project: str, sql_name: str = REPORT_SQL, params: dict | None = None) -> pd.DataFrame:
+    """Execute a queries/ file (with query parameters) and return the rows of the last SELECT as a DataFrame."""
+    df, info = query_runner(project).run_with_info(sql_name, params)
+    if info["source"] == "local-cache":
+        print(f"{sql_name}: served from the local result cache", file=sys.stderr)
+    else:
+        print(f"{sql_name}: {_format_bytes(info['bytes_processed'])} processed", file=sys.stderr)
+    return df
+
+
+def append_hourly_counts(project: str) -> None:
+    """Append newly closed hours to the hourly counts table."""
+    loaded = run_query(project, HOURLY_COUNTS_APPEND_SQL)
+    if len(loaded):
+        info = loaded.iloc[0]
+        print(
+            f"Hourly counts: loaded {info.get('load_start')} .. {info.get('loaded_until')} "
+            f"(previously through {info.get('previously_loaded_through')})",
+            file=sys.stderr,
+        )
 
 
-def run_query(project: str) -> list[dict]:
-    """Execute the BigQuery script and return all rows from the last SELECT."""
-    client = bigquery.Client(project=project)
-    sql = load_sql()
-    query_job = client.query(sql)
-    rows = list(query_job.result())
-    return [dict(row.items()) for row in rows]
+def run_incremental(project: str) -> pd.DataFrame:
+    """Append newly closed hours to the hourly counts table, then run the report on it."""
+    append_hourly_counts(project)
+    return run_query(project, INCREMENTAL_REPORT_SQL)
+
+
+def run_local(project: str) -> pd.DataFrame:
+    """
+    Append closed hours, move the persisted baseline state to today reading only the days it
+    adds or drops, then compute the report locally: the baseline is a lookup in the state,
+    today's hours are the closed rows read plus the open hour.
+    """
+    from datetime import datetime, timedelta
+    from zoneinfo import ZoneInfo
+
+    append_hourly_counts(project)
+    run_dt = datetime.now(ZoneInfo("America/Los_Angeles")).date()
+    state = BaselineState.load()
+    days = state.days_to_read(run_dt)
+    closed = None
+    if days is not None:
+        # Only the days entering (from the restated newest one) and leaving the window, plus run_dt
+        closed = load_hourly_count_days(query_runner(project), days + [(run_dt, run_dt + timedelta(days=1))])
+    if closed is None or not state.covers(closed, run_dt):
+        # Rebuild: the whole window, through the local counts cache
+        closed = load_hourly_counts(query_runner(project), window_start(run_dt), run_dt)
+    state.advance(closed, run_dt)
+    state.save()
+    print(f"Baseline state: {state.summary()}", file=sys.stderr)
+
+    live = run_query(project, HOURLY_COUNTS_LIVE_SQL).reindex(columns=closed.columns)
+    counts = pd.concat([closed, normalize_counts(live)], ignore_index=True) if len(live) else closed
+    today = counts.loc[counts["trans_dt"] == pd.Timestamp(run_dt)]
+    chg = state.chg_chk(hourly_volume(usable_counts(today, state.excluded_dts), [run_dt]))
+    return report_from_chg(chg, today)
 
 
 def format_body_from_df(df: pd.DataFrame, max_rows: int) -> str:
@@ -114,6 +238,50 @@ def format_body_from_df(df: pd.DataFrame, max_rows: int) -> str:
     )
 
 
+def format_alert_body(changes: dict, max_rows: int) -> str:
+    """HTML email body for alert transitions: a table each for new, escalating and resolved alerts."""
+    from datetime import datetime
+
+    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    sections = []
+    for transition in TRANSITIONS:
+        entries = changes[transition]
+        if not entries:
+            continue
+        df = pd.DataFrame(entries)
+        lead = [c for c in ("geo", "BIN", "flag") if c in df.columns]
+        df = df[lead + [c for c in df.columns if c not in lead]]
+        n = len(df)
+        row_cap = f" (first {min(max_rows, n)} of {n})" if n > max_rows else ""
+        sections.append(
+            f"<h3>{transition.capitalize()}: {n}{row_cap}</h3>"
+            "<div style=\"overflow-x: auto;\">" + df.head(max_rows).to_html(index=False, escape=True) + "</div>"
+        )
+    ongoing = len(changes["repeat"])
+    return (
+        "<!DOCTYPE html><html><head><meta charset=\"utf-8\">"
+        "<style>"
+        "table { border-collapse: collapse; border: 1px solid #ccc; width: 100%; font-size: 14px; }"
+        "th, td { border: 1px solid #ccc; padding: 6px 8px; text-align: left; }"
+        "th { background: #eee; }"
+        "</style></head><body>"
+        "<p><b>Hourly BIN anomaly check</b> — " + ts + "</p>"
+        + "".join(sections)
+        + f"<p>Still active, already reported: {ongoing}</p>"
+        "</body></html>"
+    )
+
+
+def alert_changes_frame(changes: dict) -> pd.DataFrame:
+    """New, escalating and resolved alerts as one table (alert, geo, BIN, flag first), for the suite digest."""
+    frames = [pd.DataFrame(changes[t]).assign(alert=t) for t in TRANSITIONS if changes[t]]
+    if not frames:
+        return pd.DataFrame(columns=["alert", "geo", "BIN", "flag"])
+    df = pd.concat(frames, ignore_index=True)
+    lead = [c for c in ("alert", "geo", "BIN", "flag") if c in df.columns]
+    return df[lead + [c for c in df.columns if c not in lead]]
+
+
 def _ascii_safe(s: str) -> str:
     """Replace common non-ASCII chars with ASCII equivalents for SMTP-safe content."""
     return (
@@ -125,12 +293,8 @@ def _ascii_safe(s: str) -> str:
     )
 
 
-def send_email(subject: str, body: str, *, html: bool = False) -> None:
-    """Send email to the Slack channel address via SMTP (plain text or HTML)."""
-    subject = _ascii_safe(subject)
-    if not html:
-        body = _ascii_safe(body)
-
+def _smtp_settings() -> dict:
+    """SMTP connection settings from the environment (raises ValueError if any is missing)."""
     host = os.environ.get("SMTP_HOST")
     port = os.environ.get("SMTP_PORT")
     user = os.environ.get("SMTP_USER")
@@ -149,8 +313,54 @@ def send_email(subject: str, body: str, *, html: bool = False) -> None:
     ]:
         if not var:
             raise ValueError(f"Missing required env var: {name}")
+    return {"host": host, "port": int(port), "user": user, "from_addr": from_addr, "password": password}
 
-    port = int(port)
+
+class SmtpSession:
+    """
+    One SMTP connection (STARTTLS + login) reused across sends (--daemon). Checked with
+    NOOP before each send and re-opened if the server dropped it in the meantime.
+    """
+
+    def __init__(self) -> None:
+        self._server: smtplib.SMTP | None = None
+        self._key: tuple | None = None
+        self.connects = 0
+
+    def _alive(self) -> bool:
+        try:
+            return self._server is not None and self._server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def server(self, settings: dict) -> smtplib.SMTP:
+        key = (settings["host"], settings["port"], settings["user"])
+        if key != self._key or not self._alive():
+            self.close()
+            server = smtplib.SMTP(settings["host"], settings["port"])
+            server.starttls()
+            server.login(settings["user"], settings["password"])
+            self._server, self._key = server, key
+            self.connects += 1
+        return self._server
+
+    def close(self) -> None:
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+        self._server, self._key = None, None
+
+
+def send_email(subject: str, body: str, *, html: bool = False, session: SmtpSession | None = None) -> None:
+    """Send email to the Slack channel address via SMTP (plain text or HTML), optionally over a reused session."""
+    subject = _ascii_safe(subject)
+    if not html:
+        body = _ascii_safe(body)
+
+    settings = _smtp_settings()
+    from_addr = settings["from_addr"]
     subtype = "html" if html else "plain"
     msg = MIMEText(body, subtype, "utf-8")
     msg["Subject"] = subject
@@ -165,21 +375,31 @@ def send_email(subject: str, body: str, *, html: bool = False) -> None:
         msg_str = msg_str.encode("ascii", "replace").decode("ascii")
     msg_bytes = msg_str.encode("utf-8")
 
-    with smtplib.SMTP(host, port) as server:
+    if session is not None:
+        session.server(settings).sendmail(from_addr, [SLACK_CHANNEL_EMAIL], msg_bytes)
+        return
+    with smtplib.SMTP(settings["host"], settings["port"]) as server:
         server.starttls()
-        server.login(user, password)
+        server.login(settings["user"], settings["password"])
         server.sendmail(from_addr, [SLACK_CHANNEL_EMAIL], msg_bytes)
 
 
-def main() -> int:
-    from datetime import datetime
+def hourly_report_rows(args: argparse.Namespace, project: str) -> pd.DataFrame:
+    """The hourly BIN report in the mode chosen on the command line."""
+    if args.engine == "local":
+        return run_local(project)
+    if args.incremental:
+        return run_incremental(project)
+    return run_query(project)
 
-    project = os.environ.get("BIGQUERY_PROJECT", "i-dss-streaming-data")
-    max_rows = int(os.environ.get("EMAIL_MAX_ROWS", "25"))
+
+def run_check(args: argparse.Namespace, project: str, max_rows: int, session: SmtpSession | None = None) -> int:
+    """One anomaly check: run the report and email it (or the error). Returns the exit code."""
+    from datetime import datetime
 
     try:
         print("Running query...", file=sys.stderr)
-        rows = run_query(project)
+        rows = hourly_report_rows(args, project)
         print(f"Query returned {len(rows)} rows.", file=sys.stderr)
     except Exception as e:
         print(f"BigQuery error: {e}", file=sys.stderr)
@@ -187,12 +407,20 @@ def main() -> int:
             send_email(
                 f"DOW hourly run failed: {str(e)[:80]}",
                 f"DOW hourly anomaly check failed at {datetime.now().isoformat()}\n\n{type(e).__name__}: {e}",
+                session=session,
             )
         except Exception as send_err:
             print(f"Failed to send error email: {send_err}", file=sys.stderr)
         return 1
 
-    df = pd.DataFrame(rows)
+    if args.no_dedup:
+        return email_report(rows, max_rows, session)
+    return email_alert_changes(rows, max_rows, session)
+
+
+def email_report(df: pd.DataFrame, max_rows: int, session: SmtpSession | None = None) -> int:
+    """Email the full report table (--no-dedup)."""
+    from datetime import datetime
 
     ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     if len(df) == 0:
@@ -203,7 +431,7 @@ def main() -> int:
     print("Drafting email...", file=sys.stderr)
     body = format_body_from_df(df, max_rows)
     try:
-        send_email(subject, body, html=True)
+        send_email(subject, body, html=True, session=session)
         print("Email sent.", file=sys.stderr)
     except Exception as e:
         print(f"SMTP error: {e}", file=sys.stderr)
@@ -212,5 +440,147 @@ def main() -> int:
     return 0
 
 
+def alert_changes(store: AlertStore, rows: pd.DataFrame) -> dict:
+    """store.diff() of the report, with the transition counts logged."""
+    changes = store.diff(rows)
+    counts = ", ".join(f"{len(changes[t])} {t}" for t in TRANSITIONS + ("repeat",))
+    print(f"Alerts: {counts}", file=sys.stderr)
+    return changes
+
+
+def email_alert_changes(rows: pd.DataFrame, max_rows: int, session: SmtpSession | None = None) -> int:
+    """
+    Compare the report with the alert state and email only new / escalating / resolved alerts;
+    nothing is sent when no alert changed. The state is updated once the email went out.
+    """
+    from datetime import datetime
+
+    store = AlertStore()
+    try:
+        changes = alert_changes(store, rows)
+        if not any(changes[t] for t in TRANSITIONS):
+            store.apply(changes)
+            print("No alert changes; email not sent.", file=sys.stderr)
+            return 0
+
+        ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        subject = "Hourly BIN alerts: " + ", ".join(f"{len(changes[t])} {t}" for t in TRANSITIONS if changes[t]) + f" — {ts}"
+        print("Drafting email...", file=sys.stderr)
+        try:
+            send_email(subject, format_alert_body(changes, max_rows), html=True, session=session)
+            print("Email sent.", file=sys.stderr)
+        except Exception as e:
+            print(f"SMTP error: {e}", file=sys.stderr)
+            return 1
+        store.apply(changes)
+        print(f"Alert state: {store.summary()}", file=sys.stderr)
+    finally:
+        store.close()
+    return 0
+
+
+def run_suite_check(args: argparse.Namespace, project: str, max_rows: int, session: SmtpSession | None = None) -> int:
+    """
+    All checks of the --suite manifest, run concurrently and emailed as one digest.
+    The hourly_report builtin is de-duplicated like the single check: its section lists only
+    new / escalating / resolved alerts, and the alert state is updated once the digest went
+    out (--no-dedup: the full report table). Returns 1 if any check failed or the email
+    could not be sent.
+    """
+    checks = load_manifest(args.suite)
+    store = None if args.no_dedup else AlertStore()
+    pending: dict = {}
+
+    def hourly_report() -> pd.DataFrame:
+        rows = hourly_report_rows(args, project)
+        if store is None:
+            return rows
+        pending["changes"] = changes = alert_changes(store, rows)
+        return alert_changes_frame(changes)
+
+    try:
+        print(f"Running {len(checks)} checks...", file=sys.stderr)
+        results = run_suite(checks, query_runner(project), {"hourly_report": hourly_report})
+        print("Drafting email...", file=sys.stderr)
+        try:
+            send_email(suite_subject(results), format_suite_body(results, max_rows), html=True, session=session)
+            print("Email sent.", file=sys.stderr)
+        except Exception as e:
+            print(f"SMTP error: {e}", file=sys.stderr)
+            return 1
+        if "changes" in pending:
+            store.apply(pending["changes"])
+            print(f"Alert state: {store.summary()}", file=sys.stderr)
+    finally:
+        if store is not None:
+            store.close()
+    return 0 if all(r.ok for r in results) else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Hourly DOW/BIN anomaly check, emailed to Slack.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Append closed hours to the hourly counts table and report from it instead of rescanning 3 months",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=("bigquery", "local"),
+        default="bigquery",
+        help="local: compute baselines and z-scores with pandas from cached hourly counts (implies --incremental)",
+    )
+    parser.add_argument(
+        "--no-dedup",
+        action="store_true",
+        help="Email the full report every run instead of only new / escalating / resolved alerts",
+    )
+    parser.add_argument(
+        "--suite",
+        nargs="?",
+        const=str(SUITE_MANIFEST),
+        metavar="MANIFEST",
+        help="Run every check of a TOML manifest (default scripts/anomaly_checks.toml) concurrently and email one digest",
+    )
+    parser.add_argument("--daemon", action="store_true", help="Stay running and check on a schedule (default :10 hourly)")
+    parser.add_argument("--at-minute", type=int, default=10, help="--daemon: minute past the hour of the first run (default 10)")
+    parser.add_argument("--every", type=int, default=60, metavar="MINUTES", help="--daemon: minutes between runs (default 60)")
+    parser.add_argument("--run-now", action="store_true", help="--daemon: also run once at startup")
+    parser.add_argument("--status", action="store_true", help="Print the daemon's last-run status and exit (1 if it failed)")
+    args = parser.parse_args()
+
+    if args.status:
+        status = read_status()
+        if status is None:
+            print(f"No daemon status at {STATUS_PATH}", file=sys.stderr)
+            return 1
+        print(json.dumps(status, indent=2))
+        last = status.get("last_run") or {}
+        return 1 if last.get("exit_code") else 0
+
+    project = os.environ.get("BIGQUERY_PROJECT", "i-dss-streaming-data")
+    max_rows = int(os.environ.get("EMAIL_MAX_ROWS", "25"))
+
+    check = run_suite_check if args.suite else run_check
+    if args.suite:
+        load_manifest(args.suite)  # fail fast on a bad manifest
+    if not args.daemon:
+        return check(args, project, max_rows)
+
+    session = SmtpSession()
+    scheduler = HourlyScheduler(
+        lambda: check(args, project, max_rows, session),
+        minute=args.at_minute,
+        every_minutes=args.every,
+        run_now=args.run_now,
+    )
+    scheduler.install_signal_handlers()
+    try:
+        return scheduler.run_forever()
+    finally:
+        session.close()
+        print(f"Daemon stopped ({scheduler.status['runs']} runs, {session.connects} SMTP logins).", file=sys.stderr)
+
+
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+Checks of bq_dry_run.py and the QueryRunner byte cap against a mocked bigquery.Client.
+
+  python -m unittest discover -s scripts -p "test_*.py"
+"""
+
+from __future__ import annotations
+
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from google.cloud import bigquery
+
+import bq_dry_run
+import bq_query_runner
+
+SQL = """
+select trans_dt, count(*) as ct
+from `i-dss-streaming-data.payment_ops_vw.recurly_transactions_fct`
+where trans_dt between @run_range_start and @run_range_end
+group by 1
+"""
+PARAMS = {"run_range_start": "2026-10-01", "run_range_end": "2026-10-14"}
+TABLE = "i-dss-streaming-data.payment_ops_vw.recurly_transactions_fct"
+
+
+def dry_run_job(total: int, referenced=()) -> mock.Mock:
+    return mock.Mock(total_bytes_processed=total, statement_type="SELECT", referenced_tables=list(referenced))
+
+
+def table(num_bytes: int = 10 * 1024 ** 4) -> mock.Mock:
+    return mock.Mock(
+        table_type="TABLE",
+        num_bytes=num_bytes,
+        num_rows=1000,
+        time_partitioning=mock.Mock(type_="DAY", field="trans_dt"),
+        range_partitioning=None,
+        require_partition_filter=True,
+        clustering_fields=["src_system_id"],
+    )
+
+
+class EstimateTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.sql_path = Path(tmp.name) / "example.sql"
+        self.sql_path.write_text(SQL)
+        self.client = mock.Mock(spec=bigquery.Client)
+        self.client.get_table.return_value = table()
+
+    def test_sends_uncached_dry_run_with_query_parameters(self) -> None:
+        self.client.query.return_value = dry_run_job(1024 ** 3)
+        bq_dry_run.estimate(self.client, str(self.sql_path), PARAMS)
+
+        (sql,), kwargs = self.client.query.call_args
+        config = kwargs["job_config"]
+        self.assertEqual(sql, SQL)
+        self.assertIs(config.dry_run, True)
+        self.assertIs(config.use_query_cache, False)
+        self.assertEqual(
+            [p.to_api_repr() for p in config.query_parameters],
+            [p.to_api_repr() for p in bq_query_runner.query_parameters(SQL, PARAMS)],
+        )
+
+    def test_over_cap(self) -> None:
+        self.client.query.return_value = dry_run_job(3 * 1024 ** 4)
+        self.assertTrue(bq_dry_run.estimate(self.client, str(self.sql_path), PARAMS, 2 * 1024 ** 4)["over_cap"])
+        self.assertFalse(bq_dry_run.estimate(self.client, str(self.sql_path), PARAMS, 4 * 1024 ** 4)["over_cap"])
+        self.assertFalse(bq_dry_run.estimate(self.client, str(self.sql_path), PARAMS, None)["over_cap"])
+
+    def test_cost_from_bytes_processed(self) -> None:
+        self.client.query.return_value = dry_run_job(1024 ** 4)
+        result = bq_dry_run.estimate(self.client, str(self.sql_path), PARAMS)
+        self.assertEqual(result["bytes_processed"], 1024 ** 4)
+        self.assertEqual(result["est_cost_usd"], bq_dry_run.ON_DEMAND_USD_PER_TIB)
+
+    def test_tables_from_job(self) -> None:
+        ref = mock.Mock(project="p", dataset_id="d", table_id="t")
+        self.client.query.return_value = dry_run_job(1, [ref])
+        result = bq_dry_run.estimate(self.client, str(self.sql_path), PARAMS)
+        self.assertEqual([t["table"] for t in result["tables"]], ["p.d.t"])
+
+    def test_tables_parsed_from_sql_when_job_reports_none(self) -> None:
+        self.client.query.return_value = dry_run_job(1)
+        result = bq_dry_run.estimate(self.client, str(self.sql_path), PARAMS)
+        self.client.get_table.assert_called_once_with(TABLE)
+        info = result["tables"][0]
+        self.assertEqual(info["table"], TABLE)
+        self.assertEqual(info["partitioning"], "DAY on trans_dt")
+        self.assertEqual(info["clustering"], ["src_system_id"])
+
+    def test_unreadable_table_is_an_error_entry(self) -> None:
+        self.client.query.return_value = dry_run_job(1)
+        self.client.get_table.side_effect = PermissionError("403 Access Denied")
+        result = bq_dry_run.estimate(self.client, str(self.sql_path), PARAMS)
+        self.assertEqual(result["tables"], [{"table": TABLE, "error": "PermissionError: 403 Access Denied"}])
+        self.assertIn("PermissionError", bq_dry_run.format_estimate(result))
+
+
+class QueryRunnerCapTest(unittest.TestCase):
+    def test_passes_maximum_bytes_billed(self) -> None:
+        client = mock.Mock(spec=bigquery.Client)
+        client.query.return_value = mock.Mock(total_bytes_processed=1, cache_hit=False)
+        runner = bq_query_runner.QueryRunner(client, use_cache=False, fetch=bq_query_runner.FETCH_REST,
+                                             max_bytes_billed=500 * 1024 ** 3)
+        with mock.patch.object(bq_query_runner, "record_job"), \
+                mock.patch.object(bq_query_runner, "result_frame", return_value=(None, bq_query_runner.FETCH_REST)):
+            runner.execute("select 1", [])
+        config = client.query.call_args.kwargs["job_config"]
+        self.assertEqual(config.maximum_bytes_billed, 500 * 1024 ** 3)
+
+    def test_job_over_cap_is_recorded(self) -> None:
+        client = mock.Mock(spec=bigquery.Client)
+        job = client.query.return_value
+        job.result.side_effect = RuntimeError("Query exceeded limit for bytes billed")
+        runner = bq_query_runner.QueryRunner(client, use_cache=False, max_bytes_billed=1)
+        with mock.patch.object(bq_query_runner, "record_job") as record:
+            with self.assertRaises(RuntimeError):
+                runner.execute("select 1", [], "capped.sql")
+        record.assert_called_once_with(job, "capped.sql", client=client)
+
+
+if __name__ == "__main__":
+    unittest.main()